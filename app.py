@@ -4,7 +4,6 @@ from modules.user import (
     login_user as login_user_func,
     register_user,
     get_current_user,
-    init_user_db,
     update_display_name,
     update_kari_id,
     get_display_name,
@@ -12,11 +11,10 @@ from modules.user import (
 )
 from modules import board, karitunagari, chatkai, chatkai2, profilepagev2
 from modules.utils import now_str
+from modules.migrations import ensure_schema
 
-# --- 初期設定 ---
-if "db_initialized" not in st.session_state:
-    init_user_db()
-    st.session_state.db_initialized = True
+# --- 初期設定（スキーマ移行はプロセスごとに1回だけ） ---
+ensure_schema()
 
 # --- ダークモードCSS ---
 st.markdown("""
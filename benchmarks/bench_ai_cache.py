@@ -0,0 +1,70 @@
+# bench_ai_cache.py
+# AI応答キャッシュの効き具合：スタンプ・挨拶が多い送信列を流し、モデルの呼び出し回数・ヒット率・所要時間を
+# キャッシュなし／ありで比較する。chat.py と chatkai.py の利用者を半々にする（文脈はどちらも aicontext が作る）。
+# ローカルの OpenAI 互換サーバーを相手にする。openai パッケージが必要。
+#
+#   python -m benchmarks.bench_ai_cache [利用者数] [1人あたりの送信数] [応答の遅延秒]
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_openai import serve_in_thread
+from modules import aicache, aiworker, db, migrations
+from modules.chatstore import save_message
+
+STAMPS = ["😀", "😂", "❤️", "👍", "😢", "🎉", "🔥", "🤔"]
+GREETINGS = ["こんにちは", "おはよう", "こんばんは", "ありがとう", "おやすみ"]
+SHORT_RATIO = 0.7      # スタンプ・挨拶の割合（残りは毎回違う文）
+
+
+def workload(n_users, per_user, seed=1):
+    rng = random.Random(seed)
+    sends = []
+    for i in range(n_users):
+        style = "chat" if i % 2 else "chatkai"
+        for j in range(per_user):
+            text = (rng.choice(STAMPS + GREETINGS) if rng.random() < SHORT_RATIO
+                    else f"今日は{i}番目の利用者として{j}回目の話をします。最近あった出来事について聞いてください。")
+            sends.append((f"user{i}", style, text))
+    rng.shuffle(sends)
+    return sends
+
+
+def run(sends, enabled, server):
+    aicache.CACHE_ENABLED = enabled
+    aicache._counts.update(hits=0, misses=0, bypassed=0, saved_ms=0)
+    calls_before = server.RequestHandlerClass.calls
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_all()
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        migrations.migrate()
+        start = time.perf_counter()
+        for user, style, text in sends:
+            save_message(user, aiworker.AI_NAME, text)
+            aiworker.enqueue_reply(user, style)
+            aiworker.run_job(aiworker.claim_job())
+        elapsed = time.perf_counter() - start
+        db.close_all()
+    return elapsed, server.RequestHandlerClass.calls - calls_before, aicache.cache_stats()
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+    server, base_url = serve_in_thread(delay=delay, chunk_delay=0)
+    os.environ.update(OPENAI_BASE_URL=base_url, OPENAI_API_KEY="dummy")
+    aiworker.STREAM = False
+    sends = workload(n_users, per_user)
+    print(f"sends={len(sends)} short_ratio={SHORT_RATIO} model_delay={delay}s")
+    for label, enabled in (("no cache", False), ("response cache", True)):
+        elapsed, calls, stats = run(sends, enabled, server)
+        print(f"{label:<16} model calls {calls:4d}   {elapsed:6.2f} s   "
+              f"hit rate {stats['hit_rate']:5.1%} (bypassed {stats['bypassed']})   saved {stats['saved_ms'] / 1000:5.2f} s")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
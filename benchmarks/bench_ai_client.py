@@ -0,0 +1,87 @@
+# bench_ai_client.py
+# modules.aiclient の効果をローカルの OpenAI 互換サーバー相手に確かめる。openai パッケージが必要。
+#   1. keep-alive：呼び出しごとにクライアントと接続を作る場合と、共有クライアントで使い回す場合の1件あたりの時間
+#   2. 再試行：一定割合で 503 を返す上流に対し、再試行なしと再試行ありの成功率
+#   3. 遮断：上流が落ちているときの1件あたりの失敗までの時間（ブレーカーなし／あり）
+# 呼び出しの記録（ai_calls）は一時DBに書く。1 の比較は記録を外した時間と、記録込みの時間を並べる。
+#
+#   python -m benchmarks.bench_ai_client [件数] [失敗率]
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+import openai
+
+from benchmarks.fake_openai import serve_in_thread
+from modules import aiclient, aimetrics, db, migrations
+
+MESSAGES = [{"role": "user", "content": "こんにちは"}]
+
+
+def per_call_ms(n, call):
+    start = time.perf_counter()
+    ok = 0
+    for _ in range(n):
+        try:
+            call()
+            ok += 1
+        except Exception:
+            pass
+    return (time.perf_counter() - start) / n * 1000, ok
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    fail_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_all()
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        migrations.migrate()
+        run(n, fail_rate)
+        print(f"recorded calls: {db.query_one('SELECT COUNT(*) FROM ai_calls')[0]}")
+        db.close_all()
+
+
+def run(n, fail_rate):
+    aiclient.bucket = aiclient.TokenBucket(rate=10_000, burst=10_000)   # 計測では流量制限を外す
+    aiclient.BACKOFF_BASE = 0.01
+
+    server, base_url = serve_in_thread(delay=0, chunk_delay=0)
+    os.environ.update(OPENAI_BASE_URL=base_url, OPENAI_API_KEY="dummy")
+    print(f"calls={n}")
+    fresh = lambda: openai.OpenAI(max_retries=0, http_client=openai.DefaultHttpxClient(
+        limits=httpx.Limits(max_keepalive_connections=0))).chat.completions.create(model="m", messages=MESSAGES)
+    ms, _ = per_call_ms(n, fresh)
+    print(f"{'new client+connection per call':<32} {ms:7.2f} ms/call")
+    record_call, aimetrics.record_call = aimetrics.record_call, lambda *args, **kwargs: None
+    ms, _ = per_call_ms(n, lambda: aiclient.chat_completion(MESSAGES, model="m"))
+    print(f"{'shared keep-alive client':<32} {ms:7.2f} ms/call")
+    aimetrics.record_call = record_call
+    ms, _ = per_call_ms(n, lambda: aiclient.chat_completion(MESSAGES, model="m"))
+    print(f"{'  + ai_calls record':<32} {ms:7.2f} ms/call")
+    server.shutdown()
+
+    server, base_url = serve_in_thread(delay=0, chunk_delay=0, fail_rate=fail_rate)
+    aiclient._client = None
+    os.environ["OPENAI_BASE_URL"] = base_url
+    aiclient.breaker = aiclient.CircuitBreaker(threshold=10 ** 9, cooldown=0)
+    print(f"upstream fail rate={fail_rate}")
+    for retries in (0, aiclient.MAX_RETRIES):
+        _, ok = per_call_ms(n, lambda: aiclient.chat_completion(MESSAGES, model="m", retries=retries))
+        print(f"{f'retries={retries}':<32} {ok / n:7.1%} succeeded")
+    server.shutdown()
+
+    aiclient._client = None
+    os.environ["OPENAI_BASE_URL"] = "http://127.0.0.1:9/v1"   # 誰も待っていないポート
+    print("upstream down")
+    for label, breaker in (("no breaker", aiclient.CircuitBreaker(10 ** 9, 0)),
+                           ("circuit breaker", aiclient.CircuitBreaker(aiclient.BREAKER_THRESHOLD, 60))):
+        aiclient.breaker = breaker
+        ms, _ = per_call_ms(n, lambda: aiclient.chat_completion(MESSAGES, model="m"))
+        print(f"{label:<32} {ms:7.2f} ms/failed call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# bench_ai_context.py
+# AIに渡す文脈の大きさを会話の長さごとに比べる（トークン数は aicontext.estimate_tokens の見積もり）。
+# 旧方式：chatkai.py は全履歴を読んで直近5件を全部 user として渡していた。
+# 新方式：role を付け、予算に収まらない古い分は要約に畳み込む。要約の生成はローカルの OpenAI 互換サーバーが受ける。
+# openai パッケージが必要。
+#
+#   python -m benchmarks.bench_ai_context [最大メッセージ数] [トークン予算]
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_openai import serve_in_thread
+from modules import aicontext, db, migrations
+from modules.chatstore import save_message, get_messages
+
+USER, AI = "alice", "AIアシスタント"
+SYSTEM = "あなたは親切な日本語のチャットAIです。"
+TEXTS = ["最近は雨の日が多くて散歩に行けないのが悩みです", "それは残念ですね。室内でできることはありますか？",
+         "週末に美術館へ行ったら思ったより楽しかった", "素敵ですね！どんな作品が印象に残りましたか？"]
+
+
+def prompt_tokens(messages):
+    return sum(aicontext._cost(m) for m in messages)
+
+
+def main():
+    n_max = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    budget = int(sys.argv[2]) if len(sys.argv) > 2 else aicontext.CONTEXT_TOKEN_BUDGET
+    server, base_url = serve_in_thread(delay=0, chunk_delay=0)
+    os.environ.update(OPENAI_BASE_URL=base_url, OPENAI_API_KEY="dummy")
+    checkpoints = {10, 50, 100, 500, n_max}
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_all()
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        migrations.migrate()
+        print(f"budget={budget} tokens")
+        print(f"{'messages':>8} | {'old: rows read':>14} {'tokens':>7} | {'new: tokens':>11} {'build ms':>8} {'summary calls':>13}")
+        for i in range(1, n_max + 1):
+            sender, receiver = (USER, AI) if i % 2 else (AI, USER)
+            save_message(sender, receiver, TEXTS[i % len(TEXTS)])
+            start = time.perf_counter()
+            context = aicontext.build_context(USER, AI, SYSTEM, budget=budget)
+            build_ms = (time.perf_counter() - start) * 1000
+            if i in checkpoints:
+                history = get_messages(USER, AI)
+                old = [{"role": "system", "content": SYSTEM}] + [{"role": "user", "content": m} for _, _, m, _ in history[-5:]]
+                print(f"{i:>8} | {len(history):>14} {prompt_tokens(old):>7} | {prompt_tokens(context):>11} "
+                      f"{build_ms:>8.1f} {server.RequestHandlerClass.calls:>13}")
+        db.close_all()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# bench_ai_metrics.py
+# モデル呼び出しの記録（ai_calls への1行追加）が1呼び出しに足す時間と、
+# 利用者・日・モデルごとの集計（p50/p95/p99 を含む）にかかる時間を、記録の件数ごとに測る。
+#
+#   python -m benchmarks.bench_ai_metrics [記録件数] [利用者数]
+import os
+import random
+import sys
+import tempfile
+import time
+
+from modules import aimetrics, db, migrations
+from modules.utils import now_epoch, day_start
+
+MODELS = ["gpt-5-nano", "gpt-5-nano", "gpt-5-nano", "gpt-3.5-turbo"]
+
+
+def build_db(n_calls, n_users, seed=1):
+    rng = random.Random(seed)
+    now = now_epoch()
+    rows = []
+    for _ in range(n_calls):
+        ts = now - rng.randrange(30 * 86400)
+        model = rng.choice(MODELS)
+        prompt, completion = rng.randrange(50, 1200), rng.randrange(10, 150)
+        outcome = aimetrics.OK if rng.random() > 0.02 else aimetrics.ERROR
+        rows.append((ts, day_start(ts), f"user{rng.randrange(n_users)}", "reply", model, outcome,
+                     rng.choice([0, 0, 0, 1]), int(rng.lognormvariate(6.5, 0.5)), prompt, completion,
+                     aimetrics.call_cost(model, prompt, completion)))
+    with db.transaction() as c:
+        c.executemany('''INSERT INTO ai_calls (ts, day, user, purpose, model, outcome, retries, latency_ms,
+                                               prompt_tokens, completion_tokens, cost_usd)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+
+
+def main():
+    n_calls = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_users = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_all()
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        migrations.migrate()
+        build_db(n_calls, n_users)
+        print(f"calls={n_calls} users={n_users}")
+
+        repeat = 1000
+        start = time.perf_counter()
+        for _ in range(repeat):
+            aimetrics.record_call("gpt-5-nano", "reply", "user0", aimetrics.OK, 650, ttft_ms=300,
+                                  prompt_tokens=800, completion_tokens=120)
+        print(f"{'record_call':<24} {(time.perf_counter() - start) / repeat * 1000:8.3f} ms/call")
+        for group_by in ("day", "model", "user"):
+            start = time.perf_counter()
+            report = aimetrics.usage_report(group_by)
+            elapsed = (time.perf_counter() - start) * 1000
+            top = report[0]
+            print(f"{'usage_report ' + group_by:<24} {elapsed:8.1f} ms  groups={len(report):<4} "
+                  f"top={top['key']} p50/p95/p99={top['p50_ms']}/{top['p95_ms']}/{top['p99_ms']} ms")
+        start = time.perf_counter()
+        aimetrics.daily_usage("user0")
+        print(f"{'daily_usage':<24} {(time.perf_counter() - start) * 1000:8.3f} ms")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
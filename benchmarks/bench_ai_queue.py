@@ -0,0 +1,59 @@
+# bench_ai_queue.py
+# AIチャットの送信処理で画面が止まる時間を比較する（ローカルの OpenAI 互換サーバーを相手にする）。
+# 旧方式：送信のたびに保存 → モデル呼び出し → 応答保存を画面の処理内で行う。
+# 新方式：保存してジョブを積むだけ。応答はワーカースレッドが並行して保存する。
+# openai パッケージが必要。
+#
+#   python -m benchmarks.bench_ai_queue [利用者数] [応答の遅延秒] [ワーカー数]
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_openai import serve_in_thread
+from modules import aicache, aiworker, db, migrations
+from modules.chatstore import save_message
+
+
+def reply_count():
+    return db.query_one("SELECT COUNT(*) FROM chat_messages WHERE sender=?", (aiworker.AI_NAME,))[0]
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else aiworker.MAX_WORKERS
+    server, base_url = serve_in_thread(delay=delay)
+    os.environ.update(OPENAI_BASE_URL=base_url, OPENAI_API_KEY="dummy")
+    aicache.CACHE_ENABLED = False     # 同じ文脈が続くので、キャッシュを切ってモデルの往復そのものを測る
+    users = [f"user{i}" for i in range(n_users)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_all()
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        migrations.migrate()
+        print(f"users={n_users} model_delay={delay}s workers={workers}")
+
+        start = time.perf_counter()
+        for user in users:
+            save_message(user, aiworker.AI_NAME, "こんにちは")
+            save_message(aiworker.AI_NAME, user, aiworker.generate_reply(aiworker.REQUESTS["chatkai"](user)))
+        elapsed = time.perf_counter() - start
+        print(f"{'inline (old)':<22} blocked {elapsed / n_users * 1000:9.1f} ms/send   all replies {elapsed:6.2f} s")
+
+        before = reply_count()
+        aiworker.start_workers(workers)
+        start = time.perf_counter()
+        for user in users:
+            save_message(user, aiworker.AI_NAME, "こんにちは")
+            aiworker.enqueue_reply(user, "chatkai")
+        blocked = time.perf_counter() - start
+        while reply_count() < before + n_users:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        print(f"{'queued + workers':<22} blocked {blocked / n_users * 1000:9.1f} ms/send   all replies {elapsed:6.2f} s")
+        db.close_all()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
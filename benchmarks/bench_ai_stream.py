@@ -0,0 +1,65 @@
+# bench_ai_stream.py
+# AI応答が画面に出始めるまでの時間を、応答を最後まで待つ方式とストリーミングで比較する。
+# 画面と同じく DB を一定間隔で読み、途中の本文（ai_jobs.partial_reply）か確定したメッセージが
+# 見えた時刻を測る。ローカルの OpenAI 互換サーバーを相手にする。openai パッケージが必要。
+#
+#   python -m benchmarks.bench_ai_stream [件数] [最初のチャンクまでの秒数] [チャンク間の秒数]
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fake_openai import serve_in_thread
+from modules import aicache, aiworker, db, migrations
+from modules.chatstore import save_message
+
+POLL = 0.01
+
+
+def reply_count(user):
+    return db.query_one("SELECT COUNT(*) FROM chat_messages WHERE sender=? AND receiver=?", (aiworker.AI_NAME, user))[0]
+
+
+# 1件分: (最初に何か見えるまで, 確定するまで) の秒数
+def measure(user):
+    before = reply_count(user)
+    save_message(user, aiworker.AI_NAME, "今日はどんな一日だった？")
+    aiworker.enqueue_reply(user, "chatkai")
+    start = time.perf_counter()
+    first_visible = None
+    while reply_count(user) == before:
+        if first_visible is None and aiworker.streaming_reply(user):
+            first_visible = time.perf_counter() - start
+        time.sleep(POLL)
+    done = time.perf_counter() - start
+    return first_visible or done, done
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    chunk_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    server, base_url = serve_in_thread(delay=delay, chunk_delay=chunk_delay)
+    os.environ.update(OPENAI_BASE_URL=base_url, OPENAI_API_KEY="dummy")
+    aicache.CACHE_ENABLED = False     # 同じ文脈が続くので、キャッシュを切ってモデルの往復そのものを測る
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_all()
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        migrations.migrate()
+        aiworker.start_workers(1, stop=threading.Event())
+        print(f"replies={n} first_chunk={delay}s chunk_delay={chunk_delay}s")
+        for label, stream in (("wait for full reply", False), ("streaming", True)):
+            aiworker.STREAM = stream
+            results = [measure(f"{label}-user") for _ in range(n)]
+            print(f"{label:<20} first visible {statistics.median(r[0] for r in results) * 1000:7.0f} ms"
+                  f"   complete {statistics.median(r[1] for r in results) * 1000:7.0f} ms  (median)")
+        ttft = db.query("SELECT first_token_ms FROM ai_jobs WHERE user='streaming-user' AND status='done'")
+        print(f"logged ttft (streaming): {sorted(r[0] for r in ttft)} ms")
+        db.close_all()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# bench_board_search.py
+# 掲示板検索：旧来の title LIKE '%kw%'（タイトルのみ）／本文まで LIKE で探した場合／search_threads を比較する。
+# search_threads は3文字以上の語を FTS5 trigram、1〜2文字の語を MeCab の単語索引で引く。MeCab と unidic_lite が必要。
+#
+#   python -m benchmarks.bench_board_search [スレッド数] [1スレッドあたりの投稿数]
+import os
+import random
+import sys
+import tempfile
+import time
+
+from modules import board, db, migrations
+
+WORDS = ["猫", "犬", "ゲーム", "旅行", "音楽", "映画", "本", "カフェ", "学校", "仕事", "推し活", "料理",
+         "天気", "雨の日", "朝ごはん", "夜更かし", "ペット", "美術館", "スポーツ", "言葉", "最近", "楽しい",
+         "悩み", "散歩", "コーヒー", "紅茶", "アニメ", "写真", "電車", "休日"]
+# 実際の検索に近い「まれな語」（投稿の約0.1%に出現）と、ありふれた語の最悪ケース
+RARE_WORDS = ["プラネタリウム", "ボルダリング", "金木犀", "天体観測", "古本屋", "苔", "金魚"]
+COMMON_WORDS = ["雨の日", "コーヒー"]
+QUERIES = (("rare keywords", RARE_WORDS[:5]), ("common keywords", COMMON_WORDS),
+           ("rare 1-2 chars", RARE_WORDS[5:]), ("common 1-2 chars", ["猫", "本", "最近", "料理"]))
+
+
+def sentence(rng, n):
+    text = "".join(rng.choice(WORDS) + rng.choice(["が", "の", "で", "と", "を"]) for _ in range(n))
+    if rng.random() < 0.001:
+        text += rng.choice(RARE_WORDS)
+    return text
+
+
+def build_db(n_threads, posts_per_thread):
+    rng = random.Random(0)
+    with db.transaction() as c:
+        for tid in range(1, n_threads + 1):
+            c.execute("INSERT INTO threads (id, title, created_at, ts_epoch) VALUES (?, ?, '', 0)",
+                      (tid, sentence(rng, 3)))
+            c.executemany("INSERT INTO board_messages (username, message, timestamp, ts_epoch, thread_id) VALUES ('u', ?, '', 0, ?)",
+                          [(sentence(rng, 12), tid) for _ in range(posts_per_thread)])
+        # 単語索引は board.py が書き込み時に足すので、ここでも同じように足す
+        c.executemany("INSERT INTO threads_words (rowid, words) VALUES (?, ?)",
+                      [(tid, board.index_words(title)) for tid, title in c.execute("SELECT id, title FROM threads").fetchall()])
+        c.executemany("INSERT INTO board_messages_words (rowid, words) VALUES (?, ?)",
+                      [(mid, board.index_words(msg))
+                       for mid, msg in c.execute("SELECT id, message FROM board_messages").fetchall()])
+
+
+# 本文まで LIKE で探す（user-009 までの短い語の探し方。新しいスレッドから順に1ページ分）
+def like_title_and_posts(keyword, page_size=20):
+    return db.query(f'''SELECT {board.THREAD_COLUMNS} FROM threads t
+                        LEFT JOIN thread_summaries s ON s.thread_id = t.id
+                        WHERE t.title LIKE ? OR EXISTS (SELECT 1 FROM board_messages b
+                                                        WHERE b.thread_id=t.id AND b.message LIKE ?)
+                        ORDER BY t.id DESC LIMIT ?''', (f"%{keyword}%", f"%{keyword}%", page_size))
+
+
+def timed(label, fn, keywords):
+    start = time.perf_counter()
+    hits = [len(fn(k)) for k in keywords]
+    print(f"  {label:<30} {(time.perf_counter() - start) / len(keywords) * 1000:9.2f} ms / query  hits={hits}")
+
+
+def main():
+    n_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    posts_per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_all()
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        migrations.migrate()
+        build_db(n_threads, posts_per_thread)
+        print(f"threads={n_threads} posts={n_threads * posts_per_thread}")
+        for name, keywords in QUERIES:
+            print(name)
+            # 旧実装はタイトルのみ・全件返却
+            timed("LIKE title (old)", lambda k: db.query(
+                "SELECT id, title, ts_epoch FROM threads WHERE title LIKE ? ORDER BY id DESC", (f"%{k}%",)), keywords)
+            timed("LIKE title+posts, page 1", like_title_and_posts, keywords)
+            timed("search_threads (new), page 1", lambda k: board.search_threads(k), keywords)
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench_chat_render.py
+# chatkai2 の1回の描画で発行されるDBアクセスを再現し、
+# 「呼び出しごとに sqlite3.connect」する旧方式と modules.db 経由を比較する。
+#
+#   python -m benchmarks.bench_chat_render [メッセージ数] [繰り返し回数]
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from modules import db
+
+USER, PARTNER = "alice", "bob"
+
+
+def build_db(path, n_messages):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("CREATE TABLE users (username TEXT PRIMARY KEY, password TEXT, display_name TEXT, kari_id TEXT, registered_at TEXT)")
+    c.execute("CREATE TABLE friends (user TEXT, friend TEXT, UNIQUE(user, friend))")
+    c.execute('''CREATE TABLE chat_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, sender TEXT, receiver TEXT,
+                 message TEXT, timestamp TEXT, message_type TEXT DEFAULT 'text', is_read INTEGER DEFAULT 0)''')
+    c.execute("CREATE TABLE message_reactions (message_id INTEGER, user TEXT, reaction TEXT, PRIMARY KEY (message_id, user))")
+    c.execute("CREATE TABLE feedback (sender TEXT, receiver TEXT, feedback TEXT, timestamp TEXT)")
+    c.executemany("INSERT INTO users VALUES (?, '', ?, '', '')", [(USER, "A"), (PARTNER, "B")])
+    c.executemany("INSERT INTO friends VALUES (?, ?)", [(USER, PARTNER), (PARTNER, USER)])
+    c.executemany(
+        "INSERT INTO chat_messages (sender, receiver, message, timestamp) VALUES (?, ?, ?, ?)",
+        [((USER, PARTNER) if i % 2 else (PARTNER, USER)) + (f"message {i}", f"2025-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}")
+         for i in range(n_messages)]
+    )
+    c.executemany("INSERT INTO message_reactions VALUES (?, ?, '👍')", [(i, USER) for i in range(1, n_messages, 3)])
+    conn.commit()
+    conn.close()
+
+
+# 1回の描画で発行されるクエリ（chatkai2.render の順）
+def render_queries(run):
+    run("SELECT display_name FROM users WHERE username=?", (USER,))
+    run("SELECT username FROM users ORDER BY username", ())
+    run("SELECT friend FROM friends WHERE user=?", (USER,))
+    run("SELECT COUNT(*) FROM chat_messages WHERE receiver=? AND sender=? AND is_read=0", (USER, PARTNER))
+    rows = run('''SELECT id, sender, message, message_type FROM chat_messages
+                  WHERE (sender=? AND receiver=?) OR (sender=? AND receiver=?)
+                  ORDER BY timestamp''', (USER, PARTNER, PARTNER, USER))
+    for msg_id, *_ in rows:
+        run("SELECT reaction, COUNT(*) FROM message_reactions WHERE message_id=? GROUP BY reaction", (msg_id,))
+    run("SELECT feedback, timestamp FROM feedback WHERE sender=? AND receiver=? ORDER BY timestamp DESC", (USER, PARTNER))
+
+
+def run_per_call_connect(path):
+    def run(sql, params):
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+    return run
+
+
+def run_pooled(sql, params):
+    return db.query(sql, params)
+
+
+def bench(label, run, repeat):
+    render_queries(run)  # ウォームアップ
+    start = time.perf_counter()
+    for _ in range(repeat):
+        render_queries(run)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed / repeat * 1000:8.2f} ms / render")
+    return elapsed
+
+
+def main():
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        build_db(path, n_messages)
+        db.close_all()
+        db.DB_PATH = path
+        print(f"messages={n_messages} repeat={repeat}")
+        before = bench("per-call connect", run_per_call_connect(path), repeat)
+        after = bench("modules.db (pooled)", run_pooled, repeat)
+        print(f"speedup: x{before / after:.1f}")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# bench_conversation_key.py
+# 数百万行の chat_messages で、旧来の OR 条件による履歴取得と
+# conversation_id による範囲走査を比較する（v5 マイグレーションの埋め戻し時間も計測）。
+#
+#   python -m benchmarks.bench_conversation_key [行数] [ユーザー数]
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from modules import db, migrations
+
+SCAN_QUERY = '''SELECT id, sender, message, message_type FROM chat_messages NOT INDEXED
+                WHERE (sender=? AND receiver=?) OR (sender=? AND receiver=?)
+                ORDER BY timestamp'''
+OLD_QUERY = '''SELECT id, sender, message, message_type FROM chat_messages
+               WHERE (sender=? AND receiver=?) OR (sender=? AND receiver=?)
+               ORDER BY id'''
+NEW_QUERY = '''SELECT id, sender, message, message_type FROM chat_messages
+               WHERE conversation_id=? ORDER BY id'''
+
+
+def build_db(path, n_rows, n_users):
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE chat_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, sender TEXT, receiver TEXT,
+                    message TEXT, timestamp TEXT, message_type TEXT DEFAULT 'text', is_read INTEGER DEFAULT 0)''')
+    conn.execute("CREATE TABLE kari_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, sender TEXT, receiver TEXT, message TEXT, topic_theme TEXT, timestamp TEXT)")
+    rng = random.Random(0)
+    users = [f"user{i:04d}" for i in range(n_users)]
+    batch = []
+    for i in range(n_rows):
+        a, b = rng.sample(users, 2)
+        batch.append((a, b, f"message {i}", "2025-01-01 00:00:00"))
+        if len(batch) == 100_000:
+            conn.executemany("INSERT INTO chat_messages (sender, receiver, message, timestamp) VALUES (?, ?, ?, ?)", batch)
+            batch.clear()
+    conn.executemany("INSERT INTO chat_messages (sender, receiver, message, timestamp) VALUES (?, ?, ?, ?)", batch)
+    conn.execute("CREATE INDEX idx_chat_messages_pair ON chat_messages (sender, receiver, id)")
+    conn.commit()
+    conn.close()
+    return users
+
+
+def timed(fn, pairs):
+    start = time.perf_counter()
+    rows = 0
+    for pair in pairs:
+        rows += len(fn(*pair))
+    return (time.perf_counter() - start) / len(pairs) * 1000, rows
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    n_users = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        users = build_db(path, n_rows, n_users)
+        db.close_all()
+        db.DB_PATH = path
+
+        start = time.perf_counter()
+        with db.transaction() as c:
+            migrations._add_conversation_ids(c)
+        print(f"rows={n_rows} users={n_users} backfill={time.perf_counter() - start:.1f}s")
+
+        rng = random.Random(1)
+        pairs = [tuple(rng.sample(users, 2)) for _ in range(200)]
+        conv_ids = {p: db.query_one("SELECT id FROM conversations WHERE user_a=? AND user_b=?", tuple(sorted(p)))
+                    for p in pairs}
+
+        scan_ms, _ = timed(lambda a, b: db.query(SCAN_QUERY, (a, b, b, a)), pairs[:5])
+        old_ms, old_rows = timed(lambda a, b: db.query(OLD_QUERY, (a, b, b, a)), pairs)
+        new_ms, new_rows = timed(lambda a, b: db.query(NEW_QUERY, conv_ids[(a, b)]), pairs)
+        assert old_rows == new_rows
+        print(f"OR, no index (baseline)        {scan_ms:7.3f} ms / history")
+        print(f"OR on (sender, receiver, id)   {old_ms:7.3f} ms / history")
+        print(f"conversation_id range scan     {new_ms:7.3f} ms / history")
+        print(f"plan: {db.query('EXPLAIN QUERY PLAN ' + NEW_QUERY, (1,))[0][3]}")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
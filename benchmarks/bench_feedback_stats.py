@@ -0,0 +1,106 @@
+# bench_feedback_stats.py
+# chat.py の AIフィードバック欄（10指標）の描画で発行されるクエリ数と所要時間を比較する。
+# 旧方式：指標ごとに会話全体を取得し直して数える／履歴を1回だけ走査する／保存時に更新した集計表を読む。
+# 話題の広がり（MeCab）は旧方式では本文の取得だけを数え、新方式では含めない
+# （流し読みと分かち書きのキャッシュは bench_tokenizer で測る）。
+#
+#   python -m benchmarks.bench_feedback_stats [メッセージ数] [繰り返し回数]
+import os
+import sys
+import tempfile
+import time
+
+from modules import db, migrations
+from modules.chatstore import conversation_id, rebuild_aggregates
+from modules.convstats import ConversationStats, get_chat
+from modules.keywords import EMOTION_WORDS, DISCLOSURE_KEYWORDS
+
+USER, PARTNER = "alice", "bob"
+TEXTS = ["最近どう?", "楽しいよ", "私は映画が好き", "そうなんだ", "悩みがあって", "安心した", "また話そう"]
+
+
+def build_db(n_messages):
+    conv_id = conversation_id(USER, PARTNER, create=True)
+    with db.transaction() as c:
+        c.executemany('''INSERT INTO chat_messages (sender, receiver, message, timestamp, ts_epoch, conversation_id)
+                         VALUES (?, ?, ?, '', ?, ?)''',
+                      [((USER, PARTNER) if i % 3 else (PARTNER, USER)) + (TEXTS[i % len(TEXTS)], 1_700_000_000 + i * 45, conv_id)
+                       for i in range(n_messages)])
+        rebuild_aggregates(c, [conv_id])
+
+
+# 旧実装の各指標（1指標ごとに get_chat を呼び、その都度走査する）
+def legacy_render():
+    rows = get_chat(USER, PARTNER)                                      # 会話の長さ
+    (rows[-1][2] - rows[0][2]) / 60
+    rows = get_chat(USER, PARTNER)                                      # 会話の連続性
+    ts = [r[2] for r in rows]
+    gaps = [ts[i] - ts[i-1] for i in range(1, len(ts))]
+    sum(1 for i in range(1, len(rows)) if rows[i][0] != rows[i-1][0]) / (len(rows) - 1)
+    sum(gaps) / len(gaps)
+    rows = get_chat(USER, PARTNER)                                      # 沈黙の余白
+    ts = [r[2] for r in rows]
+    gaps = [ts[i] - ts[i-1] for i in range(1, len(ts))]
+    sum(gaps) / len(gaps)
+    rows = get_chat(USER, PARTNER)                                      # 応答率
+    sum(1 for i in range(1, len(rows)) if rows[i-1][0] != USER and rows[i][0] == USER)
+    rows = get_chat(USER, PARTNER)                                      # 発言割合
+    sum(1 for r in rows if r[0] == USER)
+    rows = get_chat(USER, PARTNER)                                      # 問いの頻度
+    sum(1 for s, m, _ in rows if s == USER and "?" in m)
+    rows = get_chat(USER, PARTNER)                                      # 感情語
+    sum(1 for s, m, _ in rows if s == USER and any(w in m for w in EMOTION_WORDS))
+    rows = get_chat(USER, PARTNER)                                      # 自己開示度
+    sum(1 for s, m, _ in rows if s == USER and any(k in m for k in DISCLOSURE_KEYWORDS))
+    rows = get_chat(USER, PARTNER)                                      # 話題の広がり（取得のみ）
+    [m for s, m, _ in rows if s == USER]
+    rows = get_chat(USER, PARTNER)                                      # 関係性の継続性
+    (rows[-1][2] - rows[0][2]) // 86400
+
+
+def history_render():
+    read_stats(ConversationStats.from_history(USER, PARTNER))
+
+
+def aggregates_render():
+    read_stats(ConversationStats.load(USER, PARTNER))
+
+
+def read_stats(stats):
+    stats.duration_seconds, stats.switch_ratio, stats.avg_gap, stats.response_count, stats.sender_count
+    stats.question_count, stats.emotion_count, stats.disclosure_count
+
+
+def bench(label, render, repeat):
+    queries = []
+    with db.connection() as conn:
+        conn.set_trace_callback(queries.append)
+        render()
+        conn.set_trace_callback(None)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            render()
+        elapsed = time.perf_counter() - start
+    n_queries = sum(1 for q in queries if q.lstrip().upper().startswith("SELECT"))
+    print(f"{label:<24} {elapsed / repeat * 1000:8.2f} ms / render  queries={n_queries}")
+    return elapsed
+
+
+def main():
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_all()
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        migrations.migrate()
+        build_db(n_messages)
+        print(f"messages={n_messages} repeat={repeat}")
+        before = bench("per-metric fetch (old)", legacy_render, repeat)
+        single = bench("single pass", history_render, repeat)
+        after = bench("aggregates table", aggregates_render, repeat)
+        print(f"speedup: single pass x{before / single:.1f}, aggregates x{before / after:.1f}")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
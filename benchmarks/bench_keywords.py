@@ -0,0 +1,45 @@
+# bench_keywords.py
+# 感情語・自己開示語の判定：語ごとに any(word in m) で走査する旧方式と、
+# KeywordMatcher（Aho-Corasick）で全カテゴリを1回でなぞる方式を比較する。
+# 今の語彙（各8語）と、数百語に増やした場合の両方を測る。
+#
+#   python -m benchmarks.bench_keywords [メッセージ数]
+import random
+import sys
+import time
+
+from modules.keywords import KEYWORD_CATEGORIES, KeywordMatcher
+
+CHARS = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん私好嫌思"
+
+
+def scan(categories, messages):
+    return sum(sum(1 for words in categories.values() if any(w in m for w in words)) for m in messages)
+
+
+def automaton(matcher, messages):
+    return sum(sum(1 for n in matcher.count(m).values() if n) for m in messages)
+
+
+def bench(label, fn):
+    start = time.perf_counter()
+    hits = fn()
+    print(f"  {label:<24} {(time.perf_counter() - start) * 1000:8.1f} ms  hits={hits}")
+
+
+def main():
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    rng = random.Random(0)
+    messages = ["".join(rng.choice(CHARS) for _ in range(rng.randint(5, 60))) for _ in range(n_messages)]
+    large = {name: words + ["".join(rng.choice(CHARS) for _ in range(rng.randint(2, 5))) for _ in range(300)]
+             for name, words in KEYWORD_CATEGORIES.items()}
+    print(f"messages={n_messages}")
+    for name, categories in (("current lexicon", KEYWORD_CATEGORIES), ("300 extra words per category", large)):
+        print(name)
+        matcher = KeywordMatcher(categories)
+        bench("any(word in m) (old)", lambda: scan(categories, messages))
+        bench("KeywordMatcher", lambda: automaton(matcher, messages))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# bench_timing_metrics.py
+# 会話の長さ・連続性・沈黙・応答率の時間系指標を、旧実装の要素ごとのループと
+# timing_metrics（numpy の配列演算／numpy が無い場合のループ版）で比較する。
+# 取得（DB→Python）の時間は別に示す。
+# 画面で使う間隔の中央値（週ごとの度数分布からの近似）も、正確な値との差と合わせて示す。
+#
+#   python -m benchmarks.bench_timing_metrics [メッセージ数] [繰り返し回数]
+import os
+import random
+import sys
+import tempfile
+import time
+
+from modules import convstats, db, migrations
+from modules.chatstore import conversation_id, rebuild_rollups
+
+USER, PARTNER = "alice", "bob"
+
+
+def build_db(n_messages):
+    rng = random.Random(0)
+    conv_id = conversation_id(USER, PARTNER, create=True)
+    ts = 1_700_000_000
+    rows = []
+    for i in range(n_messages):
+        ts += rng.choice((5, 30, 90, 600, 86400))
+        rows.append(((USER, PARTNER) if rng.random() < 0.5 else (PARTNER, USER)) + (f"message {i}", ts, conv_id))
+    with db.transaction() as c:
+        c.executemany('''INSERT INTO chat_messages (sender, receiver, message, timestamp, ts_epoch, conversation_id)
+                         VALUES (?, ?, ?, '', ?, ?)''', rows)
+        rebuild_rollups(c, [conv_id])
+
+
+# 旧実装：連続性・沈黙・応答率・長さがそれぞれ rows をループで走査する
+def legacy_metrics(rows):
+    timestamps = [r[2] for r in rows]
+    gaps = [timestamps[i] - timestamps[i-1] for i in range(1, len(timestamps))]
+    turns = [r[0] for r in rows]
+    switch_count = sum(1 for i in range(1, len(turns)) if turns[i] != turns[i-1])
+    avg_gap = sum(gaps) / len(gaps)
+    timestamps = [r[2] for r in rows]
+    gaps = [timestamps[i] - timestamps[i-1] for i in range(1, len(timestamps))]
+    avg_gap = sum(gaps) / len(gaps)
+    response_count = 0
+    for i in range(1, len(rows)):
+        if rows[i-1][0] != USER and rows[i][0] == USER:
+            response_count += 1
+    duration = rows[-1][2] - rows[0][2]
+    return switch_count, response_count, avg_gap, duration
+
+
+def bench(label, fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    print(f"{label:<30} {(time.perf_counter() - start) / repeat * 1000:8.2f} ms")
+
+
+def main():
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_all()
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        migrations.migrate()
+        build_db(n_messages)
+        rows = convstats.get_chat(USER, PARTNER)
+        timeline = convstats.get_timeline(USER, PARTNER)
+        print(f"messages={n_messages} repeat={repeat} numpy={'yes' if convstats.np is not None else 'no'}")
+        bench("fetch get_chat (old)", lambda: convstats.get_chat(USER, PARTNER), repeat)
+        bench("fetch get_timeline", lambda: convstats.get_timeline(USER, PARTNER), repeat)
+        bench("per-metric loops (old)", lambda: legacy_metrics(rows), repeat)
+        bench("timing_metrics, loop", lambda: convstats._timing_metrics_loop(timeline), repeat)
+        if convstats.np is not None:
+            bench("timing_metrics, numpy", lambda: convstats.timing_metrics(timeline), repeat)
+            vectorized, loop = convstats.timing_metrics(timeline), convstats._timing_metrics_loop(timeline)
+            assert vectorized.pop("gap_percentiles").keys() == loop.pop("gap_percentiles").keys()
+            assert vectorized == loop
+        stats = convstats.ConversationStats.load(USER, PARTNER)
+        bench("gap_median (rollup histogram)", lambda: convstats.gap_median(conversation_id(USER, PARTNER)), repeat)
+        exact = stats.gap_percentiles[50]
+        print(f"median gap: exact {exact:.1f}s  histogram {stats.gap_median:.1f}s")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
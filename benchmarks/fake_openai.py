@@ -0,0 +1,115 @@
+# fake_openai.py
+# OpenAI 互換の /v1/chat/completions だけを返すローカルサーバー（AIワーカーの動作確認・計測用）。
+# 最後の user 発言を REPLY_REPEAT 回つなげて返す。最初のチャンクまで --delay 秒、以降はチャンクごとに
+# --chunk-delay 秒待ってモデルの生成速度を真似る（stream=True なら SSE で少しずつ、そうでなければまとめて返す）。
+# --fail-rate の割合で --fail-status（既定 503）を返し、上流の不調を真似る。
+#
+#   python -m benchmarks.fake_openai [--port 8765] [--delay 1.0] [--chunk-delay 0.05] [--fail-rate 0.3]
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=dummy python -m modules.aiworker
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK_CHARS = 4
+REPLY_REPEAT = 3
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"    # keep-alive（ストリーミングだけは送り終えたら閉じる）
+    disable_nagle_algorithm = True   # ヘッダーと本文を別々に書くので、遅延ACKで 40ms 待たないように
+    delay = 1.0
+    chunk_delay = 0.05
+    fail_rate = 0.0
+    fail_status = 503
+    calls = 0
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        type(self).calls += 1
+        if random.random() < self.fail_rate:
+            self._send_json({"error": {"message": "fake upstream failure", "type": "server_error"}},
+                            status=self.fail_status)
+            return
+        last = next((m["content"] for m in reversed(body.get("messages", [])) if m["role"] == "user"), "")
+        reply = f"（fake）{last}" * REPLY_REPEAT
+        chunks = [reply[i:i + CHUNK_CHARS] for i in range(0, len(reply), CHUNK_CHARS)]
+        meta = {"id": f"chatcmpl-fake-{self.calls}", "created": int(time.time()), "model": body.get("model", "fake")}
+        prompt_tokens = sum(len(m["content"]) for m in body.get("messages", []))    # 1文字1トークンとみなす
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(reply),
+                 "total_tokens": prompt_tokens + len(reply)}
+        time.sleep(self.delay)
+        if body.get("stream"):
+            self._stream(meta, chunks, usage if (body.get("stream_options") or {}).get("include_usage") else None)
+            return
+        time.sleep(self.chunk_delay * (len(chunks) - 1))
+        self._send_json(dict(meta, object="chat.completion",
+                             choices=[{"index": 0, "finish_reason": "stop",
+                                       "message": {"role": "assistant", "content": reply}}],
+                             usage=usage))
+
+    def _send_json(self, obj, status=200):
+        payload = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # 📡 SSE で1チャンクずつ送る（本文を送り終えたら接続を閉じる）
+    def _stream(self, meta, chunks, usage=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for i, text in enumerate(chunks):
+            if i:
+                time.sleep(self.chunk_delay)
+            self._event(dict(meta, object="chat.completion.chunk",
+                             choices=[{"index": 0, "finish_reason": None, "delta": {"content": text}}]))
+        self._event(dict(meta, object="chat.completion.chunk",
+                         choices=[{"index": 0, "finish_reason": "stop", "delta": {}}]))
+        if usage is not None:
+            self._event(dict(meta, object="chat.completion.chunk", choices=[], usage=usage))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _event(self, obj):
+        self.wfile.write(b"data: " + json.dumps(obj).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+# 🧪 別スレッドで起動して (server, base_url) を返す（port=0 なら空いているポート）
+def serve_in_thread(port=0, delay=1.0, chunk_delay=0.05, fail_rate=0.0, fail_status=503):
+    handler = type("Handler", (FakeOpenAIHandler,), {"delay": delay, "chunk_delay": chunk_delay, "calls": 0,
+                                                     "fail_rate": fail_rate, "fail_status": fail_status})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 互換のローカルサーバー")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=1.0, help="最初のチャンクまでの秒数")
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="チャンク間の秒数")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="失敗を返す割合")
+    parser.add_argument("--fail-status", type=int, default=503, help="失敗時のステータス")
+    args = parser.parse_args()
+    handler = type("Handler", (FakeOpenAIHandler,), {"delay": args.delay, "chunk_delay": args.chunk_delay,
+                                                     "fail_rate": args.fail_rate, "fail_status": args.fail_status})
+    print(f"fake OpenAI: http://127.0.0.1:{args.port}/v1 (delay {args.delay}s)")
+    ThreadingHTTPServer(("127.0.0.1", args.port), handler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
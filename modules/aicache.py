@@ -0,0 +1,126 @@
+# aicache.py（AI応答の永続キャッシュ。モデル・システムプロンプト・直前の発言が同じなら保存済みの応答を返す）
+# スタンプや短い挨拶への応答は何度も同じ形になるので、有料の往復を省く。
+# 文脈は会話の履歴（要約・これまでの応答）を含むので、キーと対象の判定は末尾の利用者の発言だけで行う。
+# 長い発言はほぼ一致しないので、調べもせず素通しする（キャッシュを汚さない）。
+#
+#   python -m modules.aicache   保存済みの件数・ヒット数・節約できた待ち時間を表示し、期限切れを掃除する
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+
+from modules import db
+from modules.utils import now_epoch
+
+# 定数（設計意図の明示）
+CACHE_ENABLED = os.getenv("MEBIUS_AI_CACHE", "1") != "0"
+CACHE_TTL = int(os.getenv("MEBIUS_AI_CACHE_TTL", "86400"))             # 保存から何秒で使わなくなるか
+CACHE_MAX_ENTRIES = int(os.getenv("MEBIUS_AI_CACHE_SIZE", "5000"))     # これを超えたら使われていない順に消す
+CACHE_CONTEXT_TURNS = 2          # キーに使う末尾の利用者の発言数（最後の AI の応答より後のものだけ）
+CACHE_MAX_CONTEXT_CHARS = 80     # その発言の合計文字数がこれを超える文脈はキャッシュしない
+CACHE_EVICT_EVERY = 100          # 何件保存するごとに期限切れ・超過分を消すか
+
+_counts = {"hits": 0, "misses": 0, "bypassed": 0, "saved_ms": 0}
+_stores = 0
+_lock = threading.Lock()
+
+# 🧹 本文の正規化（全角・半角の揺れと空白の違いでキーが分かれないように）
+def normalize(text):
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip()
+
+# 💬 キーに使う文脈：末尾から続く利用者の発言（最大 CACHE_CONTEXT_TURNS 件。要約と過去の応答は含めない）
+def _context(request):
+    turns = []
+    for m in reversed(request["messages"]):
+        if m["role"] != "user" or len(turns) == CACHE_CONTEXT_TURNS:
+            break
+        turns.append(normalize(m["content"]))
+    return turns[::-1]
+
+# 🔑 キャッシュキー（モデル・システムプロンプト・正規化した末尾の発言・生成パラメータのハッシュ）
+# システムプロンプトは先頭の1件だけ（2件目以降は会話ごとの要約なので、含めると会話をまたいで一致しない）
+def cache_key(model, request):
+    messages = request["messages"]
+    system = messages[0]["content"] if messages and messages[0]["role"] == "system" else None
+    params = {k: v for k, v in request.items() if k != "messages"}
+    payload = json.dumps([model, system, _context(request), params], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# ✅ キャッシュの対象か（末尾の発言が短いときだけ。長い発言は一致しないので素通し）
+def cacheable(request):
+    context = _context(request)
+    return CACHE_ENABLED and bool(context) and sum(len(content) for content in context) <= CACHE_MAX_CONTEXT_CHARS
+
+# 🔎 保存済みの応答を探す
+# 戻り値: (キー, 応答)。対象外ならキーも None、見つからなければ応答が None
+def lookup(model, request):
+    if not cacheable(request):
+        with _lock:
+            _counts["bypassed"] += 1
+        return None, None
+    key = cache_key(model, request)
+    now = now_epoch()
+    row = db.query_one("SELECT reply, latency_ms FROM ai_response_cache WHERE key=? AND created_at > ?",
+                       (key, now - CACHE_TTL))
+    if row is None:
+        with _lock:
+            _counts["misses"] += 1
+        return key, None
+    db.execute("UPDATE ai_response_cache SET hits=hits+1, last_hit_at=? WHERE key=?", (now, key))
+    with _lock:
+        _counts["hits"] += 1
+        _counts["saved_ms"] += row[1] or 0
+    return key, row[0]
+
+# 💾 応答を保存する（latency_ms は実際にかかった時間。ヒットのたびにこの分だけ待たずに済んだとみなす）
+def store(key, model, reply, latency_ms):
+    global _stores
+    now = now_epoch()
+    db.execute('''INSERT INTO ai_response_cache (key, model, reply, latency_ms, hits, created_at, last_hit_at)
+                  VALUES (?, ?, ?, ?, 0, ?, ?)
+                  ON CONFLICT (key) DO UPDATE SET reply=excluded.reply, latency_ms=excluded.latency_ms,
+                      created_at=excluded.created_at, last_hit_at=excluded.last_hit_at''',
+               (key, model, reply, latency_ms, now, now))
+    with _lock:
+        _stores += 1
+        due = _stores % CACHE_EVICT_EVERY == 0
+    if due:
+        evict()
+
+# 🧹 期限切れと、上限を超えた分（最後に使われた時刻の古い順）を消す。戻り値: 消した件数
+def evict():
+    with db.transaction() as c:
+        c.execute("DELETE FROM ai_response_cache WHERE created_at <= ?", (now_epoch() - CACHE_TTL,))
+        removed = c.rowcount
+        c.execute('''DELETE FROM ai_response_cache WHERE key IN (
+                         SELECT key FROM ai_response_cache ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?)''',
+                  (CACHE_MAX_ENTRIES,))
+        return removed + c.rowcount
+
+# 📈 このプロセスでの効き具合（素通しした分はヒット率に含めない）
+def cache_stats():
+    with _lock:
+        hits, misses = _counts["hits"], _counts["misses"]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "bypassed": _counts["bypassed"],
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "saved_ms": _counts["saved_ms"],
+        }
+
+# 📈 保存済みエントリからの累計（プロセスをまたいだ効き具合）
+def stored_stats():
+    entries, hits, saved_ms = db.query_one('''SELECT COUNT(*), COALESCE(SUM(hits), 0), COALESCE(SUM(hits * latency_ms), 0)
+                                              FROM ai_response_cache''')
+    return {"entries": entries, "hits": hits, "saved_ms": saved_ms}
+
+if __name__ == "__main__":
+    from modules.migrations import ensure_schema
+
+    ensure_schema()
+    print(f"evicted {evict()} entries")
+    stats = stored_stats()
+    print(f"{stats['entries']} entries, {stats['hits']} hits, saved {stats['saved_ms'] / 1000:,.1f} s of model latency")
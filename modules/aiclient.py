@@ -0,0 +1,220 @@
+# aiclient.py（OpenAI 呼び出しの共通窓口。接続の使い回し・タイムアウト・再試行・流量制限・遮断をここにまとめる）
+# 画面やワーカーは chat_completion() だけを使い、クライアントを自分で作らない。
+# 呼び出しは成否にかかわらず1件ずつ ai_calls に記録する（集計は modules.aimetrics）。
+# 接続先は OPENAI_BASE_URL で差し替えられる（ローカルの互換サーバー: python -m benchmarks.fake_openai）
+import os
+import random
+import threading
+import time
+
+import httpx
+import openai
+
+from modules import aimetrics
+
+# 定数（設計意図の明示）
+CONNECT_TIMEOUT = 5.0        # 接続確立の待ち時間（秒）
+READ_TIMEOUT = 30.0          # 応答の待ち時間（秒）。ストリーミングではチャンク間の待ち時間
+WRITE_TIMEOUT = 10.0
+POOL_TIMEOUT = 5.0           # 接続プールの空き待ち
+MAX_CONNECTIONS = 16         # 同時接続の上限（ワーカー数より多めに）
+MAX_KEEPALIVE = 8            # 使い回すために開けたままにしておく接続数
+KEEPALIVE_EXPIRY = 60.0      # 使われない接続を閉じるまでの秒数
+MAX_RETRIES = 3              # 一時的な失敗（接続・タイムアウト・429・5xx）の再試行回数
+BACKOFF_BASE = 0.5           # 再試行の待ち時間の基準（秒）。0〜基準×2^回数 の一様乱数で散らす
+BACKOFF_MAX = 8.0
+RATE_PER_SEC = float(os.getenv("MEBIUS_AI_RATE", "5"))   # 1プロセスから送る毎秒のリクエスト数
+RATE_BURST = int(os.getenv("MEBIUS_AI_BURST", "10"))     # 一度に送ってよい数（バケツの大きさ）
+RATE_WAIT_MAX = 30.0         # 流量制限でこれ以上待つなら諦める（秒）
+BREAKER_THRESHOLD = 5        # 一時的な失敗がこの回数続いたら遮断する
+BREAKER_COOLDOWN = 30.0      # 遮断してから試しに1件通すまでの秒数
+RETRYABLE = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class RateLimitTimeout(RuntimeError):
+    pass
+
+
+# 🪣 トークンバケット（毎秒 rate 個たまり、最大 burst 個まで。1リクエストで1個使う）
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # 1個取れるまで待つ（max_wait 秒を超えそうなら待たずに RateLimitTimeout）
+    def acquire(self, max_wait=RATE_WAIT_MAX):
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                raise RateLimitTimeout(f"AI呼び出しの流量制限で {max_wait:.0f} 秒以上待つため中止しました")
+            time.sleep(wait)
+
+
+# 🔌 サーキットブレーカー（closed → 失敗が続くと open → 冷却後に1件だけ試す half-open → 成功で closed）
+# 上流が不調な間は呼ばずにすぐ失敗させ、ワーカーと接続を空けておく
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.cooldown else "half-open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+bucket = TokenBucket(RATE_PER_SEC, RATE_BURST)
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+
+
+def _timeout(read=READ_TIMEOUT):
+    return httpx.Timeout(read, connect=CONNECT_TIMEOUT, write=WRITE_TIMEOUT, pool=POOL_TIMEOUT)
+
+
+# 🔌 プロセスで1つのクライアント（keep-alive の接続プールを共有する。再試行はこちらで行うので SDK 側は 0 回）
+def client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = openai.OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    base_url=os.getenv("OPENAI_BASE_URL") or None,
+                    timeout=_timeout(),
+                    max_retries=0,
+                    http_client=openai.DefaultHttpxClient(limits=httpx.Limits(
+                        max_connections=MAX_CONNECTIONS,
+                        max_keepalive_connections=MAX_KEEPALIVE,
+                        keepalive_expiry=KEEPALIVE_EXPIRY,
+                    )),
+                )
+    return _client
+
+
+# ⏱ 再試行までの待ち時間（指数バックオフ＋全幅ジッター。429 の Retry-After があればそれ以上待つ）
+def _backoff(attempt, error):
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, min(BACKOFF_MAX, float(retry_after)))
+        except ValueError:
+            pass
+    return delay
+
+
+# 🤖 chat.completions.create の共通窓口
+# 一時的な失敗は待ち時間を散らして再試行し、遮断中・流量制限の待ちすぎは CircuitOpenError / RateLimitTimeout
+# stream=True のときは最初の応答（ヘッダー）までを再試行の対象にする
+# caller（利用者）と purpose（reply / summary など）は記録用で、OpenAI には送らない
+def chat_completion(messages, model, timeout=READ_TIMEOUT, retries=MAX_RETRIES, caller=None, purpose="reply",
+                    **params):
+    started = time.perf_counter()
+    attempt = 0
+
+    def record(outcome, usage=None, error=None, ttft=None):
+        aimetrics.record_call(model, purpose, caller, outcome, round((time.perf_counter() - started) * 1000),
+                              ttft_ms=round(ttft * 1000) if ttft is not None else None, retries=attempt,
+                              prompt_tokens=getattr(usage, "prompt_tokens", None),
+                              completion_tokens=getattr(usage, "completion_tokens", None),
+                              error_type=type(error).__name__ if error is not None else None)
+
+    if params.get("stream"):
+        params.setdefault("stream_options", {"include_usage": True})   # 最後のチャンクでトークン数を受け取る
+    try:
+        for attempt in range(retries + 1):
+            bucket.acquire()
+            if not breaker.allow():
+                raise CircuitOpenError("AIサービスが不調のため、しばらく呼び出しを止めています")
+            try:
+                response = client().chat.completions.create(model=model, messages=messages,
+                                                            timeout=_timeout(timeout), **params)
+            except RETRYABLE as e:
+                breaker.failure()
+                if attempt == retries:
+                    raise
+                time.sleep(_backoff(attempt, e))
+                continue
+            except openai.APIStatusError:
+                breaker.success()      # 4xx は上流が応答できている（リクエスト側の問題）
+                raise
+            except Exception:
+                breaker.failure()      # 想定外の失敗でも half-open の試行枠は返す
+                raise
+            breaker.success()
+            break
+    except CircuitOpenError as e:
+        record(aimetrics.CIRCUIT_OPEN, error=e)
+        raise
+    except RateLimitTimeout as e:
+        record(aimetrics.RATE_LIMITED, error=e)
+        raise
+    except Exception as e:
+        record(aimetrics.ERROR, error=e)
+        raise
+    if params.get("stream"):
+        return _recorded_stream(response, started, record)
+    record(aimetrics.OK, usage=response.usage, ttft=time.perf_counter() - started)
+    return response
+
+
+# 📡 ストリームを読み終えた（または途中で失敗した）時点で記録する
+def _recorded_stream(stream, started, record):
+    usage = ttft = None
+    try:
+        for chunk in stream:
+            if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+                ttft = time.perf_counter() - started
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            yield chunk
+    except Exception as e:
+        record(aimetrics.ERROR, usage=usage, error=e, ttft=ttft)
+        raise
+    record(aimetrics.OK, usage=usage, ttft=ttft)
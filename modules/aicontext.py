@@ -0,0 +1,110 @@
+# aicontext.py（AIに渡す会話文脈の組み立て。発言者ごとに role を付け、トークン予算に収める）
+# 予算に入りきらない古いやりとりは、会話ごとの要約（ai_context_summaries）に少しずつ畳み込む。
+# 要約は「前回の要約＋新しく押し出された分」だけから作り直すので、会話が伸びても文脈の大きさは一定に保たれる。
+import os
+
+from modules import aiclient, db
+from modules.chatstore import conversation_id, get_page
+from modules.utils import now_epoch
+
+# 定数（設計意図の明示）
+CONTEXT_TOKEN_BUDGET = int(os.getenv("MEBIUS_AI_CONTEXT_TOKENS", "1200"))   # system・要約・直近の発言の合計
+FOLD_TO = 0.5                # 予算を超えたら、直近の発言が予算のこの割合に収まるまで古い順に要約へ回す
+CONTEXT_SCAN_LIMIT = 200     # 文脈の候補として読む直近のメッセージ数（初回でも全履歴は読まない）
+                             # 要約が無い会話の初回は、これより古い発言を要約にも入れない（1回の応答で要約を何度も呼ばないため）
+MESSAGE_OVERHEAD_TOKENS = 4  # 1メッセージごとの role などの上乗せ分
+SUMMARY_MODEL = "gpt-5-nano"
+SUMMARY_MAX_CHARS = 300
+SUMMARY_MAX_TOKENS = 400
+SUMMARY_PROMPT = (f"あなたは会話の要約係です。これまでの要約と新しいやりとりをもとに、利用者について覚えておくべき話題・"
+                  f"気持ち・事実を{SUMMARY_MAX_CHARS}字以内の日本語で要約し直してください。要約だけを出力してください。")
+SUMMARY_HEADER = "これまでの会話の要約:\n"
+STAMP_TEXT = "（スタンプ画像を送りました）"
+OPENING = "こんにちは！"     # まだ発言が無いときの最初の問いかけ
+
+# 🔢 トークン数の見積もり（日本語は1文字≒1トークン、英数字は4文字≒1トークンとして多めに数える）
+def estimate_tokens(text):
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return len(text) - ascii_chars + (ascii_chars + 3) // 4
+
+def _cost(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+# 💬 1メッセージ → {"role", "content"}（AI側の発言は assistant、画像スタンプは説明文に置き換える）
+def _turn(row, assistant):
+    _, sender, message, message_type = row
+    return {"role": "assistant" if sender == assistant else "user",
+            "content": STAMP_TEXT if message_type == "stamp" else message}
+
+# 📥 会話の要約と、そこまでに取り込んだ最後のメッセージID（無ければ ("", 0)）
+def load_summary(conv_id):
+    row = db.query_one("SELECT summary, last_message_id FROM ai_context_summaries WHERE conversation_id=?", (conv_id,))
+    return (row[0], row[1]) if row else ("", 0)
+
+# 💾 要約の保存（別のワーカーがより先まで畳み込んでいれば上書きしない）
+def save_summary(conv_id, summary, last_message_id):
+    db.execute('''INSERT INTO ai_context_summaries (conversation_id, summary, last_message_id, updated_at)
+                  VALUES (?, ?, ?, ?)
+                  ON CONFLICT (conversation_id) DO UPDATE SET summary=excluded.summary,
+                      last_message_id=excluded.last_message_id, updated_at=excluded.updated_at
+                  WHERE excluded.last_message_id > ai_context_summaries.last_message_id''',
+               (conv_id, summary, last_message_id, now_epoch()))
+
+# 🧺 要約に新しく押し出された発言を畳み込む
+# 戻り値: 新しい要約。失敗したら None（何も保存しないので、次回また同じ発言から畳み込みを試みる）
+def fold_summary(conv_id, summary, turns, last_message_id, user=None):
+    lines = "\n".join(f"{'AI' if t['role'] == 'assistant' else 'ユーザー'}: {t['content']}" for t in turns)
+    try:
+        resp = aiclient.chat_completion(model=SUMMARY_MODEL, max_completion_tokens=SUMMARY_MAX_TOKENS,
+                                        caller=user, purpose="summary", messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"これまでの要約:\n{summary or 'なし'}\n\n新しいやりとり:\n{lines}"},
+        ])
+        folded = resp.choices[0].message.content.strip()[:SUMMARY_MAX_CHARS]
+    except Exception:
+        return None
+    save_summary(conv_id, folded, last_message_id)
+    return folded
+
+# 🧩 モデルに渡す messages（system → 要約 → 直近の発言の順。合計は budget トークン以内）
+def build_context(user, assistant, system_prompt, budget=CONTEXT_TOKEN_BUDGET):
+    system = {"role": "system", "content": system_prompt}
+    conv_id = conversation_id(user, assistant)
+    if conv_id is None:
+        return [system, {"role": "user", "content": OPENING}]
+
+    summary, summarized_id = load_summary(conv_id)
+    # 読むのは直近 CONTEXT_SCAN_LIMIT 件まで。要約済みの位置がそれより古ければ、間の発言は要約されずに飛ばされる
+    rows, _ = get_page(user, assistant, limit=CONTEXT_SCAN_LIMIT)
+    rows = [row for row in rows if row[0] > summarized_id]
+    turns = [_turn(row, assistant) for row in rows]
+    costs = [_cost(turn) for turn in turns]
+    # 要約の枠は最大長で先に確保しておく（要約が伸びても合計が予算を超えない）
+    summary_reserve = estimate_tokens(SUMMARY_HEADER) + SUMMARY_MAX_CHARS + MESSAGE_OVERHEAD_TOKENS
+    available = max(budget - _cost(system) - summary_reserve, MESSAGE_OVERHEAD_TOKENS + 1)
+
+    if sum(costs) > available:
+        # 新しい方から予算の FOLD_TO まで残し、それより古い分を要約へ（毎回ではなく、溜まったときだけ要約する）
+        cut, kept_cost = len(turns), 0
+        while cut > 0 and kept_cost + costs[cut - 1] <= available * FOLD_TO:
+            cut -= 1
+            kept_cost += costs[cut]
+        cut = min(cut, len(turns) - 1)        # 最後の発言だけは長くても必ず残す
+        folded = fold_summary(conv_id, summary, turns[:cut], rows[cut - 1][0], user) if cut > 0 else summary
+        if folded is None:
+            # 要約できなかった発言も捨てず、新しい方から予算いっぱいまで残す（入りきらない古い分だけ落とす）
+            cut, kept_cost = len(turns), 0
+            while cut > 0 and kept_cost + costs[cut - 1] <= available:
+                cut -= 1
+                kept_cost += costs[cut]
+            cut = min(cut, len(turns) - 1)
+        else:
+            summary = folded
+        turns = turns[cut:]
+        if _cost(turns[0]) > available:
+            turns[0] = dict(turns[0], content=turns[0]["content"][-(available - MESSAGE_OVERHEAD_TOKENS):])
+
+    messages = [system]
+    if summary:
+        messages.append({"role": "system", "content": SUMMARY_HEADER + summary})
+    return messages + (turns or [{"role": "user", "content": OPENING}])
@@ -0,0 +1,107 @@
+# aimetrics.py（モデル呼び出しの記録と集計。1呼び出し＝ai_calls の1行）
+# 記録は modules.aiclient が呼び出しのたびに行う。ここでは利用者・日・モデルごとの集計と
+# 応答時間のパーセンタイル（p50/p95/p99）、料金表からの費用を出す。容量の見積もりや上限設定に使う。
+#
+#   python -m modules.aimetrics [--by user|day|model] [--days 7]
+import argparse
+import logging
+
+from modules import db
+from modules.utils import now_epoch, day_start, format_jst, DAY
+
+# 定数（設計意図の明示）
+# 料金表（USD / 100万トークン。入力, 出力）。改定されたらここを直す（記録済みの費用は呼び出し時点の値のまま）
+MODEL_PRICES = {
+    "gpt-5-nano": (0.05, 0.40),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+OK, ERROR, CIRCUIT_OPEN, RATE_LIMITED = "ok", "error", "circuit_open", "rate_limited"
+LATENCY_PERCENTILES = (50, 95, 99)
+GROUP_COLUMNS = {"user": "user", "day": "day", "model": "model"}   # 集計の単位 → 列名
+
+logger = logging.getLogger(__name__)
+
+# 💴 費用（USD）。料金表に無いモデルは None
+def call_cost(model, prompt_tokens, completion_tokens):
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    return ((prompt_tokens or 0) * prices[0] + (completion_tokens or 0) * prices[1]) / 1_000_000
+
+# 📝 1呼び出しの記録（記録の失敗で呼び出し自体は失敗させない）
+def record_call(model, purpose, user, outcome, latency_ms, ttft_ms=None, retries=0,
+                prompt_tokens=None, completion_tokens=None, error_type=None):
+    ts = now_epoch()
+    try:
+        db.execute('''INSERT INTO ai_calls (ts, day, user, purpose, model, outcome, error_type, retries,
+                                            latency_ms, ttft_ms, prompt_tokens, completion_tokens, cost_usd)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                   (ts, day_start(ts), user, purpose, model, outcome, error_type, retries, latency_ms, ttft_ms,
+                    prompt_tokens, completion_tokens, call_cost(model, prompt_tokens, completion_tokens)))
+    except Exception as e:
+        logger.warning("ai call not recorded: %s", e)
+
+# 📊 集計（group_by は "user" / "day" / "model"。since〜until はエポック秒）
+# 応答時間のパーセンタイルは成功した呼び出しだけから求める（遮断による即時失敗で小さく見えないように）
+# 戻り値: 件数の多い順（day は新しい順）に {key, calls, errors, retries, prompt_tokens, completion_tokens,
+#         cost_usd, p50_ms, p95_ms, p99_ms}
+def usage_report(group_by="day", since=0, until=None):
+    column = GROUP_COLUMNS[group_by]
+    until = until if until is not None else 2 ** 62
+    rows = db.query(f'''SELECT {column}, COUNT(*), SUM(outcome != ?), SUM(retries),
+                               COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0),
+                               COALESCE(SUM(cost_usd), 0)
+                        FROM ai_calls WHERE ts BETWEEN ? AND ?
+                        GROUP BY {column}''', (OK, since, until))
+    percentiles = latency_percentiles(group_by, since, until)
+    report = [dict(zip(("key", "calls", "errors", "retries", "prompt_tokens", "completion_tokens", "cost_usd"), row),
+                   **percentiles.get(row[0], dict.fromkeys(f"p{p}_ms" for p in LATENCY_PERCENTILES)))
+              for row in rows]
+    if group_by == "day":
+        report.sort(key=lambda r: r["key"], reverse=True)
+    else:
+        report.sort(key=lambda r: r["calls"], reverse=True)
+    return report
+
+# ⏱ グループごとの応答時間のパーセンタイル（最近傍順位法。ウィンドウ関数で1回のクエリにまとめる）
+# 戻り値: {key: {"p50_ms": .., "p95_ms": .., "p99_ms": ..}}
+def latency_percentiles(group_by="day", since=0, until=None):
+    column = GROUP_COLUMNS[group_by]
+    until = until if until is not None else 2 ** 62
+    picks = ", ".join(f"MIN(CASE WHEN rn >= n * {p / 100} THEN latency_ms END)" for p in LATENCY_PERCENTILES)
+    rows = db.query(f'''WITH ranked AS (
+                            SELECT {column} AS key, latency_ms,
+                                   ROW_NUMBER() OVER (PARTITION BY {column} ORDER BY latency_ms) AS rn,
+                                   COUNT(*) OVER (PARTITION BY {column}) AS n
+                            FROM ai_calls WHERE ts BETWEEN ? AND ? AND outcome = ?
+                        )
+                        SELECT key, {picks} FROM ranked GROUP BY key''', (since, until, OK))
+    return {row[0]: dict(zip((f"p{p}_ms" for p in LATENCY_PERCENTILES), row[1:])) for row in rows}
+
+# 🔢 利用者のその日の使用量（上限の判定用）: (呼び出し数, 入力＋出力トークン数, 費用USD)
+def daily_usage(user, epoch=None):
+    day = day_start(epoch if epoch is not None else now_epoch())
+    return db.query_one('''SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0) + COALESCE(SUM(completion_tokens), 0),
+                                  COALESCE(SUM(cost_usd), 0)
+                           FROM ai_calls WHERE user=? AND day=?''', (user, day))
+
+def _format_key(group_by, key):
+    if group_by == "day":
+        return format_jst(key)[:10]
+    return key if key is not None else "-"
+
+if __name__ == "__main__":
+    from modules.migrations import ensure_schema
+
+    parser = argparse.ArgumentParser(description="モデル呼び出しの集計を表示する")
+    parser.add_argument("--by", choices=sorted(GROUP_COLUMNS), default="day")
+    parser.add_argument("--days", type=int, default=7, help="直近何日分を集計するか")
+    args = parser.parse_args()
+    ensure_schema()
+    since = day_start(now_epoch()) - (args.days - 1) * DAY
+    print(f"{args.by:<20} {'calls':>7} {'errors':>6} {'retries':>7} {'in tok':>9} {'out tok':>9} "
+          f"{'cost $':>9} {'p50':>6} {'p95':>6} {'p99':>6}")
+    for r in usage_report(args.by, since=since):
+        print(f"{_format_key(args.by, r['key']):<20} {r['calls']:>7} {r['errors']:>6} {r['retries']:>7} "
+              f"{r['prompt_tokens']:>9} {r['completion_tokens']:>9} {r['cost_usd']:>9.4f} "
+              + " ".join(f"{r[f'p{p}_ms'] if r[f'p{p}_ms'] is not None else '-':>6}" for p in LATENCY_PERCENTILES))
@@ -1,16 +1,15 @@
-import openai
-import os
 from dotenv import load_dotenv
+from modules import aiclient
 
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 def chat_with_ai(user_message, system_prompt="あなたは優しく誠実な対話相手です。"):
-    response = openai.ChatCompletion.create(
+    response = aiclient.chat_completion(
         model="gpt-3.5-turbo",
+        purpose="aitochat",
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_message}
         ]
     )
-    return response["choices"][0]["message"]["content"]
\ No newline at end of file
+    return response.choices[0].message.content
\ No newline at end of file
@@ -0,0 +1,251 @@
+# aiworker.py（AI応答のジョブキュー。画面はジョブを積むだけで、応答の生成と保存はワーカーが行う）
+# ジョブは ai_jobs に残るので、「AI考慮中」は再描画・別セッション・別プロセスからも同じように見える。
+# Streamlit のプロセス内では start_workers() がスレッドを立てる。ワーカーだけを別プロセスで動かす場合は
+# MEBIUS_AI_WORKERS=0 で画面側のスレッドを止め、次を起動する:
+#
+#   python -m modules.aiworker [--workers N]
+#
+# 応答は既定でストリーミングで受け取り、途中までの本文を ai_jobs.partial_reply に書いていく（画面はそれを表示する）。
+# モデルの呼び出し（接続・再試行・流量制限・遮断）は modules.aiclient に、同じ文脈への応答の使い回しは
+# modules.aicache に任せる。
+import argparse
+import logging
+import os
+import threading
+import time
+
+from modules import aicache, aiclient, db
+from modules.aicontext import build_context
+from modules.chatstore import save_message
+from modules.utils import now_epoch
+
+# 定数（設計意図の明示）
+AI_NAME = "AIアシスタント"
+MODEL = "gpt-5-nano"
+MAX_WORKERS = int(os.getenv("MEBIUS_AI_WORKERS", "4"))   # 1プロセスで同時にモデルを呼ぶ数の上限
+POLL_INTERVAL = 1.0          # キューが空のときに見直す間隔（秒）。同じプロセスで積まれたジョブはすぐ起こす
+STALE_AFTER = 300            # running のまま止まったジョブ（ワーカーごと落ちた等）を拾い直すまでの秒数
+MAX_ATTEMPTS = 3             # 拾い直しを含めた実行回数の上限
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+STREAM = os.getenv("MEBIUS_AI_STREAM", "1") != "0"        # 0 なら応答を最後まで待ってから保存する
+STREAM_FLUSH_INTERVAL = 0.3  # 途中経過を書き込む間隔（秒）。チャンクごとに書くと書き込みロックを取り合う
+STREAM_REFRESH_MS = 500      # 応答待ちの間の画面の自動更新間隔（ミリ秒）
+STREAM_REFRESH_LIMIT = 600   # 応答待ちの間の自動更新回数の上限（500ms × 600 ≒ 5分。通常の 3秒 × 100 回と同じ長さ）
+FINISH_RETRIES = 3           # 応答の保存（finish_job）がロック待ち等で失敗したときの再試行回数
+ERROR_BACKOFF = 1.0          # DB の失敗のあとに待つ秒数の基準（再試行ごとに倍にする）
+ERROR_BACKOFF_MAX = 30.0
+
+logger = logging.getLogger(__name__)
+_started = False
+_lock = threading.Lock()
+_wake = threading.Event()
+
+# 💬 画面ごとの問い合わせ内容（ジョブの style で選ぶ。履歴はワーカーが実行時に読むので最新の発言まで入る）
+# 文脈は aicontext がトークン予算内に収める（古いやりとりは要約に畳み込まれる）
+def _chat_request(user):
+    return {
+        "messages": build_context(user, AI_NAME, "あなたは親切なチャットAIです。ユーザーの発言に自然に返答してください。"),
+        "max_tokens": 150,
+        "temperature": 0.7,
+    }
+
+def _chatkai_request(user):
+    return {
+        "messages": build_context(user, AI_NAME, "あなたは親切な日本語のチャットAIです。"),
+        "max_completion_tokens": 150,
+    }
+
+REQUESTS = {"chat": _chat_request, "chatkai": _chatkai_request}
+
+# 🤖 AI応答の生成（request は REQUESTS の戻り値。user は呼び出しの記録用。失敗は例外のまま返す）
+def generate_reply(request, user=None):
+    resp = aiclient.chat_completion(model=MODEL, caller=user, **request)
+    return resp.choices[0].message.content.strip()
+
+# 📡 ストリーミングで生成し、途中までの本文を on_partial に渡す
+# 最初のチャンクはすぐ、以降は STREAM_FLUSH_INTERVAL ごとにまとめて渡す
+# 戻り値: (本文, 最初のトークンまでの秒数。本文が空なら None)
+def stream_reply(request, on_partial, user=None):
+    started = last_flush = time.perf_counter()
+    first_token = None
+    parts = []
+    for chunk in aiclient.chat_completion(model=MODEL, stream=True, caller=user, **request):
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if not delta:
+            continue
+        now = time.perf_counter()
+        parts.append(delta)
+        if first_token is None:
+            first_token = now - started
+        elif now - last_flush < STREAM_FLUSH_INTERVAL:
+            continue
+        on_partial("".join(parts))
+        last_flush = now
+    return "".join(parts).strip(), first_token
+
+# 📮 応答ジョブを積む（画面側。モデルは呼ばないのですぐ戻る）
+# 同じ相手への未着手ジョブがあれば積まない（そのジョブが実行時に最新の発言まで読む）
+def enqueue_reply(user, style, partner=AI_NAME):
+    db.execute('''INSERT OR IGNORE INTO ai_jobs (user, partner, style, status, created_at)
+                  VALUES (?, ?, ?, ?, ?)''', (user, partner, style, QUEUED, now_epoch()))
+    _wake.set()
+
+# ⏳ 応答待ちのジョブがあるか（「AI考慮中」の表示用）
+def pending_reply(user, partner=AI_NAME):
+    return db.query_one('''SELECT 1 FROM ai_jobs WHERE user=? AND partner=? AND status IN (?, ?) LIMIT 1''',
+                        (user, partner, QUEUED, RUNNING)) is not None
+
+# 📡 生成中の応答の途中までの本文（無ければ None）
+def streaming_reply(user, partner=AI_NAME):
+    row = db.query_one('''SELECT partial_reply FROM ai_jobs
+                          WHERE user=? AND partner=? AND status=? AND partial_reply IS NOT NULL
+                          ORDER BY id DESC LIMIT 1''', (user, partner, RUNNING))
+    return row[0] if row else None
+
+# ⚠️ 直近のジョブが失敗していればその旨の表示文（画面用。エラーの詳細は ai_jobs.error に残す）
+def reply_error(user, partner=AI_NAME):
+    row = db.query_one('''SELECT status, error FROM ai_jobs WHERE user=? AND partner=?
+                          ORDER BY id DESC LIMIT 1''', (user, partner))
+    if row is None or row[0] != FAILED:
+        return None
+    if row[1] and row[1].startswith(aiclient.CircuitOpenError.__name__):
+        return "AIサービスが混み合っています。しばらくしてからもう一度送ってください"
+    return "AIが応答できませんでした。もう一度送ってください"
+
+# 📝 途中までの本文の書き込み（取りこぼしても最後に確定した本文が保存されるので、失敗は応答を止めない）
+def save_partial(job_id, text):
+    try:
+        db.execute("UPDATE ai_jobs SET partial_reply=? WHERE id=? AND status=?", (text, job_id, RUNNING))
+    except Exception as e:
+        logger.warning("ai partial reply not saved: job=%s: %s", job_id, e)
+
+# 🎫 ジョブを1件取る（書き込みロック内で running にするので、スレッド・プロセスをまたいで二重に取られない）
+# 戻り値: (id, user, partner, style)。無ければ None
+def claim_job():
+    now = now_epoch()
+    with db.transaction() as c:
+        c.execute('''UPDATE ai_jobs SET status=?, finished_at=?, error='ワーカーが応答しませんでした'
+                     WHERE status=? AND started_at < ? AND attempts >= ?''',
+                  (FAILED, now, RUNNING, now - STALE_AFTER, MAX_ATTEMPTS))
+        c.execute('''UPDATE ai_jobs SET status=?, started_at=?, attempts=attempts+1
+                     WHERE id = (SELECT id FROM ai_jobs
+                                 WHERE status=? OR (status=? AND started_at < ?)
+                                 ORDER BY id LIMIT 1)
+                     RETURNING id, user, partner, style''',
+                  (RUNNING, now, QUEUED, RUNNING, now - STALE_AFTER))
+        rows = c.fetchall()
+    return rows[0] if rows else None
+
+# ✅ 応答の保存とジョブの完了を1トランザクションで（途中で落ちても応答だけ二重に残らない）
+# 途中経過はここで消すので、画面には途中の本文と確定したメッセージが同時には出ない
+# 失敗したジョブはメッセージを保存しない（エラー文を会話の履歴に混ぜない）
+def finish_job(job_id, user, partner, reply, error=None, first_token_ms=None, duration_ms=None):
+    with db.transaction() as c:
+        message_id = save_message(partner, user, reply) if error is None else None
+        c.execute('''UPDATE ai_jobs SET status=?, finished_at=?, reply_message_id=?, error=?, partial_reply=NULL,
+                         first_token_ms=?, duration_ms=? WHERE id=?''',
+                  (FAILED if error else DONE, now_epoch(), message_id, error, first_token_ms, duration_ms, job_id))
+    return message_id
+
+# ↩️ 保存できなかったジョブを手放す（実行回数が残っていれば queued に戻し、無理なら failed にする）
+# 同じ相手の queued ジョブが既にあれば戻さない（そちらが最新の発言まで読んで応答する）
+def release_job(job_id, error):
+    with db.transaction() as c:
+        c.execute('''UPDATE OR IGNORE ai_jobs SET status=?, started_at=NULL, partial_reply=NULL
+                     WHERE id=? AND status=? AND attempts < ?''', (QUEUED, job_id, RUNNING, MAX_ATTEMPTS))
+        c.execute('''UPDATE ai_jobs SET status=?, finished_at=?, error=?, partial_reply=NULL
+                     WHERE id=? AND status=?''', (FAILED, now_epoch(), error, job_id, RUNNING))
+
+# 💾 finish_job を間をあけて数回試し、それでも失敗したらジョブを手放す（running のまま残さない）
+def _finish(job_id, user, partner, reply, **kwargs):
+    for attempt in range(FINISH_RETRIES):
+        try:
+            return finish_job(job_id, user, partner, reply, **kwargs)
+        except Exception as e:
+            logger.warning("ai job not saved: job=%s attempt=%d: %s", job_id, attempt + 1, e)
+            error = f"{type(e).__name__}: {e}"
+            time.sleep(min(ERROR_BACKOFF_MAX, ERROR_BACKOFF * 2 ** attempt))
+    release_job(job_id, error)
+    return None
+
+# ⚙️ 1件実行（失敗したらジョブを failed にし、画面は reply_error で知らせる）
+# 最初のトークンまでの時間は1件ごとにログに出し、ジョブにも残す（ストリーミングしない場合は全体の時間と同じ）
+# 同じ文脈への応答がキャッシュにあればモデルを呼ばずにそれを返す
+def run_job(job):
+    job_id, user, partner, style = job
+    started = time.perf_counter()
+    try:
+        request = REQUESTS[style](user)
+        key, reply = aicache.lookup(MODEL, request)
+        if reply is not None:
+            duration_ms = round((time.perf_counter() - started) * 1000)
+            logger.info("ai reply: job=%s user=%s cache hit %dms", job_id, user, duration_ms)
+            return _finish(job_id, user, partner, reply, first_token_ms=duration_ms, duration_ms=duration_ms)
+        if STREAM:
+            reply, first_token = stream_reply(request, lambda text: save_partial(job_id, text), user)
+        else:
+            reply = generate_reply(request, user)
+            first_token = time.perf_counter() - started
+        if key is not None and reply:
+            aicache.store(key, MODEL, reply, round((time.perf_counter() - started) * 1000))
+    except Exception as e:
+        duration_ms = round((time.perf_counter() - started) * 1000)
+        logger.warning("ai reply failed: job=%s user=%s %dms: %s", job_id, user, duration_ms, e)
+        return _finish(job_id, user, partner, None, error=f"{type(e).__name__}: {e}", duration_ms=duration_ms)
+    first_token_ms = round(first_token * 1000) if first_token is not None else None
+    duration_ms = round((time.perf_counter() - started) * 1000)
+    logger.info("ai reply: job=%s user=%s ttft=%sms total=%dms stream=%s",
+                job_id, user, first_token_ms, duration_ms, STREAM)
+    return _finish(job_id, user, partner, reply, first_token_ms=first_token_ms, duration_ms=duration_ms)
+
+# 🔁 ワーカー1本分（キューが空なら起こされるか POLL_INTERVAL 経つまで待つ）
+# DB の失敗（ロック待ちの打ち切り等）ではスレッドを終わらせず、ログに出して間をあけてから続ける
+# 手放せなかったジョブは running のまま残るが、STALE_AFTER 後に claim_job が拾い直す
+def _worker_loop(stop):
+    failures = 0
+    while not stop.is_set():
+        try:
+            _wake.clear()
+            job = claim_job()
+            if job is None:
+                _wake.wait(POLL_INTERVAL)
+            else:
+                run_job(job)
+            failures = 0
+        except Exception:
+            logger.exception("ai worker error")
+            stop.wait(min(ERROR_BACKOFF_MAX, ERROR_BACKOFF * 2 ** failures))
+            failures = min(failures + 1, 10)
+
+# 🚀 ワーカースレッドをプロセスごとに1回だけ立てる（再描画のたびには増やさない）
+# 同時にモデルを呼ぶ数はスレッド数（workers）で抑える
+def start_workers(workers=None, stop=None):
+    global _started
+    workers = MAX_WORKERS if workers is None else workers
+    if _started or workers <= 0:
+        return []
+    with _lock:
+        if _started:
+            return []
+        stop = stop or threading.Event()
+        threads = [threading.Thread(target=_worker_loop, args=(stop,), name=f"aiworker-{i}", daemon=True)
+                   for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        _started = True
+        return threads
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from modules.migrations import ensure_schema
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="AI応答のジョブを処理し続ける")
+    parser.add_argument("--workers", type=int, default=max(MAX_WORKERS, 1), help="同時にモデルを呼ぶ数")
+    args = parser.parse_args()
+    ensure_schema()
+    threads = start_workers(args.workers)
+    print(f"aiworker: {len(threads)} workers, base_url={os.getenv('OPENAI_BASE_URL') or 'default'}")
+    for thread in threads:
+        thread.join()
@@ -1,98 +1,171 @@
 import streamlit as st
-import sqlite3
-from modules.utils import now_str, sanitize_message
+from modules import db
+from modules.migrations import ensure_schema
+from modules.tokenizer import tokenize
+from modules.utils import now_epoch, format_jst, sanitize_message
 from modules.user import get_current_user
 
-DB_PATH = "db/mebius.db"
-
 # 定数化（設計意図の明示）
 MAX_TITLE_LEN = 64
 MAX_MESSAGE_LEN = 150
+SEARCH_PAGE_SIZE = 20
+THREAD_PAGE_SIZE = 30
+MESSAGE_PAGE_SIZE = 50
+THREAD_ORDERS = {"recent": "最近の動き順", "new": "新しいスレッド順"}
+TRIGRAM_MIN_LEN = 3   # trigram 索引で引ける最短の語長。これより短い語は単語索引（MeCab の分かち書き）で探す
+RANKED_MAX_HITS = 500   # bm25 で順位付けする一致の上限。ありふれた語は新しい方からこの件数の中で順位付けする
 
 # 🧱 DB初期化（スレッド・メッセージ）
 def init_board_db():
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS threads (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT,
-            created_at TEXT
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS board_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT,
-            message TEXT,
-            timestamp TEXT,
-            thread_id INTEGER
-        )''')
-        conn.commit()
-    finally:
-        conn.close()
+    ensure_schema()
+
+# 一覧・検索で共通の列（id, title, ts_epoch, message_count, last_post_at, last_poster）
+THREAD_COLUMNS = "t.id, t.title, t.ts_epoch, s.message_count, s.last_post_at, s.last_poster"
+
+# ✂️ 単語索引（threads_words / board_messages_words）に入れる本文：MeCab の分かち書きを空白でつなぐ
+# FTS5 の unicode61 は空白で区切るので、1〜2文字の語も1語として引ける
+def index_words(text):
+    return " ".join(tokenize(text or ""))
 
 # 📥 スレッド・メッセージ処理
 def create_thread(title):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute("INSERT INTO threads (title, created_at) VALUES (?, ?)", (title, now_str()))
-        conn.commit()
-    finally:
-        conn.close()
-
-def load_threads():
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute("SELECT id, title, created_at FROM threads ORDER BY id DESC")
-        return c.fetchall()
-    finally:
-        conn.close()
-
-def search_threads(keyword):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute(
-            "SELECT id, title, created_at FROM threads WHERE title LIKE ? ORDER BY id DESC",
-            (f"%{keyword}%",)
-        )
-        return c.fetchall()
-    finally:
-        conn.close()
+    epoch = now_epoch()
+    words = index_words(title)
+    with db.transaction() as c:
+        c.execute("INSERT INTO threads (title, created_at, ts_epoch) VALUES (?, ?, ?)", (title, format_jst(epoch), epoch))
+        thread_id = c.lastrowid
+        c.execute("INSERT INTO threads_words (rowid, words) VALUES (?, ?)", (thread_id, words))
+        # 投稿が無いうちは作成時刻を最終投稿時刻として並べる
+        c.execute("INSERT INTO thread_summaries (thread_id, message_count, last_post_at) VALUES (?, 0, ?)",
+                  (thread_id, epoch))
+
+# 📄 スレッド一覧の1ページ（キーセット方式。cursor は前ページの next_cursor）
+# 戻り値: (rows, next_cursor)。次ページが無ければ next_cursor は None
+def load_threads(order="recent", cursor=None, limit=THREAD_PAGE_SIZE):
+    if order == "recent":
+        where, params = "", ()
+        if cursor is not None:
+            last_post_at, thread_id = cursor
+            where = "WHERE s.last_post_at < ? OR (s.last_post_at = ? AND s.thread_id < ?)"
+            params = (last_post_at, last_post_at, thread_id)
+        rows = db.query(f'''SELECT {THREAD_COLUMNS} FROM thread_summaries s
+                             JOIN threads t ON t.id = s.thread_id
+                             {where}
+                             ORDER BY s.last_post_at DESC, s.thread_id DESC LIMIT ?''', (*params, limit + 1))
+    else:
+        where, params = ("WHERE t.id < ?", (cursor,)) if cursor is not None else ("", ())
+        rows = db.query(f'''SELECT {THREAD_COLUMNS} FROM threads t
+                             LEFT JOIN thread_summaries s ON s.thread_id = t.id
+                             {where}
+                             ORDER BY t.id DESC LIMIT ?''', (*params, limit + 1))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, ((last[4], last[0]) if order == "recent" else last[0])
+
+def _phrase(tokens):
+    return '"' + " ".join(t.replace('"', '""') for t in tokens) + '"'
+
+# ✂️ 順位付けの対象にする最小の rowid（新しい方から RANKED_MAX_HITS 件目。bm25 は一致1件ごとに文書長を読むので、
+# ありふれた語で全件を順位付けすると数万件分かかる）。rowid の降順は索引だけでたどれるので安い
+def _ranked_from(fts, match):
+    return db.query_one(f'''SELECT MIN(rowid) FROM (SELECT rowid FROM {fts} WHERE {fts} MATCH ?
+                                                   ORDER BY rowid DESC LIMIT ?)''', (match, RANKED_MAX_HITS))[0] or 0
 
+# 🔍 スレッド検索（タイトル・本文。関連度順・ページ単位）
+# 3文字以上の語だけなら trigram 索引で部分一致、短い語を含むなら単語索引で語の一致を探す（どちらも bm25 で順位付け）
+# 一致が RANKED_MAX_HITS を超える語は、新しい方からその件数の中だけで順位付けする
+def search_threads(keyword, page=0, page_size=SEARCH_PAGE_SIZE):
+    terms = keyword.split()
+    if not terms:
+        return []
+    if min(len(t) for t in terms) >= TRIGRAM_MIN_LEN:
+        titles, posts = "threads_fts", "board_messages_fts"
+        phrases = [_phrase([t]) for t in terms]
+    else:
+        # 語は索引と同じく分かち書きし、続けて現れる語の並び（フレーズ）として探す
+        titles, posts = "threads_words", "board_messages_words"
+        phrases = [_phrase(tokens) for tokens in map(tokenize, terms) if tokens]
+        if not phrases:
+            return []
+    # 各語を AND 検索。bm25 は小さいほど関連度が高い。タイトル一致を本文一致より優先する
+    match = " ".join(phrases)
+    return db.query(f'''WITH hits (thread_id, score) AS (
+                           SELECT rowid, bm25({titles}) * 2.0 FROM {titles}
+                           WHERE {titles} MATCH ? AND rowid >= ?
+                           UNION ALL
+                           SELECT b.thread_id, bm25({posts}) FROM {posts}
+                           JOIN board_messages b ON b.id = {posts}.rowid
+                           WHERE {posts} MATCH ? AND {posts}.rowid >= ?
+                       )
+                       SELECT {THREAD_COLUMNS} FROM hits h
+                       JOIN threads t ON t.id = h.thread_id
+                       LEFT JOIN thread_summaries s ON s.thread_id = t.id
+                       GROUP BY t.id
+                       ORDER BY MIN(h.score), t.id DESC
+                       LIMIT ? OFFSET ?''', (match, _ranked_from(titles, match), match, _ranked_from(posts, match),
+                                              page_size, page * page_size))
+
+# 💾 投稿と同じトランザクションでスレッド集計と単語索引を進める
 def save_message(username, message, thread_id):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
+    epoch = now_epoch()
+    words = index_words(message)
+    with db.transaction() as c:
         c.execute(
-            "INSERT INTO board_messages (username, message, timestamp, thread_id) VALUES (?, ?, ?, ?)",
-            (username, message, now_str(), thread_id)
+            "INSERT INTO board_messages (username, message, timestamp, ts_epoch, thread_id) VALUES (?, ?, ?, ?, ?)",
+            (username, message, format_jst(epoch), epoch, thread_id)
         )
-        conn.commit()
-    finally:
-        conn.close()
-
-def load_messages(thread_id):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute(
-            "SELECT id, username, message, timestamp FROM board_messages WHERE thread_id=? ORDER BY id DESC",
-            (thread_id,)
-        )
-        return c.fetchall()
-    finally:
-        conn.close()
+        c.execute("INSERT INTO board_messages_words (rowid, words) VALUES (?, ?)", (c.lastrowid, words))
+        c.execute('''INSERT INTO thread_summaries (thread_id, message_count, last_post_at, last_poster)
+                     VALUES (?, 1, ?, ?)
+                     ON CONFLICT (thread_id) DO UPDATE SET message_count=message_count+1,
+                         last_post_at=excluded.last_post_at, last_poster=excluded.last_poster''',
+                  (thread_id, epoch, username))
 
+# 📄 スレッド内の投稿の1ページ（新しい順。before_id より古いもの）
+# 戻り値: (rows, next_before_id)。さらに古い投稿が無ければ next_before_id は None
+def load_messages(thread_id, before_id=None, limit=MESSAGE_PAGE_SIZE):
+    if before_id is None:
+        rows = db.query('''SELECT id, username, message, ts_epoch FROM board_messages
+                           WHERE thread_id=? ORDER BY id DESC LIMIT ?''', (thread_id, limit + 1))
+    else:
+        rows = db.query('''SELECT id, username, message, ts_epoch FROM board_messages
+                           WHERE thread_id=? AND id<? ORDER BY id DESC LIMIT ?''', (thread_id, before_id, limit + 1))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, rows[-1][0]
+
+# 🗑 削除後の最終投稿は (thread_id, id) 索引で1件だけ引き直す
 def delete_message(message_id):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
+    with db.transaction() as c:
+        c.execute("SELECT thread_id FROM board_messages WHERE id=?", (message_id,))
+        row = c.fetchone()
+        if row is None:
+            return
+        thread_id = row[0]
         c.execute("DELETE FROM board_messages WHERE id=?", (message_id,))
-        conn.commit()
-    finally:
-        conn.close()
+        c.execute("DELETE FROM board_messages_words WHERE rowid=?", (message_id,))
+        c.execute("SELECT ts_epoch, username FROM board_messages WHERE thread_id=? ORDER BY id DESC LIMIT 1", (thread_id,))
+        last = c.fetchone()
+        if last is None:
+            c.execute("SELECT ts_epoch FROM threads WHERE id=?", (thread_id,))
+            created = c.fetchone()
+            last = ((created[0] if created else None) or 0, None)
+        c.execute('''UPDATE thread_summaries SET message_count=MAX(message_count-1, 0), last_post_at=?, last_poster=?
+                     WHERE thread_id=?''', (*last, thread_id))
+
+# 📑 キーセット方式のページ送り（セッションにカーソルの積み上げを持つ。先頭ページは None）
+def _pager(key, next_cursor, prev_label, next_label):
+    stack = st.session_state[key]
+    col_prev, col_next = st.columns(2)
+    if len(stack) > 1 and col_prev.button(prev_label, key=f"{key}_prev"):
+        stack.pop()
+        st.rerun()
+    if next_cursor is not None and col_next.button(next_label, key=f"{key}_next"):
+        stack.append(next_cursor)
+        st.rerun()
 
 # 🖥 UI表示
 def render():
@@ -105,13 +178,28 @@ def render():
     st.subheader("🧵 掲示板スレッド一覧")
 
     # 🔍 スレッド検索フォーム
-    search_keyword = st.text_input("🔎 スレッド検索（タイトル）")
+    search_keyword = st.text_input("🔎 スレッド検索（タイトル・本文）")
     if search_keyword:
-        threads = search_threads(search_keyword)
+        if st.session_state.get("search_keyword") != search_keyword:
+            st.session_state.search_keyword = search_keyword
+            st.session_state.search_page = 0
+        page = st.session_state.get("search_page", 0)
+        threads = search_threads(search_keyword, page=page)
         if not threads:
             st.info("該当するスレッドはありません")
+        col_prev, col_next = st.columns(2)
+        if page > 0 and col_prev.button("← 前の検索結果"):
+            st.session_state.search_page = page - 1
+            st.rerun()
+        if len(threads) == SEARCH_PAGE_SIZE and col_next.button("次の検索結果 →"):
+            st.session_state.search_page = page + 1
+            st.rerun()
     else:
-        threads = load_threads()
+        order = st.radio("並び順", list(THREAD_ORDERS), format_func=THREAD_ORDERS.get, horizontal=True)
+        if st.session_state.get("thread_order") != order:
+            st.session_state.thread_order = order
+            st.session_state.thread_cursors = [None]
+        threads, next_cursor = load_threads(order, cursor=st.session_state.thread_cursors[-1])
 
     # スレッド作成フォーム
     with st.form(key="thread_form", clear_on_submit=True):
@@ -129,10 +217,15 @@ def render():
     st.markdown("---")
 
     # スレッド一覧表示
-    for tid, title, created in threads:
-        if st.button(f"{title}（{created} JST）", key=f"thread_{tid}"):
+    for tid, title, created, count, last_post_at, last_poster in threads:
+        label = f"{title}（{count or 0}件・最終 {format_jst(last_post_at or created)} JST"
+        label += f" {last_poster}）" if last_poster else "）"
+        if st.button(label, key=f"thread_{tid}"):
             st.session_state.thread_id = tid
+            st.session_state.message_cursors = [None]
             st.rerun()
+    if not search_keyword:
+        _pager("thread_cursors", next_cursor, "← 前のスレッド", "次のスレッド →")
 
     # スレッド選択後の表示
     if "thread_id" in st.session_state:
@@ -141,22 +234,25 @@ def render():
             del st.session_state.thread_id
             st.rerun()
 
-        messages = load_messages(st.session_state.thread_id)
+        cursors = st.session_state.setdefault("message_cursors", [None])
+        messages, next_before_id = load_messages(st.session_state.thread_id, before_id=cursors[-1])
         for mid, username, msg, ts in messages:
             col1, col2 = st.columns([8, 1])
             with col1:
-                st.write(f"[{ts} JST] **{username}**: {msg}")
+                st.write(f"[{format_jst(ts)} JST] **{username}**: {msg}")
             with col2:
                 if username == user:
                     if st.button("🗑️", key=f"delete_{mid}"):
                         delete_message(mid)
                         st.rerun()
+        _pager("message_cursors", next_before_id, "← 新しい投稿", "古い投稿 →")
 
         # メッセージ送信欄
         msg = st.chat_input(f"メッセージ（{MAX_MESSAGE_LEN}文字まで）")
         if msg:
             msg = sanitize_message(msg, MAX_MESSAGE_LEN)
             save_message(user, msg, st.session_state.thread_id)
+            st.session_state.message_cursors = [None]
             st.rerun()
 
 # メイン
@@ -1,98 +1,32 @@
 # chat.py (OpenAI 1.0対応版)
 import streamlit as st
-import sqlite3
 import os
 from streamlit_autorefresh import st_autorefresh
+from modules import db
+from modules import chatstore
+from modules.chatstore import save_message
+from modules.migrations import ensure_schema
 from modules.user import get_current_user, get_display_name
-from modules.utils import now_str
-from modules.feedback import (
-    init_feedback_db,
-    save_feedback,
-    get_feedback,
-    auto_feedback,
-    question_feedback,
-    silence_feedback,
-    emotion_feedback,
-    response_feedback,
-    length_feedback,
-    diversity_feedback,
-    disclosure_feedback,
-    continuity_feedback,
-    continuity_duration_feedback
-)
+from modules.utils import now_str, format_jst
+from modules.convstats import get_trends
+from modules.feedback import init_feedback_db, save_feedback, get_feedback, feedback_report
+from modules.aiworker import (AI_NAME, STREAM_REFRESH_MS, STREAM_REFRESH_LIMIT, enqueue_reply, pending_reply,
+                              streaming_reply, reply_error, start_workers)
 from dotenv import load_dotenv
 load_dotenv()
 
-# --- OpenAI 新APIクライアント ---
-from openai import OpenAI
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-AI_NAME = "AIアシスタント"
-
 # --- スタンプ ---
 STAMPS = ["😀", "😂", "❤️", "👍", "😢", "🎉", "🔥", "🤔"]
 
 # --- DB ---
-DB_PATH = "db/mebius.db"
-
 def init_chat_db():
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS chat_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT,
-            receiver TEXT,
-            message TEXT,
-            timestamp TEXT,
-            message_type TEXT DEFAULT 'text'
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS friends (
-            user TEXT,
-            friend TEXT,
-            UNIQUE(user, friend)
-        )''')
-        conn.commit()
-    finally:
-        conn.close()
-
-def save_message(sender, receiver, message, message_type="text"):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute("INSERT INTO chat_messages (sender, receiver, message, timestamp, message_type) VALUES (?, ?, ?, ?, ?)",
-                  (sender, receiver, message, now_str(), message_type))
-        conn.commit()
-    finally:
-        conn.close()
-
-def get_messages(user, partner):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute('''SELECT sender, message, message_type FROM chat_messages
-                     WHERE (sender=? AND receiver=?) OR (sender=? AND receiver=?)
-                     ORDER BY timestamp''', (user, partner, partner, user))
-        return c.fetchall()
-    finally:
-        conn.close()
+    ensure_schema()
 
 def get_friends(user):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute("SELECT friend FROM friends WHERE user=?", (user,))
-        return [row[0] for row in c.fetchall()]
-    finally:
-        conn.close()
+    return [row[0] for row in db.query("SELECT friend FROM friends WHERE user=?", (user,))]
 
 def add_friend(user, friend):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute("INSERT OR IGNORE INTO friends (user, friend) VALUES (?, ?)", (user, friend))
-        conn.commit()
-    finally:
-        conn.close()
+    db.execute("INSERT OR IGNORE INTO friends (user, friend, added_at) VALUES (?, ?, ?)", (user, friend, now_str()))
 
 # --- スタンプ画像 ---
 def get_stamp_images():
@@ -101,29 +35,15 @@ def get_stamp_images():
         os.makedirs(stamp_dir)
     return [os.path.join(stamp_dir, f) for f in os.listdir(stamp_dir) if f.lower().endswith((".png", ".jpg", ".jpeg", ".gif"))]
 
-# --- AI応答 ---
-def generate_ai_response(user):
-    messages = get_messages(user, AI_NAME)
-    last_msg = messages[-1][1] if messages else "こんにちは！"
+# --- AI応答（ジョブを積むだけ。応答はワーカーが保存し、自動更新で表示される） ---
+def request_ai_response(user):
+    enqueue_reply(user, "chat")
 
-    try:
-        resp = client.chat.completions.create(
-            model="gpt-5-nano",
-            messages=[
-                {"role": "system", "content": "あなたは親切なチャットAIです。ユーザーの発言に自然に返答してください。"},
-                {"role": "user", "content": last_msg}
-            ],
-            max_tokens=150,
-            temperature=0.7
-        )
-        return resp.choices[0].message.content.strip()
-    except Exception as e:
-        return f"AI応答でエラーが発生しました: {e}"
-    
 # --- メインUI ---
 def render():
     init_chat_db()
     init_feedback_db()
+    start_workers()
 
     user = get_current_user()
     if not user:
@@ -133,8 +53,6 @@ def render():
     st.subheader("💬 1対1チャット空間")
     st.write(f"あなたの表示名： `{get_display_name(user)}`")
 
-    st_autorefresh(interval=3000, limit=100, key="chat_refresh")
-
     # --- 友達追加 ---
     st.markdown("---")
     st.subheader("👥 友達を追加する")
@@ -156,13 +74,24 @@ def render():
     st.session_state.partner = partner
     st.write(f"チャット相手： `{get_display_name(partner) if partner != AI_NAME else AI_NAME}`")
 
+    # AIの応答待ちの間は短い間隔で更新し、生成途中の本文を追いかける
+    # 間隔ごとに key を分け、短い間隔の回数が通常の更新回数の上限を食いつぶさないようにする
+    if partner == AI_NAME and pending_reply(user):
+        st_autorefresh(interval=STREAM_REFRESH_MS, limit=STREAM_REFRESH_LIMIT, key="chat_stream_refresh")
+    else:
+        st_autorefresh(interval=3000, limit=100, key="chat_refresh")
+
     # --- メッセージ履歴 ---
     st.markdown("---")
     st.subheader("📨 メッセージ履歴（自動更新）")
 
-    messages = get_messages(user, partner)
+    # 自動更新では最後に描画したID以降だけを取得してセッションの履歴に足す
+    window, _ = chatstore.session_window(st.session_state, user, partner)
+    if window["has_older"] and st.button("⏪ さらに前のメッセージを読み込む", key="load_older"):
+        chatstore.load_older(window)
+    messages = window["messages"]
     st.markdown("<div style='height:400px; overflow-y:auto; border:1px solid #ccc; padding:10px; background-color:#f9f9f9;'>", unsafe_allow_html=True)
-    for sender, msg, msg_type in messages:
+    for _, sender, msg, msg_type in messages:
         align = "right" if sender == user else "left"
         bg = "#1F2F54" if align == "right" else "#426AB3"
 
@@ -185,7 +114,20 @@ def render():
                 f"{msg}</span></div>",
                 unsafe_allow_html=True
             )
+    partial = streaming_reply(user) if partner == AI_NAME else None
+    if partial:
+        st.markdown(
+            f"<div style='text-align:left; margin:5px 0;'>"
+            f"<span style='background-color:#426AB3; color:#FFFFFF; padding:8px 12px; border-radius:10px; display:inline-block; max-width:80%;'>"
+            f"{partial}▌</span></div>",
+            unsafe_allow_html=True
+        )
     st.markdown("</div>", unsafe_allow_html=True)
+    if partner == AI_NAME and not partial:
+        if pending_reply(user):
+            st.info("🤖 AI考慮中…")
+        elif error := reply_error(user):
+            st.warning(f"⚠️ {error}")
 
     # --- メッセージ入力 ---
     st.markdown("---")
@@ -198,8 +140,7 @@ def render():
         if cols[i].button(stamp, key=f"stamp_{stamp}"):
             save_message(user, partner, stamp)
             if partner == AI_NAME:
-                ai_reply = generate_ai_response(user)
-                save_message(AI_NAME, user, ai_reply)
+                request_ai_response(user)
             st.rerun()
 
     # 画像スタンプ
@@ -213,8 +154,7 @@ def render():
                 if st.button("送信", key=f"send_{i}"):
                     save_message(user, partner, img_path, message_type="stamp")
                     if partner == AI_NAME:
-                        ai_reply = generate_ai_response(user)
-                        save_message(AI_NAME, user, ai_reply)
+                        request_ai_response(user)
                     st.rerun()
     else:
         st.info("スタンプ画像がまだありません。`/stamps/` フォルダに画像を追加してください。")
@@ -239,23 +179,31 @@ def render():
         else:
             save_message(user, partner, new_msg)
             if partner == AI_NAME:
-                ai_reply = generate_ai_response(user)
-                save_message(AI_NAME, user, ai_reply)
+                request_ai_response(user)
             st.rerun()
 
     # --- AIフィードバック ---
     st.markdown("---")
     st.markdown("### 🤖 AIフィードバック")
-    st.write("・会話の長さ：" + length_feedback(user, partner))
-    st.write("・会話の連続性：" + continuity_feedback(user, partner))
-    st.write("・沈黙の余白：" + silence_feedback(user, partner))
-    st.write("・応答率：" + response_feedback(user, partner))
-    st.write("・発言割合：" + auto_feedback(user, partner))
-    st.write("・問いの頻度：" + question_feedback(user, partner))
-    st.write("・感情語の使用：" + emotion_feedback(user, partner))
-    st.write("・自己開示度：" + disclosure_feedback(user, partner))
-    st.write("・話題の広がり：" + diversity_feedback(user, partner))
-    st.write("・関係性の継続性：" + continuity_duration_feedback(user, partner))
+    for label, text in feedback_report(user, partner):   # 新着が無ければキャッシュから
+        st.write(f"・{label}：{text}")
+
+    # --- 関係性の推移（日・週ごとの集計表から） ---
+    with st.expander("📈 関係性の推移"):
+        period = st.radio("集計単位", ["week", "day"], format_func={"week": "週ごと", "day": "日ごと"}.get,
+                          horizontal=True, key="trend_period")
+        trends = get_trends(user, partner, period=period)
+        if trends:
+            dates = [format_jst(t["bucket_start"])[:10] for t in trends]
+            st.line_chart({"期間": dates,
+                           "メッセージ数": [t["message_count"] for t in trends],
+                           "あなたの感情語": [t["emotion_count"] for t in trends]}, x="期間")
+            st.line_chart({"期間": dates,
+                           "間隔の中央値（秒）": [t["median_gap"] or 0 for t in trends]}, x="期間")
+            st.line_chart({"期間": dates,
+                           "問いの割合": [t["question_ratio"] for t in trends]}, x="期間")
+        else:
+            st.caption("まだ推移を表示できるほどの会話がありません")
 
     # --- 手動フィードバック ---
     st.markdown("---")
@@ -1,19 +1,20 @@
 # chatkai_newapi_autorefresh_ai_status.py
 import streamlit as st
-import sqlite3
 import os
+from modules import db
+from modules import chatstore
+from modules.chatstore import save_message
+from modules.migrations import ensure_schema
 from modules.user import get_current_user, get_display_name, get_all_users
 from modules.utils import now_str
 from modules.feedback import init_feedback_db, save_feedback, get_feedback
+from modules.aiworker import (AI_NAME, STREAM_REFRESH_MS, enqueue_reply, pending_reply, streaming_reply, reply_error,
+                              start_workers)
 from dotenv import load_dotenv
-from openai import OpenAI
 from streamlit_autorefresh import st_autorefresh
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-AI_NAME = "AIアシスタント"
-
 STAMPS = [
     "😀","😂","❤️","👍","😢","🎉","🔥","🤔",
     "🥰","😎","🙌","💀","🌟","🍕","☕","🛹",
@@ -21,69 +22,18 @@ STAMPS = [
     "🦁","🐮","🐷","🐸","🐵","🦄"
 ]
 
-DB_PATH = "db/mebius.db"
-
 # --- DB初期化 ---
 def init_chat_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS chat_messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        sender TEXT,
-        receiver TEXT,
-        message TEXT,
-        timestamp TEXT,
-        message_type TEXT DEFAULT 'text'
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS friends (
-        user TEXT,
-        friend TEXT,
-        UNIQUE(user, friend)
-    )''')
-    conn.commit()
-    conn.close()
-
-def save_message(sender, receiver, message, message_type="text"):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO chat_messages (sender, receiver, message, timestamp, message_type) VALUES (?, ?, ?, ?, ?)",
-        (sender, receiver, message, now_str(), message_type)
-    )
-    conn.commit()
-    conn.close()
-
-def get_messages(user, partner):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''SELECT sender, message, message_type FROM chat_messages
-                 WHERE (sender=? AND receiver=?) OR (sender=? AND receiver=?)
-                 ORDER BY timestamp''', (user, partner, partner, user))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    ensure_schema()
 
 def get_friends(user):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT friend FROM friends WHERE user=?", (user,))
-    res = [r[0] for r in c.fetchall()]
-    conn.close()
-    return res
+    return [r[0] for r in db.query("SELECT friend FROM friends WHERE user=?", (user,))]
 
 def add_friend(user, friend):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO friends (user, friend) VALUES (?, ?)", (user, friend))
-    conn.commit()
-    conn.close()
+    db.execute("INSERT OR IGNORE INTO friends (user, friend, added_at) VALUES (?, ?, ?)", (user, friend, now_str()))
 
 def remove_friend(user, friend):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM friends WHERE user=? AND friend=?", (user, friend))
-    conn.commit()
-    conn.close()
+    db.execute("DELETE FROM friends WHERE user=? AND friend=?", (user, friend))
 
 def get_stamp_images():
     stamp_dir = "stamps"
@@ -92,25 +42,16 @@ def get_stamp_images():
     return [os.path.join(stamp_dir, f) for f in os.listdir(stamp_dir)
             if f.lower().endswith((".png", ".jpg", ".jpeg", ".gif"))]
 
-# --- AI応答生成 ---
-def generate_ai_response(user):
-    messages = get_messages(user, AI_NAME)
-    messages_for_ai = [{"role": "user", "content": msg} for _, msg, _ in messages[-5:]] or [{"role": "user", "content": "こんにちは！"}]
-    try:
-        resp = client.chat.completions.create(
-            model="gpt-5-nano",
-            messages=[{"role": "system", "content": "あなたは親切な日本語のチャットAIです。"}] + messages_for_ai,
-            max_completion_tokens=150
-        )
-        return resp.choices[0].message.content.strip()
-    except Exception as e:
-        return f"AI応答でエラーが発生しました: {e}"
+# --- AI応答（ジョブを積むだけ。応答はワーカーが保存し、自動更新で表示される） ---
+def request_ai_response(user):
+    enqueue_reply(user, "chatkai")
 
 # --- メインUI ---
 def render():
     st.set_page_config(page_title="1対1チャット", layout="wide")
     init_chat_db()
     init_feedback_db()
+    start_workers()
 
     user = get_current_user()
     if not user:
@@ -149,15 +90,18 @@ def render():
     st.subheader("📨 メッセージ履歴")
 
     # --- 自動更新 ---
-    st_autorefresh(interval=3000, key="auto_refresh")  # 3秒ごと更新
+    # 3秒ごと更新。AIの応答待ちの間は短い間隔で更新し、生成途中の本文を追いかける
+    st_autorefresh(interval=STREAM_REFRESH_MS if partner == AI_NAME and pending_reply(user) else 3000, key="auto_refresh")
     chat_placeholder = st.empty()
-    ai_status_placeholder = st.empty()  # AI考慮中表示用
+    ai_status_placeholder = st.empty()  # AI考慮中表示用（ジョブの状態はDBにあるので、どの再描画からも見える）
 
     # --- チャット描画 ---
     def render_chat():
-        messages = get_messages(user, partner)
+        # 最後に描画したID以降だけを取得してセッションの履歴に足す
+        window, _ = chatstore.session_window(st.session_state, user, partner)
+        messages = window["messages"]
         chat_box_html = "<div id='chat-box' style='height:400px; overflow-y:auto; border:1px solid #ccc; padding:10px; background-color:#000; color:white;'>"
-        for sender, msg, msg_type in messages:
+        for _, sender, msg, msg_type in messages:
             align = "right" if sender == user else "left"
             bg = "#1F2F54" if align == "right" else "#333"
             if msg_type == "stamp" and os.path.exists(msg):
@@ -166,6 +110,9 @@ def render():
                 chat_box_html += f"<div style='text-align:{align}; margin:5px 0; font-size:40px;'>{msg}</div>"
             else:
                 chat_box_html += f"<div style='text-align:{align}; margin:5px 0;'><span style='background-color:{bg}; color:white; padding:8px 12px; border-radius:10px; display:inline-block; max-width:80%;'>{msg}</span></div>"
+        partial = streaming_reply(user) if partner == AI_NAME else None
+        if partial:
+            chat_box_html += f"<div style='text-align:left; margin:5px 0;'><span style='background-color:#333; color:white; padding:8px 12px; border-radius:10px; display:inline-block; max-width:80%;'>{partial}▌</span></div>"
         chat_box_html += "</div>"
         chat_box_html += """
         <script>
@@ -176,6 +123,15 @@ def render():
         </script>
         """
         chat_placeholder.markdown(chat_box_html, unsafe_allow_html=True)
+        error = reply_error(user) if partner == AI_NAME and not partial else None
+        if partner == AI_NAME and not partial and pending_reply(user):
+            ai_status_placeholder.info("🤖 AI考慮中…")
+        elif error:
+            ai_status_placeholder.warning(f"⚠️ {error}")
+        else:
+            ai_status_placeholder.empty()
+
+    render_chat()
 
     # --- スタンプ（テキスト） ---
     st.markdown("#### 🙂 テキストスタンプ")
@@ -185,12 +141,7 @@ def render():
             if cols[i].button(stamp, key=f"stamp_{stamp}_{row}"):
                 save_message(user, partner, stamp)
                 if partner == AI_NAME:
-                    st.session_state.ai_busy = True
-                    ai_status_placeholder.info("🤖 AI考慮中…")
-                    ai_reply = generate_ai_response(user)
-                    save_message(AI_NAME, user, ai_reply)
-                    st.session_state.ai_busy = False
-                    ai_status_placeholder.empty()
+                    request_ai_response(user)
                 render_chat()
 
     # --- 画像スタンプ ---
@@ -204,12 +155,7 @@ def render():
                 if st.button("送信", key=f"send_img_{i}"):
                     save_message(user, partner, img_path, message_type="stamp")
                     if partner == AI_NAME:
-                        st.session_state.ai_busy = True
-                        ai_status_placeholder.info("🤖 AI考慮中…")
-                        ai_reply = generate_ai_response(user)
-                        save_message(AI_NAME, user, ai_reply)
-                        st.session_state.ai_busy = False
-                        ai_status_placeholder.empty()
+                        request_ai_response(user)
                     render_chat()
     else:
         st.info("スタンプ画像を /stamps/ フォルダに追加してください。")
@@ -219,12 +165,7 @@ def render():
     if new_msg:
         save_message(user, partner, new_msg)
         if partner == AI_NAME:
-            st.session_state.ai_busy = True
-            ai_status_placeholder.info("🤖 AI考慮中…")
-            ai_reply = generate_ai_response(user)
-            save_message(AI_NAME, user, ai_reply)
-            st.session_state.ai_busy = False
-            ai_status_placeholder.empty()
+            request_ai_response(user)
         render_chat()
 
     # --- フィードバック ---
@@ -247,6 +188,4 @@ def render():
         st.write("まだフィードバックはありません。")
 
 if __name__ == "__main__":
-    if "ai_busy" not in st.session_state:
-        st.session_state.ai_busy = False
     render()
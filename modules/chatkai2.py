@@ -4,62 +4,22 @@ import streamlit as st
 import sqlite3
 import os
 import bcrypt
-from datetime import datetime
 from dotenv import load_dotenv
 from streamlit_autorefresh import st_autorefresh
+from modules import db, chatstore
+from modules.utils import now_str, now_epoch, format_jst
+from modules.migrations import ensure_schema
 
 load_dotenv()
 
-DB_PATH = "db/mebius.db"
 STAMPS = ["😀","😂","❤️","👍","😢","🎉","🔥","🤔",
           "🥰","😎","🙌","💀","🌟","🍕","☕","🛹",
           "🐶","🐱","🐭","🐹","🐰","🦊","🐻","🐼",
           "🦁","🐮","🐷","🐸","🐵","🦄"]
 
-# --- 共通ユーティリティ ---
-def now_str():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
 # --- DB初期化 ---
 def init_db():
-    os.makedirs("db", exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        username TEXT PRIMARY KEY,
-        password TEXT,
-        display_name TEXT,
-        kari_id TEXT,
-        registered_at TEXT
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS friends (
-        user TEXT,
-        friend TEXT,
-        UNIQUE(user, friend)
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS chat_messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        sender TEXT,
-        receiver TEXT,
-        message TEXT,
-        timestamp TEXT,
-        message_type TEXT DEFAULT 'text',
-        is_read INTEGER DEFAULT 0
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS message_reactions (
-        message_id INTEGER,
-        user TEXT,
-        reaction TEXT,
-        PRIMARY KEY (message_id, user)
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS feedback (
-        sender TEXT,
-        receiver TEXT,
-        feedback TEXT,
-        timestamp TEXT
-    )''')
-    conn.commit()
-    conn.close()
+    ensure_schema()
 
 # --- ユーザー管理 ---
 def register_user(username, password, display_name="", kari_id=""):
@@ -68,24 +28,15 @@ def register_user(username, password, display_name="", kari_id=""):
     if not username or not password:
         return "ユーザー名とパスワードを入力してください"
     hashed_pw = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
-    conn = sqlite3.connect(DB_PATH)
     try:
-        c = conn.cursor()
-        c.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?)",
-                  (username, hashed_pw, display_name, kari_id, now_str()))
-        conn.commit()
+        db.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?)",
+                   (username, hashed_pw, display_name, kari_id, now_str()))
         return "OK"
     except sqlite3.IntegrityError:
         return "このユーザー名は既に使われています"
-    finally:
-        conn.close()
 
 def login_user(username, password):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT password FROM users WHERE username=?", (username,))
-    result = c.fetchone()
-    conn.close()
+    result = db.query_one("SELECT password FROM users WHERE username=?", (username,))
     if result and bcrypt.checkpw(password.encode("utf-8"), result[0]):
         st.session_state.username = username
         return True
@@ -95,71 +46,33 @@ def get_current_user():
     return st.session_state.get("username", None)
 
 def get_display_name(username):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT display_name FROM users WHERE username=?", (username,))
-    result = c.fetchone()
-    conn.close()
+    result = db.query_one("SELECT display_name FROM users WHERE username=?", (username,))
     return result[0] if result and result[0] else username
 
 def get_all_users():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT username FROM users ORDER BY username")
-    users = [row[0] for row in c.fetchall()]
-    conn.close()
-    return users
+    return [row[0] for row in db.query("SELECT username FROM users ORDER BY username")]
 
 # --- チャット機能 ---
 def save_message(sender, receiver, message, message_type="text"):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO chat_messages (sender, receiver, message, timestamp, message_type) VALUES (?, ?, ?, ?, ?)",
-              (sender, receiver, message, now_str(), message_type))
-    conn.commit()
-    conn.close()
+    chatstore.save_message(sender, receiver, message, message_type)
 
 def get_messages(user, partner):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''SELECT id, sender, message, message_type FROM chat_messages
-                 WHERE (sender=? AND receiver=?) OR (sender=? AND receiver=?)
-                 ORDER BY timestamp''', (user, partner, partner, user))
-    rows = c.fetchall()
-    c.execute("UPDATE chat_messages SET is_read=1 WHERE receiver=? AND sender=? AND is_read=0", (user, partner))
-    conn.commit()
-    conn.close()
+    rows = chatstore.get_messages(user, partner)
+    if rows:
+        chatstore.mark_read(user, partner, rows[-1][0])
     return rows
 
 def get_unread_count(user, partner):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM chat_messages WHERE receiver=? AND sender=? AND is_read=0", (user, partner))
-    count = c.fetchone()[0]
-    conn.close()
-    return count
+    return chatstore.get_unread_counts(user).get(partner, 0)
 
 def get_friends(user):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT friend FROM friends WHERE user=?", (user,))
-    res = [r[0] for r in c.fetchall()]
-    conn.close()
-    return res
+    return [r[0] for r in db.query("SELECT friend FROM friends WHERE user=?", (user,))]
 
 def add_friend(user, friend):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO friends (user, friend) VALUES (?, ?)", (user, friend))
-    conn.commit()
-    conn.close()
+    db.execute("INSERT OR IGNORE INTO friends (user, friend, added_at) VALUES (?, ?, ?)", (user, friend, now_str()))
 
 def remove_friend(user, friend):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM friends WHERE user=? AND friend=?", (user, friend))
-    conn.commit()
-    conn.close()
+    db.execute("DELETE FROM friends WHERE user=? AND friend=?", (user, friend))
 
 def get_stamp_images():
     stamp_dir = "stamps"
@@ -168,37 +81,40 @@ def get_stamp_images():
     return [os.path.join(stamp_dir, f) for f in os.listdir(stamp_dir)
             if f.lower().endswith((".png", ".jpg", ".jpeg", ".gif"))]
 
+# INSERT OR REPLACE だと削除トリガーが走らないため UPSERT にする（件数はトリガーで維持）
 def save_reaction(message_id, user, reaction):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO message_reactions VALUES (?, ?, ?)", (message_id, user, reaction))
-    conn.commit()
-    conn.close()
+    db.execute('''INSERT INTO message_reactions (message_id, user, reaction) VALUES (?, ?, ?)
+                  ON CONFLICT (message_id, user) DO UPDATE SET reaction=excluded.reaction''',
+               (message_id, user, reaction))
 
 def get_reactions(message_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT reaction, COUNT(*) FROM message_reactions WHERE message_id=? GROUP BY reaction", (message_id,))
-    results = c.fetchall()
-    conn.close()
+    return db.query("SELECT reaction, count FROM message_reaction_counts WHERE message_id=? ORDER BY reaction",
+                    (message_id,))
+
+# 表示中のメッセージ全件分のリアクション数を1回の問い合わせで取得
+# 戻り値: {message_id: [(reaction, count), ...]}
+def get_reactions_bulk(message_ids, chunk=500):
+    results = {}
+    message_ids = list(message_ids)
+    for start in range(0, len(message_ids), chunk):
+        ids = message_ids[start:start + chunk]
+        placeholders = ",".join("?" * len(ids))
+        rows = db.query(f'''SELECT message_id, reaction, count FROM message_reaction_counts
+                            WHERE message_id IN ({placeholders}) ORDER BY message_id, reaction''', ids)
+        for message_id, reaction, count in rows:
+            results.setdefault(message_id, []).append((reaction, count))
     return results
 
 # --- フィードバック ---
 def save_feedback(sender, receiver, feedback):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO feedback VALUES (?, ?, ?, ?)", (sender, receiver, feedback, now_str()))
-    conn.commit()
-    conn.close()
+    epoch = now_epoch()
+    db.execute("INSERT INTO feedback (sender, receiver, feedback, timestamp, ts_epoch) VALUES (?, ?, ?, ?, ?)",
+               (sender, receiver, feedback, format_jst(epoch), epoch))
 
 def get_feedback(sender, receiver):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT feedback, timestamp FROM feedback WHERE sender=? AND receiver=? ORDER BY timestamp DESC",
-              (sender, receiver))
-    results = c.fetchall()
-    conn.close()
-    return results
+    rows = db.query("SELECT feedback, ts_epoch FROM feedback WHERE sender=? AND receiver=? ORDER BY ts_epoch DESC",
+                    (sender, receiver))
+    return [(fb, format_jst(ts)) for fb, ts in rows]
 
 # --- メインUI ---
 # --- チャット描画（初期表示） ---
@@ -236,12 +152,16 @@ def render():
         st.success(f"{new_friend} を削除しました")
 
     friends = get_friends(user)
-    partner = st.selectbox("チャット相手を選択", friends)
+    unread_counts = chatstore.get_unread_counts(user)
+    partner = st.selectbox(
+        "チャット相手を選択", friends,
+        format_func=lambda f: f"{f}（未読 {unread_counts[f]}）" if f in unread_counts else f
+    )
 
     if not partner:
         return
 
-    unread = get_unread_count(user, partner)
+    unread = unread_counts.get(partner, 0)
     if unread:
         st.info(f"📩 {unread}件の未読メッセージがあります")
 
@@ -249,10 +169,20 @@ def render():
     st.markdown("---")
     st.subheader("📨 メッセージ履歴")
     st_autorefresh(interval=3000, key="auto_refresh")
+
+    # 読み込み済みの範囲（最新ページ＋「さらに前」で足したページ）だけを描画する
+    # 自動更新では最後に描画したID以降だけを取り、新着が無ければ既読更新も省く
+    window, changed = chatstore.session_window(st.session_state, user, partner)
+    if changed and window["messages"]:
+        chatstore.mark_read(user, partner, window["messages"][-1][0])
+
+    if window["has_older"] and st.button("⏪ さらに前のメッセージを読み込む", key="load_older"):
+        chatstore.load_older(window)
     chat_placeholder = st.empty()
 
     def render_chat():
-        messages = get_messages(user, partner)
+        messages = window["messages"]
+        reactions_by_id = get_reactions_bulk(m[0] for m in messages)
         chat_box_html = """
         <div id='chat-box' style='height:400px; overflow-y:auto; border:1px solid #ccc;
                                  padding:10px; background-color:#000; color:white;'>
@@ -283,7 +213,7 @@ def render():
                 </div>
                 """
 
-            reactions = get_reactions(msg_id)
+            reactions = reactions_by_id.get(msg_id)
             if reactions:
                 reaction_str = " ".join([f"{r}×{n}" for r, n in reactions])
                 chat_box_html += f"""
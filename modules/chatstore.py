@@ -0,0 +1,258 @@
+# chatstore.py（1対1チャットの保存・取得の共通処理）
+from modules import db
+import math
+
+from modules.keywords import message_features
+from modules.utils import now_epoch, format_jst, day_start, week_start
+
+# 定数（会話の種類ごとにテーブルを分ける）
+CHAT = "chat"
+KARI = "kari"
+MESSAGE_TABLES = {CHAT: "chat_messages", KARI: "kari_messages"}
+PAGE_SIZE = 50            # 1ページ（初回表示・「さらに前を読み込む」1回分）の件数
+# 推移の集計単位 → 期間の開始時刻（"all" は会話全体を1区間にまとめたもの。間隔の中央値を画面で出すのに使う）
+ROLLUP_PERIODS = {"day": day_start, "week": week_start, "all": lambda epoch: 0}
+GAP_BINS_PER_OCTAVE = 4   # 間隔の度数分布の細かさ（2倍ごとに4区間。中央値の誤差は1割未満）
+
+# 会話IDは一度決まれば変わらないので、プロセス内で使い回す
+_conversation_ids = {}
+
+# 🔑 会話キー（順序に依存しない2者の組）
+def pair_key(a, b):
+    return (a, b) if a <= b else (b, a)
+
+# 🔑 会話IDの取得（create=True なら無ければ作る）
+def conversation_id(a, b, space=CHAT, create=False):
+    user_a, user_b = pair_key(a, b)
+    key = (space, user_a, user_b)
+    cached = _conversation_ids.get(key)
+    if cached is not None:
+        return cached
+
+    row = db.query_one("SELECT id FROM conversations WHERE space=? AND user_a=? AND user_b=?", key)
+    if row is None and create:
+        with db.transaction() as c:
+            c.execute("INSERT OR IGNORE INTO conversations (space, user_a, user_b) VALUES (?, ?, ?)", key)
+            c.execute("SELECT id FROM conversations WHERE space=? AND user_a=? AND user_b=?", key)
+            row = c.fetchone()
+    if row is None:
+        return None
+    _conversation_ids[key] = row[0]
+    return row[0]
+
+# 💾 メッセージ保存（保存したメッセージIDを返す）
+def save_message(sender, receiver, message, message_type="text"):
+    conv_id = conversation_id(sender, receiver, create=True)
+    epoch = now_epoch()
+    with db.transaction() as c:
+        c.execute('''INSERT INTO chat_messages (sender, receiver, message, timestamp, ts_epoch, message_type, conversation_id)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                  (sender, receiver, message, format_jst(epoch), epoch, message_type, conv_id))
+        message_id = c.lastrowid
+        touch_conversation(c, conv_id, message_id)
+        gap = update_aggregates(c, conv_id, sender, message, epoch)
+        update_rollups(c, conv_id, sender, message, epoch, gap)
+        return message_id
+
+# 🕒 会話の最新メッセージIDを進める（保存と同じトランザクション内で呼ぶ）
+def touch_conversation(c, conv_id, message_id):
+    c.execute("UPDATE conversations SET last_message_id=? WHERE id=?", (message_id, conv_id))
+
+# 📊 会話の集計を1件分進める（保存と同じトランザクション内で呼ぶ）
+# 直前の発言者と時刻だけ覚えておけば、話者交代・応答・間隔は差分で足せる
+# 戻り値: 直前の発言からの間隔（秒）。最初の発言・時刻が欠けている場合は None
+def update_aggregates(c, conv_id, sender, message, epoch):
+    c.execute("SELECT last_sender, last_ts FROM conversation_aggregates WHERE conversation_id=?", (conv_id,))
+    prev = c.fetchone()
+    switched = int(prev is not None and prev[0] != sender)
+    gap = epoch - prev[1] if prev is not None and prev[1] is not None and epoch is not None else None
+    question, emotion, disclosure = message_features(message)
+    c.execute('''INSERT INTO conversation_aggregates
+                     (conversation_id, message_count, switch_count, gap_sum, first_ts, last_ts, last_sender)
+                 VALUES (?, 1, 0, 0, ?, ?, ?)
+                 ON CONFLICT (conversation_id) DO UPDATE SET
+                     message_count=message_count+1, switch_count=switch_count+?, gap_sum=gap_sum+?,
+                     last_ts=excluded.last_ts, last_sender=excluded.last_sender''',
+              (conv_id, epoch, epoch, sender, switched, gap or 0))
+    c.execute('''INSERT INTO conversation_sender_aggregates
+                     (conversation_id, sender, message_count, question_count, emotion_count, disclosure_count, response_count)
+                 VALUES (?, ?, 1, ?, ?, ?, ?)
+                 ON CONFLICT (conversation_id, sender) DO UPDATE SET
+                     message_count=message_count+1,
+                     question_count=question_count+excluded.question_count,
+                     emotion_count=emotion_count+excluded.emotion_count,
+                     disclosure_count=disclosure_count+excluded.disclosure_count,
+                     response_count=response_count+excluded.response_count''',
+              (conv_id, sender, question, emotion, disclosure, switched))
+    return gap
+
+# 📈 日・週ごとの推移を1件分進める（保存と同じトランザクション内で呼ぶ）
+# 間隔はこの発言の送り手の行に数え、中央値は度数分布（対数目盛）から求める
+def update_rollups(c, conv_id, sender, message, epoch, gap):
+    if epoch is None:
+        return
+    question, emotion, disclosure = message_features(message)
+    gap_bin = gap_bin_of(gap) if gap is not None else None
+    for period, bucket_of in ROLLUP_PERIODS.items():
+        bucket = bucket_of(epoch)
+        c.execute('''INSERT INTO conversation_rollups
+                         (conversation_id, period, bucket_start, sender, message_count, question_count, emotion_count)
+                     VALUES (?, ?, ?, ?, 1, ?, ?)
+                     ON CONFLICT (conversation_id, period, bucket_start, sender) DO UPDATE SET
+                         message_count=message_count+1,
+                         question_count=question_count+excluded.question_count,
+                         emotion_count=emotion_count+excluded.emotion_count''',
+                  (conv_id, period, bucket, sender, question, emotion))
+        if gap_bin is not None:
+            c.execute('''INSERT INTO conversation_rollup_gaps (conversation_id, period, bucket_start, sender, gap_bin, count)
+                         VALUES (?, ?, ?, ?, ?, 1)
+                         ON CONFLICT (conversation_id, period, bucket_start, sender, gap_bin) DO UPDATE SET
+                             count=count+1''',
+                      (conv_id, period, bucket, sender, gap_bin))
+
+# 📐 間隔（秒）→ 度数分布の区間番号と、その区間の代表値（対数目盛の中点）
+def gap_bin_of(gap):
+    return int(GAP_BINS_PER_OCTAVE * math.log2(max(gap, 0) + 1))
+
+def gap_bin_value(gap_bin):
+    return 2 ** ((gap_bin + 0.5) / GAP_BINS_PER_OCTAVE) - 1
+
+# 🔁 会話の集計を履歴から作り直す（conv_ids を省略すると全会話）
+# 戻り値: 作り直した会話数
+def rebuild_aggregates(c, conv_ids=None):
+    if conv_ids is None:
+        c.execute("SELECT id FROM conversations WHERE space=?", (CHAT,))
+        conv_ids = [row[0] for row in c.fetchall()]
+    for conv_id in conv_ids:
+        c.execute("DELETE FROM conversation_aggregates WHERE conversation_id=?", (conv_id,))
+        c.execute("DELETE FROM conversation_sender_aggregates WHERE conversation_id=?", (conv_id,))
+        c.execute("SELECT sender, message, ts_epoch FROM chat_messages WHERE conversation_id=? ORDER BY id", (conv_id,))
+        for sender, message, epoch in c.fetchall():
+            update_aggregates(c, conv_id, sender, message, epoch)
+    return len(conv_ids)
+
+# 🔁 日・週ごとの推移を履歴から作り直す（conv_ids を省略すると全会話）
+# 戻り値: 作り直した会話数
+def rebuild_rollups(c, conv_ids=None):
+    if conv_ids is None:
+        c.execute("SELECT id FROM conversations WHERE space=?", (CHAT,))
+        conv_ids = [row[0] for row in c.fetchall()]
+    for conv_id in conv_ids:
+        c.execute("DELETE FROM conversation_rollups WHERE conversation_id=?", (conv_id,))
+        c.execute("DELETE FROM conversation_rollup_gaps WHERE conversation_id=?", (conv_id,))
+        c.execute("SELECT sender, message, ts_epoch FROM chat_messages WHERE conversation_id=? ORDER BY id", (conv_id,))
+        prev_epoch = None
+        for sender, message, epoch in c.fetchall():
+            gap = epoch - prev_epoch if epoch is not None and prev_epoch is not None else None
+            update_rollups(c, conv_id, sender, message, epoch, gap)
+            prev_epoch = epoch
+    return len(conv_ids)
+
+# 👀 新着の有無だけを確かめる安価な問い合わせ（主キー1件参照）
+def last_message_id(user, partner, space=CHAT):
+    conv_id = conversation_id(user, partner, space=space)
+    if conv_id is None:
+        return 0
+    row = db.query_one("SELECT last_message_id FROM conversations WHERE id=?", (conv_id,))
+    return (row[0] or 0) if row else 0
+
+# 📥 after_id より新しいメッセージだけを取得
+def get_since(user, partner, after_id):
+    conv_id = conversation_id(user, partner)
+    if conv_id is None:
+        return []
+    return db.query('''SELECT id, sender, message, message_type FROM chat_messages
+                       WHERE conversation_id=? AND id>? ORDER BY id''', (conv_id, after_id))
+
+# 📥 履歴取得（id, sender, message, message_type）
+def get_messages(user, partner):
+    conv_id = conversation_id(user, partner)
+    if conv_id is None:
+        return []
+    return db.query('''SELECT id, sender, message, message_type FROM chat_messages
+                       WHERE conversation_id=? ORDER BY id''', (conv_id,))
+
+# 📄 履歴の1ページ取得（before_id より古い最新 limit 件を古い順で返す）
+# 戻り値: (rows, has_older)
+def get_page(user, partner, before_id=None, limit=PAGE_SIZE):
+    conv_id = conversation_id(user, partner)
+    if conv_id is None:
+        return [], False
+    if before_id is None:
+        rows = db.query('''SELECT id, sender, message, message_type FROM chat_messages
+                           WHERE conversation_id=? ORDER BY id DESC LIMIT ?''', (conv_id, limit + 1))
+    else:
+        rows = db.query('''SELECT id, sender, message, message_type FROM chat_messages
+                           WHERE conversation_id=? AND id<? ORDER BY id DESC LIMIT ?''', (conv_id, before_id, limit + 1))
+    has_older = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, has_older
+
+# 🪟 表示ウィンドウ（読み込み済みの範囲だけを保持する。UI側でセッションに置く）
+def open_window(user, partner, limit=PAGE_SIZE):
+    rows, has_older = get_page(user, partner, limit=limit)
+    return {"user": user, "partner": partner, "messages": rows, "has_older": has_older}
+
+# ⏪ さらに前のページを先頭に足す
+def load_older(window, limit=PAGE_SIZE):
+    messages = window["messages"]
+    if not messages:
+        return window
+    rows, has_older = get_page(window["user"], window["partner"], before_id=messages[0][0], limit=limit)
+    window["messages"] = rows + messages
+    window["has_older"] = has_older
+    return window
+
+# 🔄 最後に描画したID以降だけを取得して末尾に足す（新着が無ければDBを読まない）
+# 戻り値: 新着があったかどうか
+def refresh_window(window):
+    messages = window["messages"]
+    last_id = messages[-1][0] if messages else 0
+    if last_message_id(window["user"], window["partner"]) <= last_id:
+        return False
+    rows = get_since(window["user"], window["partner"], last_id)
+    messages.extend(rows)
+    return bool(rows)
+
+# 📩 既読位置を進める（進むときだけ書き込む）
+def mark_read(user, partner, last_id):
+    conv_id = conversation_id(user, partner)
+    if conv_id is None or not last_id:
+        return
+    db.execute('''INSERT INTO read_markers (user, conversation_id, last_read_id) VALUES (?, ?, ?)
+                  ON CONFLICT (user, conversation_id) DO UPDATE SET last_read_id=excluded.last_read_id
+                  WHERE excluded.last_read_id > read_markers.last_read_id''',
+               (user, conv_id, last_id))
+
+# 📩 全ての相手についての未読数を1回の問い合わせで取得
+# 新着の無い会話は conversations.last_message_id と既読位置の比較だけで除外する
+# 戻り値: {partner: 未読数}（未読のある相手のみ）
+def get_unread_counts(user):
+    rows = db.query('''WITH mine (id, partner, last_message_id) AS (
+                           SELECT id, user_b, last_message_id FROM conversations WHERE space=? AND user_a=?
+                           UNION ALL
+                           SELECT id, user_a, last_message_id FROM conversations WHERE space=? AND user_b=?
+                       )
+                       SELECT mine.partner,
+                              (SELECT COUNT(*) FROM chat_messages m
+                               WHERE m.conversation_id=mine.id AND m.receiver=?
+                                 AND m.id > COALESCE(r.last_read_id, 0))
+                       FROM mine
+                       LEFT JOIN read_markers r ON r.user=? AND r.conversation_id=mine.id
+                       WHERE mine.last_message_id > COALESCE(r.last_read_id, 0)''',
+                    (CHAT, user, CHAT, user, user, user))
+    return {partner: count for partner, count in rows if count}
+
+# 🗂 セッションに置いたウィンドウを取り出して新着だけ反映する
+# state は st.session_state（dict と同じ操作ができるもの）
+# 戻り値: (window, 新たに開いたか新着があったか)
+def session_window(state, user, partner, key="chat_window"):
+    window = state.get(key)
+    if not window or window["user"] != user or window["partner"] != partner:
+        window = open_window(user, partner)
+        changed = True
+    else:
+        changed = refresh_window(window)
+    state[key] = window
+    return window, changed
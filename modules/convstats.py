@@ -0,0 +1,264 @@
+# convstats.py（会話分析の集計。1回の取得・1回の走査で各フィードバックの材料をそろえる）
+#
+#   python -m modules.convstats            保存済みの集計を履歴からの再計算と突き合わせる
+#   python -m modules.convstats --rebuild  集計・推移を履歴から作り直してから突き合わせる
+import math
+import sys
+from itertools import chain
+
+from modules import db
+from modules.chatstore import CHAT, conversation_id, rebuild_aggregates, rebuild_rollups, gap_bin_value
+from modules.keywords import message_features
+from modules.migrations import ensure_schema
+
+try:
+    import numpy as np
+except ImportError:   # numpy が無い環境では同じ値を Python のループで求める
+    np = None
+
+# 定数（設計意図の明示）
+GAP_PERCENTILES = (50, 90)    # 間隔の中央値・p90
+
+# 💬 会話取得（共通）: (sender, message, ts_epoch)
+def get_chat(sender, receiver):
+    conv_id = conversation_id(sender, receiver)
+    if conv_id is None:
+        return []
+    return db.query('''SELECT sender, message, ts_epoch FROM chat_messages
+                       WHERE conversation_id=? ORDER BY id''', (conv_id,))
+
+# 💬 集計用の会話取得: (id, sender, message, ts_epoch)
+def get_chat_rows(sender, receiver):
+    conv_id = conversation_id(sender, receiver)
+    if conv_id is None:
+        return []
+    return db.query('''SELECT id, sender, message, ts_epoch FROM chat_messages
+                       WHERE conversation_id=? ORDER BY id''', (conv_id,))
+
+# ⏱ 時系列の取得: (sender の発言なら1, ts_epoch。欠けていれば -1)。本文を読まないので長い履歴でも軽い
+def get_timeline(sender, receiver):
+    conv_id = conversation_id(sender, receiver)
+    if conv_id is None:
+        return []
+    return db.query('''SELECT sender=?, COALESCE(ts_epoch, -1) FROM chat_messages
+                       WHERE conversation_id=? ORDER BY id''', (sender, conv_id))
+
+# ⏱ 間隔・話者交代・応答・期間と、間隔のパーセンタイル（timeline は get_timeline の形）
+# numpy があれば配列演算でまとめて求める。時刻の欠けた発言の前後の間隔は数えない
+def timing_metrics(timeline):
+    if np is None:
+        return _timing_metrics_loop(timeline)
+    metrics = {"total": len(timeline), "gap_sum": 0, "switch_count": 0, "response_count": 0,
+               "duration_seconds": 0, "gap_percentiles": {p: 0 for p in GAP_PERCENTILES}}
+    if not timeline:
+        return metrics
+    # タプルのリストを経由せず、平らにして1本の配列に読み込む（偶数番目が sender フラグ、奇数番目が時刻）
+    data = np.fromiter(chain.from_iterable(timeline), dtype=np.int64, count=2 * len(timeline))
+    mine, ts = data[0::2], data[1::2]
+    valid = ts >= 0
+    gaps = np.diff(ts)[valid[1:] & valid[:-1]]
+    switched = mine[1:] != mine[:-1]
+    metrics["gap_sum"] = int(gaps.sum())
+    metrics["switch_count"] = int(switched.sum())
+    metrics["response_count"] = int((switched & (mine[1:] == 1)).sum())
+    metrics["duration_seconds"] = int(ts[-1] - ts[0]) if valid[0] and valid[-1] else 0
+    if gaps.size:
+        metrics["gap_percentiles"] = dict(zip(GAP_PERCENTILES, np.percentile(gaps, GAP_PERCENTILES).tolist()))
+    return metrics
+
+# ⏱ timing_metrics の numpy を使わない版（同じ値を返す）
+def _timing_metrics_loop(timeline):
+    gaps = []
+    switch_count = response_count = 0
+    for (prev_mine, prev_ts), (mine, ts) in zip(timeline, timeline[1:]):
+        if ts >= 0 and prev_ts >= 0:
+            gaps.append(ts - prev_ts)
+        if mine != prev_mine:
+            switch_count += 1
+            response_count += mine
+    first_ts, last_ts = (timeline[0][1], timeline[-1][1]) if timeline else (-1, -1)
+    gaps.sort()
+    return {
+        "total": len(timeline),
+        "gap_sum": sum(gaps),
+        "switch_count": switch_count,
+        "response_count": response_count,
+        "duration_seconds": last_ts - first_ts if first_ts >= 0 and last_ts >= 0 else 0,
+        "gap_percentiles": {p: _percentile(gaps, p) for p in GAP_PERCENTILES},
+    }
+
+# 📐 パーセンタイル（numpy.percentile の既定と同じ線形補間。values は昇順）
+def _percentile(values, p):
+    if not values:
+        return 0
+    pos = (len(values) - 1) * p / 100
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+# 📊 会話の集計（sender 視点）
+# 件数・間隔・話者交代・応答・キーワード一致をまとめて数える。各 *_feedback はこれを整形するだけ
+# rows は get_chat_rows の形 (id, sender, message, ts_epoch)
+class ConversationStats:
+    def __init__(self, rows, sender, receiver=None):
+        self.sender = sender
+        self.receiver = receiver
+        self.total = len(rows)
+        self.sender_count = 0
+        self.gap_sum = 0               # 連続する2発言の間隔（秒）の合計
+        self.switch_count = 0          # 話者が入れ替わった回数
+        self.response_count = 0        # 相手の発言の直後に sender が返した回数
+        self.question_count = 0
+        self.emotion_count = 0
+        self.disclosure_count = 0
+        self.first_ts = rows[0][3] if rows else None
+        self.last_ts = rows[-1][3] if rows else None
+        self._gap_percentiles = None
+        self._gap_median = None
+
+        prev_sender = prev_ts = None
+        for _, speaker, message, ts in rows:
+            if prev_sender is not None:
+                if ts is not None and prev_ts is not None:
+                    self.gap_sum += ts - prev_ts
+                if speaker != prev_sender:
+                    self.switch_count += 1
+                    if speaker == sender:
+                        self.response_count += 1
+            if speaker == sender:
+                self.sender_count += 1
+                question, emotion, disclosure = message_features(message)
+                self.question_count += question
+                self.emotion_count += emotion
+                self.disclosure_count += disclosure
+            prev_sender, prev_ts = speaker, ts
+
+    # 📥 保存時に更新している集計表から読む（履歴の長さによらず主キー参照2回）
+    @classmethod
+    def load(cls, sender, receiver):
+        stats = cls([], sender, receiver)
+        conv_id = conversation_id(sender, receiver)
+        if conv_id is None:
+            return stats
+        row = db.query_one('''SELECT message_count, switch_count, gap_sum, first_ts, last_ts
+                              FROM conversation_aggregates WHERE conversation_id=?''', (conv_id,))
+        if row is None:
+            return stats
+        stats.total, stats.switch_count, stats.gap_sum, stats.first_ts, stats.last_ts = row
+        row = db.query_one('''SELECT message_count, question_count, emotion_count, disclosure_count, response_count
+                              FROM conversation_sender_aggregates WHERE conversation_id=? AND sender=?''',
+                           (conv_id, sender))
+        if row is not None:
+            (stats.sender_count, stats.question_count, stats.emotion_count,
+             stats.disclosure_count, stats.response_count) = row
+        return stats
+
+    # 📥 履歴を1回取得して数え直す（集計表の検証用）
+    @classmethod
+    def from_history(cls, sender, receiver):
+        return cls(get_chat_rows(sender, receiver), sender, receiver)
+
+    # ⏱ 間隔のパーセンタイル {50: 中央値, 90: p90}（正確な値。時系列を全件読むので一括処理・分析用）
+    @property
+    def gap_percentiles(self):
+        if self._gap_percentiles is None:
+            self._gap_percentiles = timing_metrics(get_timeline(self.sender, self.receiver))["gap_percentiles"]
+        return self._gap_percentiles
+
+    # ⏱ 間隔の中央値（会話全体の度数分布からの近似値。履歴は読まないので画面の再計算で使う）
+    @property
+    def gap_median(self):
+        if self._gap_median is None:
+            conv_id = conversation_id(self.sender, self.receiver)
+            self._gap_median = gap_median(conv_id) if conv_id is not None else None
+        return self._gap_median
+
+    @property
+    def avg_gap(self):
+        return self.gap_sum / (self.total - 1) if self.total > 1 else 0
+
+    @property
+    def switch_ratio(self):
+        return self.switch_count / (self.total - 1) if self.total > 1 else 0
+
+    # 時刻の読めない古い発言が最初か最後にあると first_ts / last_ts は None（期間は 0 とみなす）
+    @property
+    def duration_seconds(self):
+        if not self.total or self.first_ts is None or self.last_ts is None:
+            return 0
+        return self.last_ts - self.first_ts
+
+# 📈 日・週ごとの推移（sender 視点。conversation_rollups の範囲検索だけで作る）
+# 戻り値: 期間の古い順に {bucket_start, message_count, sender_count, question_ratio, emotion_count, median_gap}
+# median_gap は度数分布から求めた近似値（間隔が無い期間は None）
+def get_trends(sender, receiver, period="week", since=0, until=None):
+    conv_id = conversation_id(sender, receiver)
+    if conv_id is None:
+        return []
+    until = until if until is not None else 2 ** 62
+    rows = db.query('''SELECT bucket_start, SUM(message_count),
+                              SUM(CASE WHEN sender=? THEN message_count ELSE 0 END),
+                              SUM(CASE WHEN sender=? THEN question_count ELSE 0 END),
+                              SUM(CASE WHEN sender=? THEN emotion_count ELSE 0 END)
+                       FROM conversation_rollups
+                       WHERE conversation_id=? AND period=? AND bucket_start BETWEEN ? AND ?
+                       GROUP BY bucket_start ORDER BY bucket_start''',
+                    (sender, sender, sender, conv_id, period, since, until))
+    histograms = {}
+    for bucket, gap_bin, count in db.query('''SELECT bucket_start, gap_bin, SUM(count) FROM conversation_rollup_gaps
+                                             WHERE conversation_id=? AND period=? AND bucket_start BETWEEN ? AND ?
+                                             GROUP BY bucket_start, gap_bin ORDER BY bucket_start, gap_bin''',
+                                          (conv_id, period, since, until)):
+        histograms.setdefault(bucket, []).append((gap_bin, count))
+    return [{
+        "bucket_start": bucket,
+        "message_count": total,
+        "sender_count": mine,
+        "question_ratio": questions / total if total else 0,
+        "emotion_count": emotions,
+        "median_gap": _histogram_median(histograms.get(bucket, [])),
+    } for bucket, total, mine, questions, emotions in rows]
+
+# 📐 度数分布 [(区間番号, 件数)]（区間番号の昇順）の中央値
+def _histogram_median(histogram):
+    half = sum(count for _, count in histogram) / 2
+    seen = 0
+    for gap_bin, count in histogram:
+        seen += count
+        if seen >= half:
+            return gap_bin_value(gap_bin)
+    return None
+
+# 📐 会話全体の間隔の中央値（conversation_rollup_gaps の period='all' の度数分布から。間隔が無ければ None）
+# 読む行数は区間数×発言者数だけで、メッセージ数にも会話の期間にもよらない
+def gap_median(conv_id):
+    return _histogram_median(db.query('''SELECT gap_bin, SUM(count) FROM conversation_rollup_gaps
+                                        WHERE conversation_id=? AND period='all' AND bucket_start=0
+                                        GROUP BY gap_bin ORDER BY gap_bin''', (conv_id,)))
+
+# 定数（集計表と履歴からの再計算で一致すべき値）
+COMPARED_FIELDS = ("total", "sender_count", "gap_sum", "switch_count", "response_count",
+                   "question_count", "emotion_count", "disclosure_count", "first_ts", "last_ts")
+
+# 🔎 全会話の集計表を履歴からの再計算と突き合わせる
+# 戻り値: 食い違いのリスト [(user_a, user_b, sender, 項目, 集計表の値, 再計算の値)]
+def verify_aggregates():
+    mismatches = []
+    for user_a, user_b in db.query("SELECT user_a, user_b FROM conversations WHERE space=?", (CHAT,)):
+        for sender, receiver in ((user_a, user_b), (user_b, user_a)):
+            stored = ConversationStats.load(sender, receiver)
+            actual = ConversationStats.from_history(sender, receiver)
+            for field in COMPARED_FIELDS:
+                if getattr(stored, field) != getattr(actual, field):
+                    mismatches.append((user_a, user_b, sender, field, getattr(stored, field), getattr(actual, field)))
+    return mismatches
+
+if __name__ == "__main__":
+    ensure_schema()
+    if "--rebuild" in sys.argv[1:]:
+        with db.transaction() as c:
+            print(f"rebuilt {rebuild_aggregates(c)} conversations")
+            rebuild_rollups(c)
+    mismatches = verify_aggregates()
+    for mismatch in mismatches:
+        print("mismatch:", *mismatch)
+    print(f"{len(mismatches)} mismatches")
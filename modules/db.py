@@ -0,0 +1,148 @@
+# db.py（共通SQLiteアクセス層）
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = os.getenv("MEBIUS_DB_PATH", "db/mebius.db")
+
+# 定数（設計意図の明示）
+POOL_SIZE = 8                 # プロセス内で保持する接続数の上限
+BUSY_TIMEOUT_MS = 5000        # ロック競合時の待ち時間
+CACHED_STATEMENTS = 256       # 接続ごとのプリペアドステートメントキャッシュ
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA cache_size=-16000",       # 約16MB
+    "PRAGMA mmap_size=134217728",     # 128MB
+    "PRAGMA temp_store=MEMORY",
+)
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_local = threading.local()
+_pid = os.getpid()
+_inherited = []   # fork で親から引き継いだプールと接続（子では使わず、参照を持ち続けて GC に閉じさせない）
+
+
+# 🔌 新規接続（プラグマ設定込み）
+def _open():
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,          # 自動コミット。書き込みのまとまりは transaction() で囲む
+        check_same_thread=False,       # プールを介してスレッド間で受け渡すため
+        cached_statements=CACHED_STATEMENTS,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# 🍴 fork された子プロセスでは親の接続を使わない（プールを作り直す）
+# 親の接続を子で閉じると親が使っている DB ファイルのロックや WAL の後始末に触れるので、閉じずに _inherited に
+# 残しておく。multiprocessing の子は os._exit で終わるため、これらが子の中で後始末されることはない
+def _check_fork():
+    global _pool, _local, _pid
+    if os.getpid() != _pid:
+        _inherited.append((_pool, _local))
+        _pool = queue.LifoQueue(maxsize=POOL_SIZE)
+        _local = threading.local()
+        _pid = os.getpid()
+
+
+# ♻️ 接続の貸し出し（同じスレッド内の入れ子呼び出しは同じ接続を再利用）
+@contextmanager
+def connection():
+    _check_fork()
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _open()
+    _local.conn = conn
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+# 📌 カーソル取得（接続ごとのステートメントキャッシュが効く）
+@contextmanager
+def cursor():
+    with connection() as conn:
+        c = conn.cursor()
+        try:
+            yield c
+        finally:
+            c.close()
+
+
+# 🔒 書き込みトランザクション（入れ子の場合は外側に合流）
+@contextmanager
+def transaction():
+    with connection() as conn:
+        if conn.in_transaction:
+            yield conn.cursor()
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+
+# 📥 読み取りヘルパー
+def query(sql, params=()):
+    with cursor() as c:
+        c.execute(sql, params)
+        return c.fetchall()
+
+
+def query_one(sql, params=()):
+    with cursor() as c:
+        c.execute(sql, params)
+        return c.fetchone()
+
+
+# 📜 大きな結果を少しずつ読む（全件をリストにしない。読み終えるまで接続を借りたまま）
+def iterate(sql, params=(), batch=500):
+    with cursor() as c:
+        c.execute(sql, params)
+        while True:
+            rows = c.fetchmany(batch)
+            if not rows:
+                return
+            yield from rows
+
+
+# 💾 単文の書き込み（lastrowid / rowcount を返す）
+def execute(sql, params=()):
+    with cursor() as c:
+        c.execute(sql, params)
+        return c.lastrowid, c.rowcount
+
+
+# 🧹 プール内の接続をすべて閉じる（DB_PATH 切り替え時・プロセス終了時）
+def close_all():
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            break
+        conn.close()
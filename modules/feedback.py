@@ -1,90 +1,61 @@
-import sqlite3
-import re
-from datetime import datetime
-from modules.utils import now_str
-
-# MeCabによる日本語形態素解析
-import MeCab
-import unidic_lite
-
-DB_PATH = "db/mebius.db"
+import json
+import os
+import threading
+from collections import OrderedDict
+from modules import db
+from modules.chatstore import conversation_id, last_message_id
+from modules.convstats import ConversationStats, get_chat
+from modules.hll import HyperLogLog
+from modules.migrations import ensure_schema
+from modules.tokenizer import tokenize, tokenize_message
+from modules.utils import now_epoch, format_jst
 
 # 定数（設計意図の明示）
-EMOTION_WORDS = ["嬉しい", "楽しい", "悲しい", "不安", "安心", "つらい", "好き", "嫌い"]
-DISCLOSURE_KEYWORDS = ["私", "自分", "最近", "悩み", "好き", "嫌い", "思う", "考える"]
+FEEDBACK_CACHE_SIZE = int(os.getenv("MEBIUS_FEEDBACK_CACHE_SIZE", "1024"))   # 覚えておく会話数
+VOCAB_EXACT_MAX_MESSAGES = 500   # sender の発言がこの件数以下なら語彙を正確に数える。超えたら保存済みのスケッチで近似する
 
-# ✅ 共通DB接続関数
-def get_connection():
-    return sqlite3.connect(DB_PATH)
+# 会話の最新メッセージIDが変わらない限り結果は同じなので、プロセス内（全セッション共通）で使い回す
+_feedback_cache = OrderedDict()
+_feedback_cache_lock = threading.Lock()
+_feedback_cache_counts = {"hits": 0, "misses": 0}
 
 # ✅ 会話取得＋長さチェック（min_len件以上）
 def get_valid_chat(sender, receiver, min_len=1):
     rows = get_chat(sender, receiver)
     return rows if len(rows) >= min_len else None
 
+# 📊 集計の取得（stats を渡せば使い回す。1画面で1回だけ load する想定）
+# 戻り値: 会話が min_len 件未満なら None
+def get_valid_stats(sender, receiver, stats=None, min_len=1):
+    if stats is None:
+        stats = ConversationStats.load(sender, receiver)
+    return stats if stats.total >= min_len else None
+
 # 🧱 初期化
 def init_feedback_db():
-    conn = get_connection()
-    try:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS chat_feedback (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT,
-            receiver TEXT,
-            feedback TEXT,
-            timestamp TEXT
-        )''')
-        conn.commit()
-    finally:
-        conn.close()
+    ensure_schema()
 
 # 💾 手動フィードバック保存
 def save_feedback(sender, receiver, feedback_text):
-    conn = get_connection()
-    try:
-        c = conn.cursor()
-        c.execute("INSERT INTO chat_feedback (sender, receiver, feedback, timestamp) VALUES (?, ?, ?, ?)",
-                  (sender, receiver, feedback_text, now_str()))
-        conn.commit()
-    finally:
-        conn.close()
+    epoch = now_epoch()
+    db.execute("INSERT INTO chat_feedback (sender, receiver, feedback, timestamp, ts_epoch) VALUES (?, ?, ?, ?, ?)",
+               (sender, receiver, feedback_text, format_jst(epoch), epoch))
 
 # 📥 手動フィードバック取得
 def get_feedback(sender, receiver):
-    conn = get_connection()
-    try:
-        c = conn.cursor()
-        c.execute('''SELECT feedback, timestamp FROM chat_feedback
-                     WHERE sender=? AND receiver=?
-                     ORDER BY timestamp DESC''', (sender, receiver))
-        return c.fetchall()
-    finally:
-        conn.close()
-
-# 💬 会話取得（共通）
-def get_chat(sender, receiver):
-    conn = get_connection()
-    try:
-        c = conn.cursor()
-        c.execute('''SELECT sender, message, timestamp FROM chat_messages
-                     WHERE (sender=? AND receiver=?) OR (sender=? AND receiver=?)
-                     ORDER BY timestamp''', (sender, receiver, receiver, sender))
-        return c.fetchall()
-    finally:
-        conn.close()
+    rows = db.query('''SELECT feedback, ts_epoch FROM chat_feedback
+                       WHERE sender=? AND receiver=?
+                       ORDER BY ts_epoch DESC''', (sender, receiver))
+    return [(fb, format_jst(ts)) for fb, ts in rows]
 
 # 🤖 会話の連続性フィードバック
-def continuity_feedback(sender, receiver):
-    rows = get_valid_chat(sender, receiver, min_len=4)
-    if not rows:
+def continuity_feedback(sender, receiver, stats=None):
+    stats = get_valid_stats(sender, receiver, stats, min_len=4)
+    if not stats:
         return "会話の流れを分析するには少し短すぎます"
 
-    timestamps = [datetime.strptime(r[2], "%Y-%m-%d %H:%M:%S") for r in rows]
-    gaps = [(timestamps[i] - timestamps[i-1]).total_seconds() for i in range(1, len(timestamps))]
-    turns = [r[0] for r in rows]
-    switch_count = sum(1 for i in range(1, len(turns)) if turns[i] != turns[i-1])
-    switch_ratio = switch_count / (len(turns) - 1)
-    avg_gap = sum(gaps) / len(gaps)
+    switch_ratio = stats.switch_ratio
+    avg_gap = stats.avg_gap
 
     if avg_gap < 90 and switch_ratio > 0.6:
         return f"自然な流れで会話が続いていました（平均間隔 {int(avg_gap)}秒・交互率 {int(switch_ratio*100)}%）"
@@ -94,13 +65,11 @@ def continuity_feedback(sender, receiver):
         return f"間が空きがちで、会話の流れはやや途切れがちでした（平均間隔 {int(avg_gap)}秒）"
 
 # 🤖 発言割合
-def auto_feedback(sender, receiver):
-    rows = get_valid_chat(sender, receiver)
-    if not rows:
+def auto_feedback(sender, receiver, stats=None):
+    stats = get_valid_stats(sender, receiver, stats)
+    if not stats:
         return "会話がまだありません"
-    total = len(rows)
-    sender_count = sum(1 for r in rows if r[0] == sender)
-    ratio = sender_count / total
+    ratio = stats.sender_count / stats.total
     if ratio > 0.7:
         return f"あなたの発言が多めでした（{int(ratio*100)}%）"
     elif ratio < 0.3:
@@ -109,40 +78,39 @@ def auto_feedback(sender, receiver):
         return f"バランスの取れた会話でした（{int(ratio*100)}%）"
 
 # 🤖 問いの頻度
-def question_feedback(sender, receiver):
-    rows = get_valid_chat(sender, receiver)
-    if not rows:
+def question_feedback(sender, receiver, stats=None):
+    stats = get_valid_stats(sender, receiver, stats)
+    if not stats:
         return "会話がまだありません"
-    total = len(rows)
-    question_count = sum(1 for s, m, _ in rows if s == sender and "?" in m)
+    question_count = stats.question_count
     if question_count == 0:
         return "問いかけはありませんでした。沈黙や受け止める時間が多かったかも"
-    elif question_count / total > 0.5:
+    elif question_count / stats.total > 0.5:
         return f"問いかけが多く、関係性を探る姿勢が見られました（{question_count}件）"
     else:
         return f"問いが適度に含まれていて、会話に流れがありました（{question_count}件）"
 
 # 🤖 沈黙の余白
-def silence_feedback(sender, receiver):
-    rows = get_valid_chat(sender, receiver, min_len=2)
-    if not rows:
+def silence_feedback(sender, receiver, stats=None):
+    stats = get_valid_stats(sender, receiver, stats, min_len=2)
+    if not stats:
         return "沈黙の分析には会話が少なすぎます"
-    timestamps = [datetime.strptime(r[2], "%Y-%m-%d %H:%M:%S") for r in rows]
-    gaps = [(timestamps[i] - timestamps[i-1]).total_seconds() for i in range(1, len(timestamps))]
-    avg_gap = sum(gaps) / len(gaps)
+    avg_gap = stats.avg_gap
+    # 平均は長い沈黙1回に引っぱられるので、中央値も添える（保存時に更新している度数分布からの近似値）
+    median = int(stats.gap_median or 0)
     if avg_gap > 300:
-        return f"沈黙の余白が長く、安心感を生む会話だったかもしれません（平均 {int(avg_gap)}秒）"
+        return f"沈黙の余白が長く、安心感を生む会話だったかもしれません（平均 {int(avg_gap)}秒・中央値 {median}秒）"
     elif avg_gap > 60:
-        return f"適度な間があり、問いや受け止めが活きていたようです（平均 {int(avg_gap)}秒）"
+        return f"適度な間があり、問いや受け止めが活きていたようです（平均 {int(avg_gap)}秒・中央値 {median}秒）"
     else:
-        return f"テンポよく会話が進みました（平均 {int(avg_gap)}秒）"
+        return f"テンポよく会話が進みました（平均 {int(avg_gap)}秒・中央値 {median}秒）"
 
 # 🤖 感情語の使用率
-def emotion_feedback(sender, receiver):
-    rows = get_valid_chat(sender, receiver)
-    if not rows:
+def emotion_feedback(sender, receiver, stats=None):
+    stats = get_valid_stats(sender, receiver, stats)
+    if not stats:
         return "会話がまだありません"
-    count = sum(1 for s, m, _ in rows if s == sender and any(word in m for word in EMOTION_WORDS))
+    count = stats.emotion_count
     if count == 0:
         return "感情表現は控えめでした。沈黙や問いが中心だったかも"
     elif count > 5:
@@ -151,52 +119,89 @@ def emotion_feedback(sender, receiver):
         return f"感情語が適度に使われていました（{count}件）"
 
 # 🤖 応答率
-def response_feedback(sender, receiver):
-    rows = get_valid_chat(sender, receiver, min_len=2)
-    if not rows:
+def response_feedback(sender, receiver, stats=None):
+    stats = get_valid_stats(sender, receiver, stats, min_len=2)
+    if not stats:
         return "応答の分析には会話が少なすぎます"
-    response_count = 0
-    for i in range(1, len(rows)):
-        prev_sender = rows[i-1][0]
-        curr_sender = rows[i][0]
-        if prev_sender != sender and curr_sender == sender:
-            response_count += 1
-    ratio = response_count / len(rows)
+    ratio = stats.response_count / stats.total
     if ratio > 0.4:
         return f"相手の言葉をよく受け止めていました（応答率 {int(ratio*100)}%）"
     else:
         return f"問いや沈黙が中心の会話だったかもしれません（応答率 {int(ratio*100)}%）"
 
 # 🤖 会話の長さ
-def length_feedback(sender, receiver):
-    rows = get_valid_chat(sender, receiver)
-    if not rows:
+def length_feedback(sender, receiver, stats=None):
+    stats = get_valid_stats(sender, receiver, stats)
+    if not stats:
         return "会話がまだありません"
-    start = datetime.strptime(rows[0][2], "%Y-%m-%d %H:%M:%S")
-    end = datetime.strptime(rows[-1][2], "%Y-%m-%d %H:%M:%S")
-    duration = (end - start).total_seconds() / 60
-    if len(rows) > 20 and duration > 30:
-        return f"継続的なやりとりがあり、関係性が育っているようです（{len(rows)}件・{int(duration)}分）"
+    duration = stats.duration_seconds / 60
+    if stats.total > 20 and duration > 30:
+        return f"継続的なやりとりがあり、関係性が育っているようです（{stats.total}件・{int(duration)}分）"
     else:
-        return f"短めの会話でした（{len(rows)}件・{int(duration)}分）"
+        return f"短めの会話でした（{stats.total}件・{int(duration)}分）"
 
 # 🤖 日本語テキストの形態素解析とトークン化
 def tokenize_japanese(text):
-    tagger = MeCab.Tagger(f"-d {unidic_lite.DICDIR} -Owakati")
-    return tagger.parse(text).strip().split()
+    return tokenize(text)
+
+# 📜 sender の発言を少しずつ読む（after_id より新しいもの）: (id, message) の反復子
+def iter_sender_messages(sender, receiver, after_id=0):
+    conv_id = conversation_id(sender, receiver)
+    if conv_id is None:
+        return iter(())
+    return db.iterate('''SELECT id, message FROM chat_messages
+                         WHERE conversation_id=? AND sender=? AND id>? ORDER BY id''', (conv_id, sender, after_id))
+
+# 🔢 語彙の異なり数を1件ずつ数える（messages は (id, message) の反復子）
+# sketch を渡せば HyperLogLog に足し込み（記憶量一定）、省略すれば語の集合で正確に数える
+# 分かち書きはメッセージIDで覚えておくので、再描画では解析し直さない
+# 戻り値: 最後に読んだメッセージID（1件も無ければ None）
+def count_vocabulary(messages, sketch=None, seen=None):
+    last_id = None
+    for message_id, msg in messages:
+        for word in tokenize_message(message_id, msg):
+            if sketch is not None:
+                sketch.add(word)
+            else:
+                seen.add(word)
+        last_id = message_id
+    return last_id
+
+# 🔢 sender の語彙スケッチ（保存済みのものに新着分だけ足して保存し直す）
+def vocabulary_sketch(sender, receiver):
+    conv_id = conversation_id(sender, receiver)
+    if conv_id is None:
+        return HyperLogLog()
+    row = db.query_one("SELECT last_message_id, registers FROM vocab_sketches WHERE conversation_id=? AND sender=?",
+                       (conv_id, sender))
+    watermark, sketch = (row[0], HyperLogLog.from_bytes(row[1])) if row else (0, HyperLogLog())
+    last_id = count_vocabulary(iter_sender_messages(sender, receiver, watermark), sketch)
+    if last_id is not None:
+        db.execute('''INSERT INTO vocab_sketches (conversation_id, sender, last_message_id, registers) VALUES (?, ?, ?, ?)
+                      ON CONFLICT (conversation_id, sender) DO UPDATE SET
+                          last_message_id=excluded.last_message_id, registers=excluded.registers
+                      WHERE excluded.last_message_id > vocab_sketches.last_message_id''',
+                   (conv_id, sender, last_id, sketch.to_bytes()))
+    return sketch
+
+# 🔢 語彙の異なり数（既定は保存済みのスケッチに新着分だけ足して近似する）
+# 発言が VOCAB_EXACT_MAX_MESSAGES 件以下の短い履歴は、流し読みして正確に数える（フィードバックの閾値付近で誤差が出ないように）
+# message_count には sender の発言数（stats.sender_count）を渡す。exact を指定すればそちらを優先する
+def vocabulary_size(sender, receiver, message_count=None, exact=None):
+    if exact is None:
+        exact = message_count is not None and message_count <= VOCAB_EXACT_MAX_MESSAGES
+    if exact:
+        seen = set()
+        count_vocabulary(iter_sender_messages(sender, receiver), seen=seen)
+        return len(seen)
+    return round(vocabulary_sketch(sender, receiver).count())
 
 # 🤖 話題の広がり（語彙の多様性）
-def diversity_feedback(sender, receiver):
-    rows = get_valid_chat(sender, receiver)
-    if not rows:
+def diversity_feedback(sender, receiver, stats=None):
+    stats = get_valid_stats(sender, receiver, stats)
+    if not stats:
         return "会話がまだありません"
-    sender_msgs = [m for s, m, _ in rows if s == sender]
-    all_words = []
-    for msg in sender_msgs:
-        words = tokenize_japanese(msg)
-        all_words.extend(words)
-    unique_words = set(all_words)
-    count = len(unique_words)
+    count = vocabulary_size(sender, receiver, stats.sender_count)
     if count > 50:
         return f"語彙が豊かで、多様な話題が展開されていました（{count}種類）"
     elif count > 20:
@@ -205,11 +210,11 @@ def diversity_feedback(sender, receiver):
         return f"語彙は少なめでした（{count}種類）"
 
 # 🤖 自己開示度
-def disclosure_feedback(sender, receiver):
-    rows = get_valid_chat(sender, receiver)
-    if not rows:
+def disclosure_feedback(sender, receiver, stats=None):
+    stats = get_valid_stats(sender, receiver, stats)
+    if not stats:
         return "会話がまだありません"
-    count = sum(1 for s, m, _ in rows if s == sender and any(k in m for k in DISCLOSURE_KEYWORDS))
+    count = stats.disclosure_count
     if count > 10:
         return f"自己開示が多く、関係性が深まっていたようです（{count}件）"
     elif count > 3:
@@ -218,13 +223,11 @@ def disclosure_feedback(sender, receiver):
         return f"自己開示は控えめでした。問いや沈黙が中心だったかもしれません（{count}件）"
 
 # 🤝 関係性の継続性フィードバック
-def continuity_duration_feedback(sender, receiver):
-    rows = get_valid_chat(sender, receiver)
-    if not rows:
+def continuity_duration_feedback(sender, receiver, stats=None):
+    stats = get_valid_stats(sender, receiver, stats)
+    if not stats:
         return "会話がまだ始まっていません"
-    start = datetime.strptime(rows[0][2], "%Y-%m-%d %H:%M:%S")
-    end = datetime.strptime(rows[-1][2], "%Y-%m-%d %H:%M:%S")
-    duration_days = (end - start).days
+    duration_days = stats.duration_seconds // 86400
     if duration_days >= 30:
         return f"この関係は {duration_days} 日間続いており、継続的な対話が育っています"
     elif duration_days >= 7:
@@ -232,4 +235,77 @@ def continuity_duration_feedback(sender, receiver):
     elif duration_days >= 2:
         return f"この関係は {duration_days} 日間続いており、対話の芽が育ち始めています"
     else:
-        return f"会話は始まったばかりで、これから関係性が育っていくかもしれません（{duration_days}日）"
\ No newline at end of file
+        return f"会話は始まったばかりで、これから関係性が育っていくかもしれません（{duration_days}日）"
+
+# 定数（AIフィードバック欄の項目と表示順）
+FEEDBACK_ITEMS = (
+    ("会話の長さ", length_feedback),
+    ("会話の連続性", continuity_feedback),
+    ("沈黙の余白", silence_feedback),
+    ("応答率", response_feedback),
+    ("発言割合", auto_feedback),
+    ("問いの頻度", question_feedback),
+    ("感情語の使用", emotion_feedback),
+    ("自己開示度", disclosure_feedback),
+    ("話題の広がり", diversity_feedback),
+    ("関係性の継続性", continuity_duration_feedback),
+)
+
+# 📋 AIフィードバック欄の全項目を計算する [(項目名, 文)]
+def compute_report(sender, receiver):
+    stats = ConversationStats.load(sender, receiver)
+    return tuple((label, feedback(sender, receiver, stats)) for label, feedback in FEEDBACK_ITEMS)
+
+# 💾 一括計算の結果を保存（results: [(conversation_id, sender, last_message_id, report)]）
+def save_reports(results):
+    computed_at = now_epoch()
+    with db.transaction() as c:
+        c.executemany('''INSERT INTO feedback_reports (conversation_id, sender, last_message_id, report, computed_at)
+                         VALUES (?, ?, ?, ?, ?)
+                         ON CONFLICT (conversation_id, sender) DO UPDATE SET
+                             last_message_id=excluded.last_message_id, report=excluded.report,
+                             computed_at=excluded.computed_at''',
+                      [(conv_id, sender, watermark, json.dumps(report, ensure_ascii=False), computed_at)
+                       for conv_id, sender, watermark, report in results])
+
+# 📥 保存済みの結果（会話が watermark から進んでいなければ）。無ければ None
+def load_saved_report(sender, receiver, watermark):
+    conv_id = conversation_id(sender, receiver)
+    if conv_id is None:
+        return None
+    row = db.query_one("SELECT report FROM feedback_reports WHERE conversation_id=? AND sender=? AND last_message_id=?",
+                       (conv_id, sender, watermark))
+    return tuple(tuple(item) for item in json.loads(row[0])) if row else None
+
+# 📋 AIフィードバック欄の全項目 [(項目名, 文)]
+# (sender, receiver, 最新メッセージID) をキーに LRU で覚え、新着が無い再描画では集計しない
+# LRU に無ければ feedbackbatch が書いた結果を探し、それも古ければその場で計算する
+def feedback_report(sender, receiver):
+    watermark = last_message_id(sender, receiver)
+    key = (sender, receiver, watermark)
+    with _feedback_cache_lock:
+        report = _feedback_cache.get(key)
+        if report is not None:
+            _feedback_cache.move_to_end(key)
+            _feedback_cache_counts["hits"] += 1
+            return report
+        _feedback_cache_counts["misses"] += 1
+
+    report = load_saved_report(sender, receiver, watermark) or compute_report(sender, receiver)
+    with _feedback_cache_lock:
+        _feedback_cache[key] = report
+        while len(_feedback_cache) > FEEDBACK_CACHE_SIZE:
+            _feedback_cache.popitem(last=False)
+    return report
+
+# 📈 フィードバックキャッシュの効き具合
+def feedback_cache_stats():
+    with _feedback_cache_lock:
+        hits, misses = _feedback_cache_counts["hits"], _feedback_cache_counts["misses"]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "size": len(_feedback_cache),
+            "capacity": FEEDBACK_CACHE_SIZE,
+        }
\ No newline at end of file
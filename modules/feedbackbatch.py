@@ -0,0 +1,77 @@
+# feedbackbatch.py（全会話のAIフィードバックを一括計算して feedback_reports に書く）
+# 会話ごと・発言者ごとに計算し、UI（feedback.feedback_report）は保存済みの結果をそのまま読む。
+# 会話の最新メッセージIDが保存時から進んでいないものは飛ばすので、中断しても続きから再開できる。
+#
+#   python -m modules.feedbackbatch [--workers N] [--full]
+import argparse
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from modules import db
+from modules.chatstore import CHAT
+from modules.feedback import compute_report, save_reports
+from modules.migrations import ensure_schema
+
+# 定数（設計意図の明示）
+WRITE_BATCH = 200          # 1トランザクションで保存する件数（中断時に失うのは最大この件数）
+CHUNK_SIZE = 8             # ワーカーに1度に渡す件数
+PROGRESS_INTERVAL = 1.0    # 進捗表示の間隔（秒）
+
+# 📋 計算が必要な (conversation_id, sender, receiver, last_message_id)
+# full=False なら保存済みの結果が最新のものは除く
+def pending_jobs(full=False):
+    return db.query('''WITH pairs (conversation_id, sender, receiver, last_message_id) AS (
+                           SELECT id, user_a, user_b, last_message_id FROM conversations
+                           WHERE space=? AND last_message_id IS NOT NULL
+                           UNION ALL
+                           SELECT id, user_b, user_a, last_message_id FROM conversations
+                           WHERE space=? AND last_message_id IS NOT NULL
+                       )
+                       SELECT p.conversation_id, p.sender, p.receiver, p.last_message_id FROM pairs p
+                       LEFT JOIN feedback_reports r ON r.conversation_id = p.conversation_id AND r.sender = p.sender
+                       WHERE ? OR r.last_message_id IS NULL OR r.last_message_id < p.last_message_id
+                       ORDER BY p.conversation_id, p.sender''', (CHAT, CHAT, int(full)))
+
+# 🧮 ワーカー側の1件分（fork 後の接続は db 側で張り直される）
+def _compute(job):
+    conv_id, sender, receiver, watermark = job
+    return conv_id, sender, watermark, compute_report(sender, receiver)
+
+def _progress(out, done, total, started):
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed else 0.0
+    out.write(f"\r{done}/{total} reports  {rate:,.1f}/s  {elapsed:,.0f}s")
+    out.flush()
+
+# 🚀 一括計算（戻り値: 保存した件数）
+def run(workers=None, full=False, out=sys.stderr):
+    ensure_schema()
+    jobs = pending_jobs(full)
+    total, done, batch = len(jobs), 0, []
+    started = last_report = time.perf_counter()
+    out.write(f"{total} reports to compute with {workers or os.cpu_count()} workers\n")
+    with Pool(workers) as pool:
+        for result in pool.imap_unordered(_compute, jobs, chunksize=CHUNK_SIZE):
+            batch.append(result)
+            if len(batch) >= WRITE_BATCH:
+                save_reports(batch)
+                done += len(batch)
+                batch = []
+            if time.perf_counter() - last_report >= PROGRESS_INTERVAL:
+                _progress(out, done + len(batch), total, started)
+                last_report = time.perf_counter()
+    if batch:
+        save_reports(batch)
+        done += len(batch)
+    _progress(out, done, total, started)
+    out.write("\n")
+    return done
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="全会話のAIフィードバックを一括計算する")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数（既定: CPUコア数）")
+    parser.add_argument("--full", action="store_true", help="保存済みの結果が最新でも計算し直す")
+    args = parser.parse_args()
+    run(workers=args.workers, full=args.full)
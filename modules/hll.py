@@ -0,0 +1,46 @@
+# hll.py（HyperLogLog：異なり数の近似。記憶量は要素数によらず一定で、保存・マージできる）
+import hashlib
+import math
+
+# 定数（設計意図の明示）
+HLL_PRECISION = 12            # レジスタ数 2^12 = 4096 バイト。標準誤差は約1.6%
+
+# 🔢 HyperLogLog
+# 同じ要素を何度足しても結果は変わらないので、新着分だけ足し込んでいける
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+
+    # ➕ 要素を足す（プロセスをまたいで同じ値になるよう、組み込みの hash ではなく blake2b を使う）
+    def add(self, item):
+        x = int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "big")
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    # 🔗 別のスケッチを取り込む（和集合の異なり数になる）
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("precision が異なる HyperLogLog はマージできません")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    # 📊 異なり数の推定（少ないうちは線形カウンティングでほぼ正確）
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            return self.size * math.log(self.size / zeros)
+        return estimate
+
+    # 💾 保存用（レジスタ列そのもの。長さから precision を復元する）
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(precision=len(data).bit_length() - 1, registers=data)
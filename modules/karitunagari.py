@@ -1,10 +1,10 @@
 import streamlit as st
-import sqlite3
 import random
+from modules import db
+from modules.chatstore import conversation_id, touch_conversation, KARI
+from modules.migrations import ensure_schema
 from modules.user import get_current_user, get_kari_id
-from modules.utils import now_str
-
-DB_PATH = "db/mebius.db"
+from modules.utils import now_str, now_epoch, format_jst
 
 # 話題カード
 TOPIC_CARDS = {
@@ -34,79 +34,40 @@ TOPIC_CARDS = {
 
 # DB初期化
 def init_kari_db():
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS kari_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT,
-            receiver TEXT,
-            message TEXT,
-            topic_theme TEXT,
-            timestamp TEXT
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS friends (
-            user TEXT,
-            friend TEXT,
-            UNIQUE(user, friend)
-        )''')
-        conn.commit()
-    finally:
-        conn.close()
+    ensure_schema()
 
 # メッセージ保存・取得
 def save_message(sender, receiver, message, theme=None):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute("INSERT INTO kari_messages (sender, receiver, message, topic_theme, timestamp) VALUES (?, ?, ?, ?, ?)",
-                  (sender, receiver, message, theme, now_str()))
-        conn.commit()
-    finally:
-        conn.close()
+    conv_id = conversation_id(sender, receiver, space=KARI, create=True)
+    epoch = now_epoch()
+    with db.transaction() as c:
+        c.execute('''INSERT INTO kari_messages (sender, receiver, message, topic_theme, timestamp, ts_epoch, conversation_id)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                  (sender, receiver, message, theme, format_jst(epoch), epoch, conv_id))
+        touch_conversation(c, conv_id, c.lastrowid)
 
 def get_messages(user, partner):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute('''SELECT sender, message FROM kari_messages
-                     WHERE (sender=? AND receiver=?) OR (sender=? AND receiver=?)
-                     ORDER BY timestamp''', (user, partner, partner, user))
-        return c.fetchall()
-    finally:
-        conn.close()
+    conv_id = conversation_id(user, partner, space=KARI)
+    if conv_id is None:
+        return []
+    return db.query("SELECT sender, message FROM kari_messages WHERE conversation_id=? ORDER BY id", (conv_id,))
 
 def get_shared_theme(user, partner):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute('''SELECT topic_theme FROM kari_messages
-                     WHERE ((sender=? AND receiver=?) OR (sender=? AND receiver=?))
-                     AND topic_theme IS NOT NULL
-                     ORDER BY timestamp LIMIT 1''', (user, partner, partner, user))
-        result = c.fetchone()
-        return result[0] if result else None
-    finally:
-        conn.close()
+    conv_id = conversation_id(user, partner, space=KARI)
+    if conv_id is None:
+        return None
+    result = db.query_one('''SELECT topic_theme FROM kari_messages
+                             WHERE conversation_id=? AND topic_theme IS NOT NULL
+                             ORDER BY id LIMIT 1''', (conv_id,))
+    return result[0] if result else None
 
 def add_friend(user, friend):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute("INSERT OR IGNORE INTO friends (user, friend) VALUES (?, ?)", (user, friend))
-        c.execute("INSERT OR IGNORE INTO friends (user, friend) VALUES (?, ?)", (friend, user))
-        conn.commit()
-    finally:
-        conn.close()
+    with db.transaction() as c:
+        c.execute("INSERT OR IGNORE INTO friends (user, friend, added_at) VALUES (?, ?, ?)", (user, friend, now_str()))
+        c.execute("INSERT OR IGNORE INTO friends (user, friend, added_at) VALUES (?, ?, ?)", (friend, user, now_str()))
 
 def get_friends(user):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute("SELECT friend FROM friends WHERE user=?", (user,))
-        return [row[0] for row in c.fetchall()]
-    finally:
-        conn.close()
+    return [row[0] for row in db.query("SELECT friend FROM friends WHERE user=?", (user,))]
 
 def render():
     init_kari_db()
@@ -0,0 +1,78 @@
+# keywords.py（会話分析で数えるキーワード。保存時の集計と会話全体の集計で同じ判定を使う）
+from collections import deque
+
+# 定数（設計意図の明示）
+EMOTION_WORDS = ["嬉しい", "楽しい", "悲しい", "不安", "安心", "つらい", "好き", "嫌い"]
+DISCLOSURE_KEYWORDS = ["私", "自分", "最近", "悩み", "好き", "嫌い", "思う", "考える"]
+KEYWORD_CATEGORIES = {
+    "question": ["?"],
+    "emotion": EMOTION_WORDS,
+    "disclosure": DISCLOSURE_KEYWORDS,
+}
+
+# 🔤 複数キーワードの一括照合（Aho-Corasick）
+# 全カテゴリの語を1つのオートマトンにまとめ、本文を1文字ずつ1回なぞるだけで
+# カテゴリごとの出現回数を数える。語彙が増えても照合は本文の長さにしか比例しない
+class KeywordMatcher:
+    def __init__(self, categories):
+        self.categories = tuple(categories)
+        self._goto = [{}]          # 状態ごとの遷移（文字 → 次の状態）
+        self._fail = [0]           # 遷移できないときに戻る状態（最長の接尾辞）
+        self._output = [()]        # その状態で一致が確定するカテゴリ（語ごとに1つ）
+        for category, words in categories.items():
+            for word in words:
+                self._add(word, category)
+        self._link()
+
+    def _add(self, word, category):
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = nxt
+        self._output[state] += (category,)
+
+    # 幅優先で失敗リンクを張り、接尾辞側の一致も出力に含めておく（根の直下の失敗先は根のまま）
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._output[nxt] += self._output[self._fail[nxt]]
+
+    # 📊 カテゴリごとの出現回数（重なった出現もそれぞれ数える）
+    def count(self, text):
+        goto, fail, output = self._goto, self._fail, self._output
+        counts = dict.fromkeys(self.categories, 0)
+        state = 0
+        for ch in text:
+            nxt = goto[state].get(ch)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto[state].get(ch)
+            state = nxt or 0
+            if output[state]:
+                for category in output[state]:
+                    counts[category] += 1
+        return counts
+
+MATCHER = KeywordMatcher(KEYWORD_CATEGORIES)
+
+# 🏷 1メッセージの特徴: (問いか, 感情語を含むか, 自己開示語を含むか) をそれぞれ 0/1 で返す
+def message_features(message):
+    counts = MATCHER.count(message)
+    return (
+        int(counts["question"] > 0),
+        int(counts["emotion"] > 0),
+        int(counts["disclosure"] > 0),
+    )
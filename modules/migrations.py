@@ -0,0 +1,602 @@
+# migrations.py（スキーマのバージョン管理）
+import logging
+import math
+import os
+import threading
+import time
+from modules import db
+from modules.utils import now_str, JST_OFFSET
+
+logger = logging.getLogger(__name__)
+
+# 🧱 v1: 基本テーブル（各モジュールの init_* に散らばっていた定義を集約）
+def _create_base_tables(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        password TEXT,
+        display_name TEXT,
+        kari_id TEXT,
+        registered_at TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS friends (
+        user TEXT,
+        friend TEXT,
+        added_at TEXT,
+        UNIQUE(user, friend)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS threads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        created_at TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS board_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT,
+        message TEXT,
+        timestamp TEXT,
+        thread_id INTEGER
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS chat_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender TEXT,
+        receiver TEXT,
+        message TEXT,
+        timestamp TEXT,
+        message_type TEXT DEFAULT 'text',
+        is_read INTEGER DEFAULT 0
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS message_reactions (
+        message_id INTEGER,
+        user TEXT,
+        reaction TEXT,
+        PRIMARY KEY (message_id, user)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS chat_feedback (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender TEXT,
+        receiver TEXT,
+        feedback TEXT,
+        timestamp TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS feedback (
+        sender TEXT,
+        receiver TEXT,
+        feedback TEXT,
+        timestamp TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS kari_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender TEXT,
+        receiver TEXT,
+        message TEXT,
+        topic_theme TEXT,
+        timestamp TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS user_profiles (
+        username TEXT PRIMARY KEY,
+        profile_text TEXT,
+        updated_at TEXT
+    )''')
+    # chat.py / chatkai.py 版で作られた chat_messages には is_read が無い
+    _add_column(c, "chat_messages", "is_read", "INTEGER DEFAULT 0")
+
+# 👥 v2: friends の定義を (user, friend, added_at) に統一
+# user.py は (owner, friend, added_at)、chat系は (user, friend UNIQUE) で作っていた
+def _reconcile_friends(c):
+    columns = _columns(c, "friends")
+    if "owner" in columns:
+        c.execute("ALTER TABLE friends RENAME TO friends_legacy")
+        c.execute('''CREATE TABLE friends (
+            user TEXT,
+            friend TEXT,
+            added_at TEXT,
+            UNIQUE(user, friend)
+        )''')
+        c.execute('''INSERT OR IGNORE INTO friends (user, friend, added_at)
+                     SELECT owner, friend, added_at FROM friends_legacy''')
+        c.execute("DROP TABLE friends_legacy")
+    else:
+        _add_column(c, "friends", "added_at", "TEXT")
+
+# 📝 v3: user_profiles の定義を (username, profile_text, updated_at) に統一
+def _reconcile_user_profiles(c):
+    _add_column(c, "user_profiles", "profile_text", "TEXT")
+    _add_column(c, "user_profiles", "updated_at", "TEXT")
+
+# 🔎 v4: 実際の WHERE / ORDER BY に合わせた索引
+def _create_indexes(c):
+    # 1対1チャット：(sender=? AND receiver=?) の両方向＋未読数（receiver/sender 等値）
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_pair ON chat_messages (sender, receiver, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_kari_messages_pair ON kari_messages (sender, receiver, id)")
+    # 掲示板：thread_id=? ORDER BY id DESC
+    c.execute("CREATE INDEX IF NOT EXISTS idx_board_messages_thread ON board_messages (thread_id, id)")
+    # リアクション集計：message_id=? GROUP BY reaction を索引だけで処理
+    c.execute("CREATE INDEX IF NOT EXISTS idx_message_reactions_message ON message_reactions (message_id, reaction)")
+    # フィードバック履歴：sender=? AND receiver=? ORDER BY timestamp DESC
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_feedback_pair ON chat_feedback (sender, receiver, timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_feedback_pair ON feedback (sender, receiver, timestamp)")
+
+# 🔑 v5: 会話ID（順序に依存しない2者の組）を全メッセージに付与
+# (sender=? AND receiver=?) OR (sender=? AND receiver=?) を (conversation_id, id) の範囲走査1回にする
+def _add_conversation_ids(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS conversations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        space TEXT,
+        user_a TEXT,
+        user_b TEXT,
+        UNIQUE(space, user_a, user_b)
+    )''')
+    for space, table in (("chat", "chat_messages"), ("kari", "kari_messages")):
+        _add_column(c, table, "conversation_id", "INTEGER")
+        c.execute(f'''INSERT OR IGNORE INTO conversations (space, user_a, user_b)
+                      SELECT DISTINCT ?, MIN(sender, receiver), MAX(sender, receiver) FROM {table}
+                      WHERE conversation_id IS NULL''', (space,))
+        c.execute(f'''UPDATE {table} SET conversation_id = (
+                          SELECT id FROM conversations
+                          WHERE space=? AND user_a=MIN({table}.sender, {table}.receiver)
+                                        AND user_b=MAX({table}.sender, {table}.receiver))
+                      WHERE conversation_id IS NULL''', (space,))
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_conversation ON {table} (conversation_id, id)")
+    # 会話キーで引けるようになったので、ペア索引は未読数用途以外では不要
+    c.execute("DROP INDEX IF EXISTS idx_kari_messages_pair")
+
+# 🕒 v6: 会話ごとの最新メッセージID（自動更新時の「新着あり？」判定用）
+def _add_conversation_watermark(c):
+    _add_column(c, "conversations", "last_message_id", "INTEGER DEFAULT 0")
+    for space, table in (("chat", "chat_messages"), ("kari", "kari_messages")):
+        c.execute(f'''UPDATE conversations SET last_message_id = COALESCE(
+                          (SELECT MAX(id) FROM {table} WHERE conversation_id=conversations.id), 0)
+                      WHERE space=?''', (space,))
+
+# 👍 v7: メッセージごとのリアクション数（message_reactions の変更をトリガーで反映）
+def _add_reaction_counts(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS message_reaction_counts (
+        message_id INTEGER,
+        reaction TEXT,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (message_id, reaction)
+    )''')
+    c.execute("DELETE FROM message_reaction_counts")
+    c.execute('''INSERT INTO message_reaction_counts (message_id, reaction, count)
+                 SELECT message_id, reaction, COUNT(*) FROM message_reactions GROUP BY message_id, reaction''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_message_reactions_insert AFTER INSERT ON message_reactions
+                 BEGIN
+                     INSERT INTO message_reaction_counts (message_id, reaction, count)
+                     VALUES (NEW.message_id, NEW.reaction, 1)
+                     ON CONFLICT (message_id, reaction) DO UPDATE SET count = count + 1;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_message_reactions_delete AFTER DELETE ON message_reactions
+                 BEGIN
+                     UPDATE message_reaction_counts SET count = count - 1
+                     WHERE message_id=OLD.message_id AND reaction=OLD.reaction;
+                     DELETE FROM message_reaction_counts
+                     WHERE message_id=OLD.message_id AND reaction=OLD.reaction AND count <= 0;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_message_reactions_update AFTER UPDATE OF reaction ON message_reactions
+                 WHEN OLD.reaction IS NOT NEW.reaction
+                 BEGIN
+                     UPDATE message_reaction_counts SET count = count - 1
+                     WHERE message_id=OLD.message_id AND reaction=OLD.reaction;
+                     DELETE FROM message_reaction_counts
+                     WHERE message_id=OLD.message_id AND reaction=OLD.reaction AND count <= 0;
+                     INSERT INTO message_reaction_counts (message_id, reaction, count)
+                     VALUES (NEW.message_id, NEW.reaction, 1)
+                     ON CONFLICT (message_id, reaction) DO UPDATE SET count = count + 1;
+                 END''')
+    # 集計は message_reaction_counts で引くので、集計用の索引は不要
+    c.execute("DROP INDEX IF EXISTS idx_message_reactions_message")
+
+# 📩 v8: 既読位置（ユーザー×会話ごとの last_read_id）
+# 行ごとの is_read 更新をやめ、未読数は「既読位置より新しい受信メッセージ数」で数える
+def _add_read_markers(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS read_markers (
+        user TEXT,
+        conversation_id INTEGER,
+        last_read_id INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user, conversation_id)
+    ) WITHOUT ROWID''')
+    # 既読済みの受信メッセージと、自分が送ったメッセージまでは読んだものとみなす
+    c.execute('''INSERT INTO read_markers (user, conversation_id, last_read_id)
+                 SELECT receiver, conversation_id, MAX(id) FROM chat_messages
+                 WHERE is_read=1 GROUP BY receiver, conversation_id
+                 ON CONFLICT (user, conversation_id) DO UPDATE
+                 SET last_read_id=MAX(last_read_id, excluded.last_read_id)''')
+    c.execute('''INSERT INTO read_markers (user, conversation_id, last_read_id)
+                 SELECT sender, conversation_id, MAX(id) FROM chat_messages
+                 WHERE true GROUP BY sender, conversation_id
+                 ON CONFLICT (user, conversation_id) DO UPDATE
+                 SET last_read_id=MAX(last_read_id, excluded.last_read_id)''')
+    # 未読数：conversation_id=? AND receiver=? AND id>? を索引だけで数える
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_unread ON chat_messages (conversation_id, receiver, id)")
+    # 相手側（user_b）からも自分の会話一覧を引けるように
+    c.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_b ON conversations (space, user_b)")
+    c.execute("DROP INDEX IF EXISTS idx_chat_messages_pair")
+
+# 🕰 v9: 時刻を UTC エポック秒（ts_epoch）でも保持する
+# 既存の TEXT は、書いたモジュールの時刻系で解釈する
+#   "jst":   utils.now_str（chat / chatkai / board / karitunagari / feedback）は JST で書いていた
+#   "local": chatkai2 の旧 now_str は datetime.now()（サーバーのローカル時刻）。feedback 表は chatkai2 だけが書いていた
+# chat_messages は chat と chatkai2 の両方が書いていて行ごとに区別できないので JST とみなす（ずれうる場合は警告を残す）
+EPOCH_COLUMNS = (
+    ("chat_messages", "timestamp", "jst"),
+    ("kari_messages", "timestamp", "jst"),
+    ("board_messages", "timestamp", "jst"),
+    ("threads", "created_at", "jst"),
+    ("chat_feedback", "timestamp", "jst"),
+    ("feedback", "timestamp", "local"),
+)
+
+# chatkai2 が動いていたサーバーの UTC オフセット（秒）
+# 既定は移行を実行するサーバーのローカル時刻。別のサーバーで移行するときは MEBIUS_LEGACY_UTC_OFFSET_HOURS で指定する
+def _legacy_local_offset():
+    hours = os.getenv("MEBIUS_LEGACY_UTC_OFFSET_HOURS")
+    return round(float(hours) * 3600) if hours else time.localtime().tm_gmtoff
+
+def _add_epoch_timestamps(c):
+    offsets = {"jst": JST_OFFSET, "local": _legacy_local_offset()}
+    for table, text_column, origin in EPOCH_COLUMNS:
+        _add_column(c, table, "ts_epoch", "INTEGER")
+        c.execute(f'''UPDATE {table} SET ts_epoch = CAST(strftime('%s', {text_column}, ?) AS INTEGER)
+                      WHERE ts_epoch IS NULL''', (f"{-offsets[origin]} seconds",))
+    # 移行前の発言があり、サーバーが JST でないときだけ、chatkai2 が書いた行のずれを知らせる
+    if offsets["local"] != JST_OFFSET and c.execute("SELECT 1 FROM chat_messages LIMIT 1").fetchone():
+        logger.warning("v9: chat_messages の既存時刻を JST として変換します。"
+                       "chatkai2 が書いた行はローカル時刻（UTC%+.1f）なので %.1f 時間ずれます",
+                       offsets["local"] / 3600, (JST_OFFSET - offsets["local"]) / 3600)
+    # 期間指定の集計（会話内の時間範囲）用
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_conversation_time ON chat_messages (conversation_id, ts_epoch)")
+    # フィードバック履歴は新しい順に並べる
+    c.execute("DROP INDEX IF EXISTS idx_chat_feedback_pair")
+    c.execute("DROP INDEX IF EXISTS idx_feedback_pair")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_feedback_pair ON chat_feedback (sender, receiver, ts_epoch)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_feedback_pair ON feedback (sender, receiver, ts_epoch)")
+
+# 🔍 v10: 掲示板の全文検索（FTS5 trigram。日本語も分かち書き不要で部分一致できる）
+# 外部コンテンツ方式：本文は threads / board_messages にだけ持ち、索引はトリガーで同期する
+def _add_board_search(c):
+    for fts, table, column in (("threads_fts", "threads", "title"),
+                               ("board_messages_fts", "board_messages", "message")):
+        c.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            {column}, content='{table}', content_rowid='id', tokenize='trigram'
+        )''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_insert AFTER INSERT ON {table}
+                      BEGIN
+                          INSERT INTO {fts} (rowid, {column}) VALUES (NEW.id, NEW.{column});
+                      END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_delete AFTER DELETE ON {table}
+                      BEGIN
+                          INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', OLD.id, OLD.{column});
+                      END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_update AFTER UPDATE OF {column} ON {table}
+                      BEGIN
+                          INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', OLD.id, OLD.{column});
+                          INSERT INTO {fts} (rowid, {column}) VALUES (NEW.id, NEW.{column});
+                      END''')
+        c.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+# 🧵 v11: スレッドごとの集計（投稿数・最終投稿時刻・最終投稿者）
+# 一覧の表示と「最近の動き順」の並べ替えを board_messages を走査せずに行う
+# 投稿の無いスレッドは作成時刻を last_post_at とする
+def _add_thread_summaries(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS thread_summaries (
+        thread_id INTEGER PRIMARY KEY,
+        message_count INTEGER NOT NULL DEFAULT 0,
+        last_post_at INTEGER,
+        last_poster TEXT
+    )''')
+    c.execute('''INSERT OR REPLACE INTO thread_summaries (thread_id, message_count, last_post_at, last_poster)
+                 SELECT t.id,
+                        (SELECT COUNT(*) FROM board_messages b WHERE b.thread_id=t.id),
+                        COALESCE((SELECT b.ts_epoch FROM board_messages b WHERE b.thread_id=t.id ORDER BY b.id DESC LIMIT 1),
+                                 t.ts_epoch, 0),
+                        (SELECT b.username FROM board_messages b WHERE b.thread_id=t.id ORDER BY b.id DESC LIMIT 1)
+                 FROM threads t''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_thread_summaries_recent ON thread_summaries (last_post_at, thread_id)")
+
+# 定数（v12・v14 を書いた時点のキーワードと度数分布の区間。後でアプリ側が変わっても、古い移行の結果は変えない）
+_V12_EMOTION_WORDS = ("嬉しい", "楽しい", "悲しい", "不安", "安心", "つらい", "好き", "嫌い")
+_V12_DISCLOSURE_WORDS = ("私", "自分", "最近", "悩み", "好き", "嫌い", "思う", "考える")
+_V14_GAP_BINS_PER_OCTAVE = 4
+
+def _contains_any(column, words):
+    return "(" + " OR ".join(f"instr({column}, '{word}') > 0" for word in words) + ")"
+
+# 💬 v12・v14 の埋め戻し用：1対1チャットの全発言と、同じ会話の直前の発言者・時刻・問い・感情語・自己開示語
+_V12_MESSAGES = f'''
+    SELECT m.conversation_id, m.id, m.sender, m.ts_epoch,
+           ROW_NUMBER() OVER w AS rn, COUNT(*) OVER (PARTITION BY m.conversation_id) AS n,
+           LAG(m.sender) OVER w AS prev_sender, LAG(m.ts_epoch) OVER w AS prev_ts,
+           COALESCE(instr(m.message, '?') > 0, 0) AS question,
+           COALESCE({_contains_any("m.message", _V12_EMOTION_WORDS)}, 0) AS emotion,
+           COALESCE({_contains_any("m.message", _V12_DISCLOSURE_WORDS)}, 0) AS disclosure
+    FROM chat_messages m JOIN conversations cv ON cv.id = m.conversation_id AND cv.space = 'chat'
+    WINDOW w AS (PARTITION BY m.conversation_id ORDER BY m.id)'''
+
+# 📊 v12: 会話ごとの集計（フィードバック欄を履歴の走査なしで表示する）
+# 会話全体の値と、発言者ごとの値に分ける。保存時に chatstore.update_aggregates で更新する
+# 既存の履歴はここで SQL だけで埋める（アプリのコードは呼ばない）
+def _add_conversation_aggregates(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS conversation_aggregates (
+        conversation_id INTEGER PRIMARY KEY,
+        message_count INTEGER NOT NULL DEFAULT 0,
+        switch_count INTEGER NOT NULL DEFAULT 0,
+        gap_sum INTEGER NOT NULL DEFAULT 0,
+        first_ts INTEGER,
+        last_ts INTEGER,
+        last_sender TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS conversation_sender_aggregates (
+        conversation_id INTEGER,
+        sender TEXT,
+        message_count INTEGER NOT NULL DEFAULT 0,
+        question_count INTEGER NOT NULL DEFAULT 0,
+        emotion_count INTEGER NOT NULL DEFAULT 0,
+        disclosure_count INTEGER NOT NULL DEFAULT 0,
+        response_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (conversation_id, sender)
+    ) WITHOUT ROWID''')
+    c.execute(f'''WITH m AS ({_V12_MESSAGES}),
+                      s AS (SELECT *, rn > 1 AND prev_sender IS NOT sender AS switched,
+                                   CASE WHEN rn > 1 AND ts_epoch IS NOT NULL AND prev_ts IS NOT NULL
+                                        THEN ts_epoch - prev_ts ELSE 0 END AS gap
+                            FROM m)
+                  INSERT INTO conversation_aggregates
+                      (conversation_id, message_count, switch_count, gap_sum, first_ts, last_ts, last_sender)
+                  SELECT conversation_id, COUNT(*), SUM(switched), SUM(gap),
+                         MAX(CASE WHEN rn = 1 THEN ts_epoch END), MAX(CASE WHEN rn = n THEN ts_epoch END),
+                         MAX(CASE WHEN rn = n THEN sender END)
+                  FROM s GROUP BY conversation_id''')
+    c.execute(f'''WITH m AS ({_V12_MESSAGES})
+                  INSERT INTO conversation_sender_aggregates
+                      (conversation_id, sender, message_count, question_count, emotion_count, disclosure_count,
+                       response_count)
+                  SELECT conversation_id, sender, COUNT(*), SUM(question), SUM(emotion), SUM(disclosure),
+                         SUM(rn > 1 AND prev_sender IS NOT sender)
+                  FROM m GROUP BY conversation_id, sender''')
+
+# 📋 v13: AIフィードバック欄の計算結果（feedbackbatch が一括で書き、UI はそのまま読む）
+# last_message_id は計算時点の会話の最新メッセージID。これが進んでいなければ結果は使える
+def _add_feedback_reports(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS feedback_reports (
+        conversation_id INTEGER,
+        sender TEXT,
+        last_message_id INTEGER NOT NULL,
+        report TEXT NOT NULL,
+        computed_at INTEGER,
+        PRIMARY KEY (conversation_id, sender)
+    ) WITHOUT ROWID''')
+
+# 📐 v14 の間隔の区間番号（対数目盛。2倍ごとに _V14_GAP_BINS_PER_OCTAVE 区間）
+def _v14_gap_bin(gap):
+    return int(_V14_GAP_BINS_PER_OCTAVE * math.log2(max(gap, 0) + 1))
+
+# 📈 v14: 会話の日・週ごとの推移（件数・問い・感情語・間隔の度数分布）
+# 関係性の変化を期間で区切って見るときは、この2表の範囲検索だけで済ませる
+# 既存の履歴はここで埋める（期間の区切りは JST の日・月曜始まりの週。アプリのコードは呼ばない）
+def _add_conversation_rollups(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS conversation_rollups (
+        conversation_id INTEGER,
+        period TEXT,
+        bucket_start INTEGER,
+        sender TEXT,
+        message_count INTEGER NOT NULL DEFAULT 0,
+        question_count INTEGER NOT NULL DEFAULT 0,
+        emotion_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (conversation_id, period, bucket_start, sender)
+    ) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS conversation_rollup_gaps (
+        conversation_id INTEGER,
+        period TEXT,
+        bucket_start INTEGER,
+        sender TEXT,
+        gap_bin INTEGER,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (conversation_id, period, bucket_start, sender, gap_bin)
+    ) WITHOUT ROWID''')
+    c.connection.create_function("v14_gap_bin", 1, _v14_gap_bin, deterministic=True)
+    buckets = f'''
+        SELECT m.*, 'day' AS period, (ts_epoch + 32400) / 86400 * 86400 - 32400 AS bucket_start FROM ({_V12_MESSAGES}) m
+        WHERE ts_epoch IS NOT NULL
+        UNION ALL
+        SELECT m.*, 'week', ((ts_epoch + 32400) / 86400 - ((ts_epoch + 32400) / 86400 + 3) % 7) * 86400 - 32400
+        FROM ({_V12_MESSAGES}) m WHERE ts_epoch IS NOT NULL'''
+    c.execute(f'''INSERT INTO conversation_rollups
+                      (conversation_id, period, bucket_start, sender, message_count, question_count, emotion_count)
+                  SELECT conversation_id, period, bucket_start, sender, COUNT(*), SUM(question), SUM(emotion)
+                  FROM ({buckets}) GROUP BY conversation_id, period, bucket_start, sender''')
+    c.execute(f'''INSERT INTO conversation_rollup_gaps (conversation_id, period, bucket_start, sender, gap_bin, count)
+                  SELECT conversation_id, period, bucket_start, sender, v14_gap_bin(ts_epoch - prev_ts), COUNT(*)
+                  FROM ({buckets}) WHERE rn > 1 AND prev_ts IS NOT NULL
+                  GROUP BY conversation_id, period, bucket_start, sender, v14_gap_bin(ts_epoch - prev_ts)''')
+
+# 🔢 v15: 発言者ごとの語彙の HyperLogLog スケッチ（last_message_id まで取り込み済み）
+# 語彙の多様性は、これに新着分だけ足して数える
+def _add_vocab_sketches(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS vocab_sketches (
+        conversation_id INTEGER,
+        sender TEXT,
+        last_message_id INTEGER NOT NULL DEFAULT 0,
+        registers BLOB NOT NULL,
+        PRIMARY KEY (conversation_id, sender)
+    ) WITHOUT ROWID''')
+
+# 🤖 v16: AI応答のジョブキュー（queued → running → done / failed）
+# 画面はジョブを積むだけで、応答の生成と保存はワーカー（modules.aiworker）が受け持つ
+# 同じ利用者・相手の未着手ジョブは1件に限る（続けて送っても応答は最新の文脈で1回だけ作る）
+def _add_ai_jobs(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS ai_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user TEXT NOT NULL,
+        partner TEXT NOT NULL,
+        style TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        reply_message_id INTEGER,
+        created_at INTEGER,
+        started_at INTEGER,
+        finished_at INTEGER
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ai_jobs_status ON ai_jobs(status, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ai_jobs_user ON ai_jobs(user, partner, status)")
+    c.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_ai_jobs_queued
+                 ON ai_jobs(user, partner) WHERE status='queued'""")
+
+# 📡 v17: ストリーミング応答の途中経過と所要時間（最初のトークンまで・全体）
+# 途中の本文はジョブの行に上書きしていき、完了時にメッセージとして1回だけ保存する
+def _add_ai_job_streaming(c):
+    _add_column(c, "ai_jobs", "partial_reply", "TEXT")
+    _add_column(c, "ai_jobs", "first_token_ms", "INTEGER")
+    _add_column(c, "ai_jobs", "duration_ms", "INTEGER")
+
+# 🗃 v18: AI応答の永続キャッシュ（キーはモデル・システムプロンプト・正規化した文脈のハッシュ）
+# 古いもの（created_at）は TTL で、数が多すぎれば最後に使われた時刻（last_hit_at）の古い順に消す
+def _add_ai_response_cache(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS ai_response_cache (
+        key TEXT PRIMARY KEY,
+        model TEXT,
+        reply TEXT NOT NULL,
+        latency_ms INTEGER,
+        hits INTEGER NOT NULL DEFAULT 0,
+        created_at INTEGER,
+        last_hit_at INTEGER
+    ) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ai_response_cache_last_hit ON ai_response_cache(last_hit_at)")
+
+# 🧺 v19: AIに渡す文脈の要約（会話ごと。last_message_id までの発言を畳み込み済み）
+def _add_ai_context_summaries(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS ai_context_summaries (
+        conversation_id INTEGER PRIMARY KEY,
+        summary TEXT NOT NULL,
+        last_message_id INTEGER NOT NULL DEFAULT 0,
+        updated_at INTEGER
+    )''')
+
+# 📟 v20: モデル呼び出しの記録（1呼び出し1行。費用は呼び出し時点の料金表で計算して残す）
+def _add_ai_calls(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS ai_calls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        user TEXT,
+        purpose TEXT,
+        model TEXT,
+        outcome TEXT NOT NULL,
+        error_type TEXT,
+        retries INTEGER NOT NULL DEFAULT 0,
+        latency_ms INTEGER,
+        ttft_ms INTEGER,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        cost_usd REAL
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ai_calls_ts ON ai_calls(ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ai_calls_user_day ON ai_calls(user, day)")
+
+# 📈 v21: 会話全体の推移（period='all', bucket_start=0）。既存の会話は週ごとの行を合算して作る
+# 間隔の中央値を、履歴を読まずに度数分布1つから求めるため
+def _add_whole_conversation_rollups(c):
+    c.execute('''INSERT OR REPLACE INTO conversation_rollups
+                     (conversation_id, period, bucket_start, sender, message_count, question_count, emotion_count)
+                 SELECT conversation_id, 'all', 0, sender, SUM(message_count), SUM(question_count), SUM(emotion_count)
+                 FROM conversation_rollups WHERE period='week'
+                 GROUP BY conversation_id, sender''')
+    c.execute('''INSERT OR REPLACE INTO conversation_rollup_gaps (conversation_id, period, bucket_start, sender, gap_bin, count)
+                 SELECT conversation_id, 'all', 0, sender, gap_bin, SUM(count)
+                 FROM conversation_rollup_gaps WHERE period='week'
+                 GROUP BY conversation_id, sender, gap_bin''')
+
+# ✂️ v22 の分かち書き（この時点の MeCab の設定。アプリ側の tokenizer が変わってもこの移行の結果は変えない）
+def _v22_wakati():
+    import MeCab
+    import unidic_lite
+
+    tagger = MeCab.Tagger(f"-d {unidic_lite.DICDIR} -Owakati")
+    return lambda text: " ".join(tagger.parse(text or "").split())
+
+# 🔍 v22: 掲示板の単語索引（MeCab で分かち書きした本文を unicode61 で引く）
+# trigram 索引では引けない1〜2文字の語も bm25 で順位付けして探せるようにする。以後は board.py が書き込み時に更新する
+def _add_board_word_index(c):
+    c.connection.create_function("v22_wakati", 1, _v22_wakati(), deterministic=True)
+    for fts, table, column in (("threads_words", "threads", "title"),
+                               ("board_messages_words", "board_messages", "message")):
+        c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(words, tokenize='unicode61 remove_diacritics 0')")
+        c.execute(f"INSERT INTO {fts} (rowid, words) SELECT id, v22_wakati({column}) FROM {table}")
+
+# 定数（バージョン, 説明, 適用関数）。追加は末尾に限る
+MIGRATIONS = [
+    (1, "base tables", _create_base_tables),
+    (2, "reconcile friends", _reconcile_friends),
+    (3, "reconcile user_profiles", _reconcile_user_profiles),
+    (4, "indexes for hot lookups", _create_indexes),
+    (5, "conversation ids", _add_conversation_ids),
+    (6, "conversation watermark", _add_conversation_watermark),
+    (7, "reaction counts", _add_reaction_counts),
+    (8, "read markers", _add_read_markers),
+    (9, "epoch timestamps", _add_epoch_timestamps),
+    (10, "board full-text search", _add_board_search),
+    (11, "thread summaries", _add_thread_summaries),
+    (12, "conversation aggregates", _add_conversation_aggregates),
+    (13, "feedback reports", _add_feedback_reports),
+    (14, "conversation rollups", _add_conversation_rollups),
+    (15, "vocabulary sketches", _add_vocab_sketches),
+    (16, "ai jobs", _add_ai_jobs),
+    (17, "ai job streaming", _add_ai_job_streaming),
+    (18, "ai response cache", _add_ai_response_cache),
+    (19, "ai context summaries", _add_ai_context_summaries),
+    (20, "ai calls", _add_ai_calls),
+    (21, "whole-conversation rollups", _add_whole_conversation_rollups),
+    (22, "board word index", _add_board_word_index),
+]
+
+_migrated = False
+_lock = threading.Lock()
+
+# 🔧 補助
+def _columns(c, table):
+    c.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in c.fetchall()]
+
+def _add_column(c, table, column, decl):
+    if column not in _columns(c, table):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def current_version():
+    db.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT,
+        applied_at TEXT
+    )''')
+    row = db.query_one("SELECT MAX(version) FROM schema_version")
+    return row[0] or 0
+
+# 🚚 未適用のマイグレーションを順に適用（1件ごとに1トランザクション）
+def migrate():
+    applied = []
+    version = current_version()
+    for number, name, apply in MIGRATIONS:
+        if number <= version:
+            continue
+        with db.transaction() as c:
+            # 別プロセスが先に適用していないか、書き込みロック取得後に確認
+            c.execute("SELECT 1 FROM schema_version WHERE version=?", (number,))
+            if c.fetchone():
+                continue
+            apply(c)
+            c.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                      (number, name, now_str()))
+        applied.append(number)
+    return applied
+
+# 🚀 プロセス起動時に1回だけ実行（再描画のたびには走らせない）
+def ensure_schema():
+    global _migrated
+    if _migrated:
+        return
+    with _lock:
+        if not _migrated:
+            migrate()
+            _migrated = True
+
+if __name__ == "__main__":
+    print(f"applied: {migrate()} (schema version {current_version()})")
@@ -1,55 +1,26 @@
 import streamlit as st
-import sqlite3
+from modules import db
+from modules.migrations import ensure_schema
 from modules.user import get_current_user
 from modules.utils import now_str
 
-DB_PATH = "db/mebius.db"
-
 # ----------------------
 # DB操作
 # ----------------------
 def init_profile_db():
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS user_profiles (
-            username TEXT PRIMARY KEY,
-            profile_text TEXT,
-            updated_at TEXT
-        )''')
-        conn.commit()
-    finally:
-        conn.close()
+    ensure_schema()
 
 def save_profile(username, text):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute("REPLACE INTO user_profiles (username, profile_text, updated_at) VALUES (?, ?, ?)",
-                  (username, text, now_str()))
-        conn.commit()
-    finally:
-        conn.close()
+    db.execute("REPLACE INTO user_profiles (username, profile_text, updated_at) VALUES (?, ?, ?)",
+               (username, text, now_str()))
 
 def load_profile(username):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute("SELECT profile_text, updated_at FROM user_profiles WHERE username=?", (username,))
-        result = c.fetchone()
-        return result if result else ("", "")
-    finally:
-        conn.close()
+    result = db.query_one("SELECT profile_text, updated_at FROM user_profiles WHERE username=?", (username,))
+    return result if result else ("", "")
 
 def list_users():
     """登録されているユーザー名一覧を取得"""
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute("SELECT username FROM user_profiles ORDER BY username")
-        return [row[0] for row in c.fetchall()]
-    finally:
-        conn.close()
+    return [row[0] for row in db.query("SELECT username FROM user_profiles ORDER BY username")]
 
 # ----------------------
 # UI表示
@@ -0,0 +1,56 @@
+# tokenizer.py（MeCabによる日本語の分かち書き。Tagger の使い回しとトークンのキャッシュ）
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import MeCab
+import unidic_lite
+
+# 定数（設計意図の明示）
+TAGGER_ARGS = f"-d {unidic_lite.DICDIR} -Owakati"
+TAGGER_POOL_SIZE = 4          # 保持する Tagger の上限（辞書の読み込みはプロセス内でこの回数まで）
+TOKEN_CACHE_SIZE = 20000      # トークン列を覚えておくメッセージ数
+
+# Tagger は同時に複数スレッドから使えないので、1スレッド1個ずつ貸し出す
+_taggers = queue.LifoQueue(maxsize=TAGGER_POOL_SIZE)
+_token_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+# ♻️ Tagger の貸し出し（空なら新しく作り、返すときに上限を超えた分は捨てる）
+@contextmanager
+def tagger():
+    try:
+        t = _taggers.get_nowait()
+    except queue.Empty:
+        t = MeCab.Tagger(TAGGER_ARGS)
+    try:
+        yield t
+    finally:
+        try:
+            _taggers.put_nowait(t)
+        except queue.Full:
+            pass
+
+
+# ✂️ 分かち書き
+def tokenize(text):
+    with tagger() as t:
+        return t.parse(text).strip().split()
+
+
+# ✂️ メッセージIDつきの分かち書き（一度解析したメッセージは解析し直さない）
+# chat_messages は追記のみ（本文の編集・削除が無い）なので、メッセージIDが同じならトークン列も変わらない
+def tokenize_message(message_id, text):
+    with _cache_lock:
+        tokens = _token_cache.get(message_id)
+        if tokens is not None:
+            _token_cache.move_to_end(message_id)
+            return tokens
+    tokens = tuple(tokenize(text))
+    with _cache_lock:
+        _token_cache[message_id] = tokens
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return tokens
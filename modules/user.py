@@ -1,27 +1,16 @@
 import streamlit as st
 import sqlite3
 import bcrypt
+from modules import db
+from modules.migrations import ensure_schema
 from modules.utils import now_str
 
-DB_PATH = "db/mebius.db"
 USERS_TABLE = "users"
 FRIENDS_TABLE = "friends"
 
-# 🧱 DB初期化（usersテーブル）
+# 🧱 DB初期化（スキーマは migrations で一元管理）
 def init_user_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(f'''
-        CREATE TABLE IF NOT EXISTS {USERS_TABLE} (
-            username TEXT PRIMARY KEY,
-            password TEXT,
-            display_name TEXT,
-            kari_id TEXT,
-            registered_at TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    ensure_schema()
 
 # 🆕 ユーザー登録
 def register_user(username, password, display_name="", kari_id=""):
@@ -31,28 +20,17 @@ def register_user(username, password, display_name="", kari_id=""):
         return "ユーザー名とパスワードを入力してください"
 
     hashed_pw = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
-    conn = sqlite3.connect(DB_PATH)
     try:
-        c = conn.cursor()
-        c.execute(f'''INSERT INTO {USERS_TABLE} (username, password, display_name, kari_id, registered_at)
+        db.execute(f'''INSERT INTO {USERS_TABLE} (username, password, display_name, kari_id, registered_at)
                       VALUES (?, ?, ?, ?, ?)''',
-                  (username, hashed_pw, display_name, kari_id, now_str()))
-        conn.commit()
+                   (username, hashed_pw, display_name, kari_id, now_str()))
         return "OK"
     except sqlite3.IntegrityError:
         return "このユーザー名は既に使われています"
-    finally:
-        conn.close()
 
 # 🔐 ログイン
 def login_user(username, password):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute(f"SELECT password FROM {USERS_TABLE} WHERE username=?", (username,))
-        result = c.fetchone()
-    finally:
-        conn.close()
+    result = db.query_one(f"SELECT password FROM {USERS_TABLE} WHERE username=?", (username,))
     if result and bcrypt.checkpw(password.encode("utf-8"), result[0]):
         st.session_state.username = username
         return True
@@ -60,25 +38,13 @@ def login_user(username, password):
 
 # 🧠 表示名取得
 def get_display_name(username):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute(f"SELECT display_name FROM {USERS_TABLE} WHERE username=?", (username,))
-        result = c.fetchone()
-        return result[0] if result and result[0] else username
-    finally:
-        conn.close()
+    result = db.query_one(f"SELECT display_name FROM {USERS_TABLE} WHERE username=?", (username,))
+    return result[0] if result and result[0] else username
 
 # 🕶️ 仮ID取得
 def get_kari_id(username):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute(f"SELECT kari_id FROM {USERS_TABLE} WHERE username=?", (username,))
-        result = c.fetchone()
-        return result[0] if result and result[0] else username
-    finally:
-        conn.close()
+    result = db.query_one(f"SELECT kari_id FROM {USERS_TABLE} WHERE username=?", (username,))
+    return result[0] if result and result[0] else username
 
 # 🧭 現在ログイン中のユーザー名
 def get_current_user():
@@ -86,49 +52,20 @@ def get_current_user():
 
 # 表示名の更新
 def update_display_name(username, new_name):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute(f"UPDATE {USERS_TABLE} SET display_name=? WHERE username=?", (new_name.strip(), username))
-        conn.commit()
-    finally:
-        conn.close()
+    db.execute(f"UPDATE {USERS_TABLE} SET display_name=? WHERE username=?", (new_name.strip(), username))
 
 # 仮IDの更新
 def update_kari_id(username, new_kari_id):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute(f"UPDATE {USERS_TABLE} SET kari_id=? WHERE username=?", (new_kari_id.strip(), username))
-        conn.commit()
-    finally:
-        conn.close()
+    db.execute(f"UPDATE {USERS_TABLE} SET kari_id=? WHERE username=?", (new_kari_id.strip(), username))
 
 # 友達追加
 def add_friend(username, friend_username):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute(f'''CREATE TABLE IF NOT EXISTS {FRIENDS_TABLE} (
-            owner TEXT,
-            friend TEXT,
-            added_at TEXT
-        )''')
-        c.execute(f"INSERT INTO {FRIENDS_TABLE} (owner, friend, added_at) VALUES (?, ?, ?)",
-                  (username, friend_username, now_str()))
-        conn.commit()
-    finally:
-        conn.close()
+    db.execute(f"INSERT OR IGNORE INTO {FRIENDS_TABLE} (user, friend, added_at) VALUES (?, ?, ?)",
+               (username, friend_username, now_str()))
 
 # 友達一覧取得
 def get_friends(username):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute(f"SELECT friend FROM {FRIENDS_TABLE} WHERE owner=?", (username,))
-        return [row[0] for row in c.fetchall()]
-    finally:
-        conn.close()
+    return [row[0] for row in db.query(f"SELECT friend FROM {FRIENDS_TABLE} WHERE user=?", (username,))]
 
 # 🔓 ログアウト
 def logout():
@@ -136,29 +73,17 @@ def logout():
 
 # 🔍 全ユーザー取得（プロフィール・チャット共通）
 def get_all_users():
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute(f"SELECT username FROM {USERS_TABLE} ORDER BY username")
-        return [row[0] for row in c.fetchall()]
-    finally:
-        conn.close()
+    return [row[0] for row in db.query(f"SELECT username FROM {USERS_TABLE} ORDER BY username")]
 
 # 🧾 プロフィール情報取得（必要に応じて拡張）
 def get_profile_data(username):
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        c = conn.cursor()
-        c.execute(f"SELECT display_name, kari_id FROM {USERS_TABLE} WHERE username=?", (username,))
-        row = c.fetchone()
-        return {
-            "name": username,
-            "display_name": row[0] if row else username,
-            "kari_id": row[1] if row else "",
-            "bio": "",  # 必要に応じて追加
-            "followers": 0,
-            "following": 0,
-            "image": None
-        }
-    finally:
-        conn.close()
\ No newline at end of file
+    row = db.query_one(f"SELECT display_name, kari_id FROM {USERS_TABLE} WHERE username=?", (username,))
+    return {
+        "name": username,
+        "display_name": row[0] if row else username,
+        "kari_id": row[1] if row else "",
+        "bio": "",  # 必要に応じて追加
+        "followers": 0,
+        "following": 0,
+        "image": None
+    }
\ No newline at end of file
@@ -1,18 +1,45 @@
 import re
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+# 定数（時刻は UTC エポック秒で保存し、表示時だけ JST に変換する）
+JST = timezone(timedelta(hours=9))
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+JST_OFFSET = 9 * 3600
+DAY = 86400
+
+def now_epoch():
+    # 現在時刻（UTCエポック秒）
+    return int(time.time())
+
+@lru_cache(maxsize=4096)
+def format_jst(epoch):
+    # エポック秒 → JST文字列（表示用。同じ秒は使い回す）
+    if epoch is None:
+        return ""
+    return datetime.fromtimestamp(epoch, JST).strftime(TIME_FORMAT)
 
 def now_str():
     # JSTで現在時刻を文字列で返す
-    jst = datetime.utcnow() + timedelta(hours=9)
-    return jst.strftime("%Y-%m-%d %H:%M:%S")
+    return format_jst(now_epoch())
 
 def to_jst(utc_str):
     # UTC文字列 → JST文字列に変換
-    utc = datetime.strptime(utc_str, "%Y-%m-%d %H:%M:%S")
+    utc = datetime.strptime(utc_str, TIME_FORMAT)
     jst = utc + timedelta(hours=9)
-    return jst.strftime("%Y-%m-%d %H:%M:%S")
+    return jst.strftime(TIME_FORMAT)
 
 def sanitize_message(text: str, max_len: int) -> str:
     text = text.replace("\r", " ").replace("\n", " ")
     text = re.sub(r"\s+", " ", text).strip()
-    return text[:max_len]
\ No newline at end of file
+    return text[:max_len]
+
+def day_start(epoch):
+    # その時刻を含むJSTの日の0時（エポック秒）
+    return (epoch + JST_OFFSET) // DAY * DAY - JST_OFFSET
+
+def week_start(epoch):
+    # その時刻を含むJSTの週（月曜始まり）の0時（エポック秒）。1970-01-01 は木曜
+    days = (epoch + JST_OFFSET) // DAY
+    return (days - (days + 3) % 7) * DAY - JST_OFFSET
\ No newline at end of file